@@ -1,3 +1,22 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Cart, CartItem, CartSnapshot
+
+
+@admin.register(CartSnapshot)
+class CartSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('session_key', 'item_count', 'total_quantity', 'value', 'last_seen_at', 'expired_at', 'end_reason')
+    list_filter = ('expired_at', 'end_reason')
+    search_fields = ('session_key',)
+
+
+class CartItemInline(admin.TabularInline):
+    model = CartItem
+    extra = 0
+
+
+@admin.register(Cart)
+class CartAdmin(admin.ModelAdmin):
+    list_display = ('user', 'promo_code', 'updated_at')
+    search_fields = ('user__username',)
+    inlines = (CartItemInline,)
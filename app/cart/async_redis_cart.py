@@ -0,0 +1,188 @@
+"""redis.asyncio counterpart of ``redis_cart`` for the ASGI cart views.
+
+Keys, scripts, item encoding and parsing are shared with ``redis_cart`` so
+sync and async requests operate on the same carts.
+"""
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import pricing, redis_cart, scripts
+
+redis_client = settings.REDIS_ASYNC_CLIENT
+
+_scripts = {
+    redis_cart.SPLIT: {name: redis_client.register_script(src) for name, src in scripts.SPLIT.items()},
+    redis_cart.COMPACT: {name: redis_client.register_script(src) for name, src in scripts.COMPACT.items()},
+}
+
+
+async def _run(name, session_id, *args):
+    mark_dirty = redis_cart.CART_PERSISTENCE and session_id and name not in redis_cart._NOT_DIRTY
+    scripts_ = _scripts[redis_cart.CART_STORAGE]
+    keys = redis_cart._cart_keys(session_id)
+    with redis_cart._taking_deltas(name, session_id) as pending:
+        deltas = pending.get(session_id)
+        if not deltas and not mark_dirty:
+            return await scripts_[name](
+                keys=keys, args=[redis_cart._ttl_arg(name, session_id), *args], client=redis_client
+            )
+
+        pipe = redis_client.pipeline(transaction=False)
+        if mark_dirty:
+            pipe.exists(*keys[:-1])
+        for product_id, delta in (deltas or {}).items():
+            await scripts_["change_quantity"](
+                keys=keys, args=[redis_cart._ttl_arg("change_quantity", session_id), product_id, delta],
+                client=pipe,
+            )
+        await scripts_[name](keys=keys, args=[redis_cart._ttl_arg(name, session_id), *args], client=pipe)
+        if mark_dirty:
+            redis_cart._queue_dirty(pipe, name, session_id)
+        results = await pipe.execute()
+        index = bool(mark_dirty) + (len(deltas) if deltas else 0)
+        if mark_dirty and not results[0] and name != "clear":
+            await _restore_saved(session_id)
+        if mark_dirty and name in redis_cart._MAY_EMPTY:
+            found = results[index + 1]
+            if index in getattr(pipe, "resent", ()):
+                found = await redis_client.exists(*keys[:-1])
+            if not found:
+                await _mark_emptied(session_id)
+        return results[index]
+
+
+async def _mark_emptied(session_id):
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.sadd(redis_cart.EMPTIED_KEY, session_id)
+    pipe.sadd(redis_cart.DIRTY_KEY, session_id)
+    await pipe.execute()
+
+
+_restore_saved = sync_to_async(redis_cart._restore_saved)
+
+
+async def _read_settled(session_ids, read):
+    buffer = redis_cart._delta_buffer
+    if buffer is None:
+        return await read(), {}
+    return await buffer.aread(session_ids, read)
+
+
+async def add_to_cart(session_id, product_id, quantity, name, price):
+    return await _run(
+        "add_item", session_id, product_id, quantity, redis_cart._encode_item(product_id, name, price)
+    )
+
+
+async def get_cart(session_id):
+    cart_items, _ = await get_cart_with_promo_code(session_id)
+    return cart_items
+
+
+async def get_cart_with_promo_code(session_id):
+    cart_items, promo_code = await _read_settled_cart(session_id)
+    if not cart_items and promo_code is None and await _restore_saved(session_id):
+        cart_items, promo_code = await _read_settled_cart(session_id)
+    return cart_items, promo_code
+
+
+async def _read_settled_cart(session_id):
+    raw, pending = await _read_settled([session_id], lambda: _run("read", session_id))
+    cart_items, promo_code = redis_cart._parse_cart(raw)
+    return redis_cart._apply_pending(cart_items, pending.get(session_id)), promo_code
+
+
+async def get_priced_cart(session_id):
+    cart_items, promo_code, summary = await _read_priced(session_id)
+    if not cart_items and promo_code is None and await _restore_saved(session_id):
+        cart_items, promo_code, summary = await _read_priced(session_id)
+    return cart_items, promo_code, summary
+
+
+async def _read_priced(session_id):
+    nonce = uuid.uuid4().hex
+    scripts_ = _scripts[redis_cart.CART_STORAGE]
+    keys = redis_cart._cart_keys(session_id)
+    raw, pending = await _read_settled(
+        [session_id],
+        lambda: scripts_["read_priced"](keys=keys, args=[redis_cart.CART_TTL, nonce], client=redis_client),
+    )
+    cart_items, promo_code, summary, store = redis_cart._price(raw, pending.get(session_id))
+    if store:
+        await scripts_["store_summary"](
+            keys=keys, args=[redis_cart.CART_TTL, nonce, pricing.dumps(summary)], client=redis_client
+        )
+    return cart_items, promo_code, summary
+
+
+async def get_carts(session_ids, chunk_size=redis_cart.BATCH_CHUNK_SIZE):
+    session_ids = list(session_ids)
+    carts = {}
+    for start in range(0, len(session_ids), chunk_size):
+        chunk = session_ids[start:start + chunk_size]
+        replies, pending = await _read_settled(chunk, lambda: _read_chunk(chunk))
+        for session_id, raw in zip(chunk, replies):
+            cart_items, promo_code = redis_cart._parse_cart(raw)
+            carts[session_id] = {
+                "items": redis_cart._apply_pending(cart_items, pending.get(session_id)),
+                "promo_code": promo_code,
+            }
+    return carts
+
+
+async def _read_chunk(session_ids):
+    read = _scripts[redis_cart.CART_STORAGE]["read"]
+    pipe = redis_client.pipeline(transaction=False)
+    for session_id in session_ids:
+        await read(keys=redis_cart._cart_keys(session_id), args=[redis_cart.CART_TTL], client=pipe)
+    return await pipe.execute()
+
+
+async def remove_cart(session_id, product_id):
+    return await _run("remove_item", session_id, product_id)
+
+
+async def clear_cart(session_id):
+    await _run("clear", session_id)
+
+
+async def _change_quantity(session_id, product_id, delta):
+    if redis_cart._delta_buffer is not None:
+        # Shared with the sync module; flushed by its background thread.
+        redis_cart._delta_buffer.add(session_id, int(product_id), delta)
+    else:
+        await _run("change_quantity", session_id, product_id, delta)
+
+
+async def increment_quantity(session_id, product_id, step=1):
+    await _change_quantity(session_id, product_id, step)
+    return True
+
+
+async def decrement_quantity(session_id, product_id, step=1):
+    await _change_quantity(session_id, product_id, -step)
+    return True
+
+
+async def set_quantity(session_id, product_id, quantity):
+    return bool(await _run("set_quantity", session_id, product_id, quantity))
+
+
+async def set_cart_promo_code(session_id, promo_code):
+    await _run("set_promo_code", session_id, promo_code)
+
+
+async def update_cart_item(session_id, product_id, name, price, quantity):
+    await _run(
+        "update_item", session_id, product_id, quantity, redis_cart._encode_item(product_id, name, price)
+    )
+
+
+async def remove_from_cart(session_id, product_id):
+    return await remove_cart(session_id, product_id)
+
+
+async def reconcile_cart(session_id, removals=(), updates=()):
+    await _run("reconcile", session_id, *redis_cart._reconcile_args(removals, updates))
@@ -0,0 +1,223 @@
+import json
+
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.authentication import CSRFCheck
+
+from . import async_redis_cart, pricing, scanner
+from .serializers import *
+from inventory import product_cache, stock
+
+
+def _csrf_failure(request):
+    """Why CsrfViewMiddleware would reject ``request``, or None."""
+    check = CSRFCheck(lambda request: None)
+    check.process_request(request)
+    return check.process_view(request, None, (), {})
+
+
+class AsyncCartAPIView(View):
+    """Native async counterpart of the DRF cart views.
+
+    Like APIView with SessionAuthentication, it is CSRF exempt for anonymous
+    sessions and enforces CSRF once the session belongs to a signed-in user.
+    Request bodies are validated with the same serializers, which do no I/O.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await request.auser()
+        if user.is_authenticated:
+            reason = _csrf_failure(request)
+            if reason:
+                return JsonResponse({"detail": f"CSRF Failed: {reason}"}, status=403)
+        return await super().dispatch(request, *args, **kwargs)
+
+    def validate(self, request, serializer_class):
+        try:
+            payload = json.loads(request.body or b"{}")
+        except ValueError:
+            return None, JsonResponse({"detail": "JSON parse error."}, status=400)
+        serializer = serializer_class(data=payload)
+        if not serializer.is_valid():
+            return None, JsonResponse(serializer.errors, status=400)
+        return serializer.validated_data, None
+
+
+class AsyncCartView(AsyncCartAPIView):
+    async def get(self, request):
+        session_id = request.session.session_key
+        cart_data, promo_code, summary = await async_redis_cart.get_priced_cart(session_id)
+        return JsonResponse(cart_response(cart_data, promo_code, summary))
+
+    async def delete(self, request):
+        session_id = request.session.session_key
+        await async_redis_cart.clear_cart(session_id)
+        if session_id:
+            await stock.arelease(session_id)
+            await scanner.amark_ended(session_id, scanner.CLEARED)
+        return JsonResponse({"message": "Cart cleared."})
+
+
+class AsyncAddToCartView(AsyncCartAPIView):
+    async def post(self, request):
+        data, error = self.validate(request, AddToCartSerializer)
+        if error:
+            return error
+
+        product = await product_cache.aget_product(data["product_id"])
+        if not product or not product["is_active"]:
+            return JsonResponse({"error": "Product not found."}, status=404)
+
+        if not request.session.session_key:
+            await request.session.acreate()
+        session_id = request.session.session_key
+
+        await async_redis_cart.add_to_cart(
+            session_id,
+            product_id=product["id"],
+            quantity=data["quantity"],
+            name=product["name"],
+            price=product["price"],
+        )
+        return JsonResponse({"message": "Added to cart."})
+
+
+class AsyncRemoveFromCartView(AsyncCartAPIView):
+    async def post(self, request):
+        session_id = request.session.session_key
+
+        data, error = self.validate(request, RemoveFromCartSerializer)
+        if error:
+            return error
+
+        await async_redis_cart.remove_cart(session_id, data["product_id"])
+        return JsonResponse({"message": "Removed from cart."})
+
+
+class AsyncUpdateQuantityView(AsyncCartAPIView):
+    async def post(self, request):
+        session_id = request.session.session_key
+
+        data, error = self.validate(request, UpdateQuantitySerializer)
+        if error:
+            return error
+
+        action = data["action"]
+        if action == "inc":
+            await async_redis_cart.increment_quantity(session_id, data["product_id"])
+        else:
+            await async_redis_cart.decrement_quantity(session_id, data["product_id"])
+
+        return JsonResponse({"message": f"{action} quantity successful"})
+
+
+class AsyncSetQuantityView(AsyncCartAPIView):
+    async def post(self, request):
+        if not request.session.session_key:
+            await request.session.acreate()
+        session_id = request.session.session_key
+
+        data, error = self.validate(request, SetQuantitySerializer)
+        if error:
+            return error
+
+        quantity = data["quantity"]
+        updated = await async_redis_cart.set_quantity(session_id, data["product_id"], quantity)
+
+        if not updated:
+            return JsonResponse({"error": "Product not found in cart."}, status=404)
+
+        return JsonResponse({"message": f"Quantity updated to {quantity}"})
+
+
+class AsyncCartPromoView(AsyncCartAPIView):
+    async def post(self, request):
+        session_id = request.session.session_key
+
+        data, error = self.validate(request, CartPromoSerializer)
+        if error:
+            return error
+
+        await async_redis_cart.set_cart_promo_code(session_id, data["promo_code"])
+        return JsonResponse({"message": "Cart promotion code set."})
+
+
+class AsyncCartCheckoutView(AsyncCartAPIView):
+    async def post(self, request):
+        data = await self.checkout(request)
+        return JsonResponse(CheckoutResponseItemSerializer(data["items"], many=True).data, safe=False)
+
+    async def checkout(self, request):
+        session_id = request.session.session_key
+        cart_items, promo_code = await async_redis_cart.get_cart_with_promo_code(session_id)
+
+        if not cart_items:
+            return {"items": [], "promo_code": None, "summary": pricing.price_cart([]), "reserved_until": None}
+
+        product_ids = [item["product_id"] for item in cart_items]
+        product_map = {
+            pid: product
+            for pid, product in (await product_cache.aget_products(product_ids)).items()
+            if product["is_active"]
+        }
+
+        cleaned_cart = []
+        removals = []
+        updates = []
+
+        for item in cart_items:
+            product_id = item["product_id"]
+            product = product_map.get(product_id)
+
+            if not product:
+                removals.append(product_id)
+                continue
+
+            if item["name"] != product["name"] or float(item["price"]) != float(product["price"]):
+                updates.append((product_id, product["name"], product["price"]))
+                item["name"] = product["name"]
+                item["price"] = float(product["price"])
+
+            item["valid"] = True
+            item["error"] = ""
+            cleaned_cart.append(item)
+
+        if removals or updates:
+            await async_redis_cart.reconcile_cart(session_id, removals=removals, updates=updates)
+
+        reserved_until = None
+        if cleaned_cart:
+            try:
+                reserved_until = await stock.areserve(
+                    session_id, {item["product_id"]: item["quantity"] for item in cleaned_cart}
+                )
+            except stock.InsufficientStock as exc:
+                await stock.arelease(session_id)
+                for item in cleaned_cart:
+                    if item["product_id"] in exc.shortages:
+                        item["valid"] = False
+                        item["error"] = f"Only {exc.shortages[item['product_id']]} left in stock."
+
+        promo_code = promo_code if cleaned_cart else None
+        summary = pricing.price_cart(cleaned_cart, promo_code)
+        return {"items": cleaned_cart, "promo_code": promo_code, "summary": summary, "reserved_until": reserved_until}
+
+
+class AsyncCartCheckoutV2View(AsyncCartCheckoutView):
+    async def post(self, request):
+        return JsonResponse(CheckoutResponseSerializer(await self.checkout(request)).data)
+
+
+class AsyncCartCheckoutCompleteView(AsyncCartAPIView):
+    async def post(self, request):
+        session_id = request.session.session_key
+        if not session_id or not await stock.acommit(session_id):
+            return JsonResponse({"error": "No live stock reservation; check out again."}, status=409)
+        await async_redis_cart.clear_cart(session_id)
+        await scanner.amark_ended(session_id, scanner.CHECKED_OUT)
+        return JsonResponse({"message": "Order placed."})
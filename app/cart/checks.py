@@ -0,0 +1,53 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.core.checks import Error, register
+from redis.crc import key_slot
+
+
+def _slots(keys):
+    return {key_slot(key.encode()) for key in keys}
+
+
+@register()
+def check_cart_key_slots(app_configs, **kwargs):
+    """Keys used together by one script or pipeline must share a Redis Cluster slot."""
+    from . import persistence, redis_cart
+
+    if not getattr(settings, "REDIS_CLUSTER", False):
+        return []
+    if not redis_cart.CART_KEY_HASH_TAGS:
+        return [Error(
+            "REDIS_CLUSTER needs CART_KEY_HASH_TAGS: cart scripts use several keys per cart.",
+            hint="Set CART_KEY_HASH_TAGS = True and run manage.py migrate_cart_keys.",
+            id="cart.E001",
+        )]
+    groups = {
+        "cart": redis_cart._cart_keys("0" * 32),
+        "dirty set": [
+            redis_cart.DIRTY_KEY, persistence.FLUSHING_KEY, redis_cart.EMPTIED_KEY, persistence.EMPTIED_FLUSHING_KEY,
+        ],
+    }
+    return [
+        Error(f"The {name} keys {keys} map to several cluster slots.", id="cart.E002")
+        for name, keys in groups.items()
+        if len(_slots(keys)) > 1
+    ]
+
+
+@register()
+def check_cart_persistence(app_configs, **kwargs):
+    """Merging the anonymous cart on login needs the key the session had before login."""
+    from . import redis_cart
+
+    if not redis_cart.CART_PERSISTENCE:
+        return []
+    store = import_module(settings.SESSION_ENGINE).SessionStore
+    if not hasattr(store, "previous_session_key"):
+        return [Error(
+            f"CART_PERSISTENCE needs a session engine that keeps previous_session_key on cycle_key(); "
+            f"{settings.SESSION_ENGINE} does not.",
+            hint="Use SESSION_ENGINE = 'core.redis_session' or set CART_PERSISTENCE = False.",
+            id="cart.E003",
+        )]
+    return []
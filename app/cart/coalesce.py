@@ -0,0 +1,163 @@
+"""In-process write-behind buffer for cart quantity clicks.
+
+With ``CART_COALESCE_WINDOW_MS`` set, ``redis_cart`` adds +/- clicks here
+instead of sending them to Redis. A background thread hands everything
+collected during one window to the flush callback, which writes every
+net delta of every session in one pipeline. Buffered deltas live in this
+process only: readers in the same process apply them on read, other
+workers see them after the next flush, and a crash loses at most one
+window of clicks.
+
+Deltas being written stay "in flight" until their pipeline returns, and
+every finished write bumps an epoch. ``read``/``aread`` wait until none of
+their sessions has deltas in flight, read Redis, and read again if a
+write started or finished meanwhile: Redis may or may not have applied
+it, so the buffered deltas could be missed or counted twice.
+"""
+import asyncio
+import atexit
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class DeltaBuffer:
+    def __init__(self, window_ms, flush):
+        self.window = window_ms / 1000
+        self._flush = flush
+        self._lock = threading.Lock()
+        self._settled = threading.Condition(self._lock)
+        self._pending = {}  # session_id -> {product_id: net delta}
+        self._in_flight = {}  # write id -> {session_id: {product_id: net delta}}
+        self._write_ids = itertools.count()
+        self._epoch = 0  # finished writes
+        self._thread = None
+        self._pid = None
+        self.buffered = 0
+        self.written = 0
+
+    def add(self, session_id, product_id, delta):
+        with self._lock:
+            self._ensure_worker()
+            deltas = self._pending.setdefault(session_id, {})
+            deltas[product_id] = deltas.get(product_id, 0) + delta
+            self.buffered += 1
+
+    @contextmanager
+    def writing(self, session_ids=None):
+        """Hand the pending deltas of ``session_ids`` (default: all) to the caller to write.
+
+        They stay visible to readers until the block exits, whether the
+        write succeeded or not; failed writes are not re-queued.
+        """
+        with self._lock:
+            if session_ids is None:
+                taken, self._pending = self._pending, {}
+            else:
+                taken = {sid: self._pending.pop(sid) for sid in session_ids if sid in self._pending}
+            taken = {
+                session_id: {pid: delta for pid, delta in deltas.items() if delta}
+                for session_id, deltas in taken.items()
+            }
+            taken = {session_id: deltas for session_id, deltas in taken.items() if deltas}
+            write_id = next(self._write_ids)
+            if taken:
+                self._in_flight[write_id] = taken
+        failed = True
+        try:
+            yield taken
+            failed = False
+        finally:
+            with self._lock:
+                if self._in_flight.pop(write_id, None) is not None:
+                    self._epoch += 1
+                    self._settled.notify_all()
+                if not failed:
+                    self.written += sum(len(deltas) for deltas in taken.values())
+
+    def _busy(self, session_ids):
+        return any(not deltas.keys().isdisjoint(session_ids) for deltas in self._in_flight.values())
+
+    def _pending_since(self, epoch, session_ids):
+        """Pending deltas of ``session_ids``, or None if a write overlapped a read begun at ``epoch``."""
+        with self._lock:
+            if self._epoch != epoch or self._busy(session_ids):
+                return None
+            return {
+                session_id: {pid: delta for pid, delta in self._pending[session_id].items() if delta}
+                for session_id in session_ids
+                if session_id in self._pending
+            }
+
+    def read(self, session_ids, read):
+        """``(read(), {session_id: pending deltas})``, the deltas being exactly those not in the result."""
+        session_ids = set(session_ids)
+        while True:
+            with self._lock:
+                self._settled.wait_for(lambda: not self._busy(session_ids))
+                epoch = self._epoch
+            result = read()
+            deltas = self._pending_since(epoch, session_ids)
+            if deltas is not None:
+                return result, deltas
+
+    async def aread(self, session_ids, read):
+        """``read`` for a coroutine ``read``; polls instead of blocking the event loop."""
+        session_ids = set(session_ids)
+        while True:
+            with self._lock:
+                busy, epoch = self._busy(session_ids), self._epoch
+            if busy:
+                await asyncio.sleep(0.001)
+                continue
+            result = await read()
+            deltas = self._pending_since(epoch, session_ids)
+            if deltas is not None:
+                return result, deltas
+
+    def stats(self):
+        with self._lock:
+            return {
+                "window_ms": self.window * 1000,
+                "buffered": self.buffered,
+                "written": self.written,
+                "pending_sessions": len(self._pending),
+            }
+
+    def _ensure_worker(self):
+        # A forked worker inherits the parent's buffer but not its thread;
+        # it must neither replay the parent's deltas nor go without a flusher.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pending = {}
+            self._in_flight = {}
+            self._thread = threading.Thread(target=self._run, name="cart-coalesce", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.window)
+            self.flush()
+
+    def flush(self):
+        pending = {}
+        try:
+            with self.writing() as pending:
+                if pending:
+                    self._flush(pending)
+        except Exception:
+            # Deltas are not re-queued: part of the pipeline may have been
+            # applied, and replaying it would double count.
+            logger.exception("Dropped %d buffered cart quantity changes", _count(pending))
+            return 0
+        return _count(pending)
+
+
+def _count(pending):
+    return sum(len(deltas) for deltas in pending.values())
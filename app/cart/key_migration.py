@@ -0,0 +1,288 @@
+"""Move carts from plain keys (``cart:<sid>:qty``) to hash-tagged ones (``cart:{<sid>}:qty``).
+
+Run with ``manage.py migrate_cart_keys`` once every worker has
+``CART_KEY_HASH_TAGS`` on. The old keys of a session are read with DUMP,
+which works when they live on other cluster nodes than the new ones, and
+restored by one script in the new slot that refuses if the session has
+any hash-tagged key already: a cart written since the switch, perhaps
+while the page was being read. That cart gets the old one merged in
+instead: quantities are summed, and its own item details and promo code
+win. Either way a marker key in the new slot records what was done, so a
+run that is interrupted before the old keys are deleted can simply be
+started again. Old keys are only deleted once their content is in place;
+the ones a merge could not use (details without a quantity, say) are
+left for inspection. Queued ids in the old dirty set are carried over as
+well.
+"""
+import json
+import time
+
+from . import redis_cart, scripts
+
+SCAN_COUNT = 500
+MARKER_TTL = 7 * 24 * 3600  # longer than any migration run
+
+_SUFFIXES = ("", ":qty", ":details", ":promo_code")
+_CACHE_SUFFIX = ":summary"  # priced from the old cart; dropped, never moved
+_OLD_DIRTY_KEYS = ("carts:dirty", "carts:dirty:flushing")
+_OLD_EMPTIED_KEYS = ("carts:dirty:emptied", "carts:dirty:emptied:flushing")
+
+# KEYS: the new cart keys, then the marker. ARGV: marker TTL, then a
+# (PTTL, DUMP payload) pair per cart key, with an empty payload for a key
+# the old cart does not have. Returns 1 if moved, 0 if moved before, -1 if
+# the new cart already exists.
+_MOVE = """
+local marker = KEYS[#KEYS]
+if redis.call('SISMEMBER', marker, 'moved') == 1 then
+    return 0
+end
+for i = 1, #KEYS - 1 do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        return -1
+    end
+end
+for i = 1, #KEYS - 1 do
+    if ARGV[2 * i + 1] ~= '' then
+        redis.call('RESTORE', KEYS[i], ARGV[2 * i], ARGV[2 * i + 1])
+    end
+end
+redis.call('SADD', marker, 'moved')
+redis.call('EXPIRE', marker, ARGV[1])
+return 1
+"""
+
+# The merge scripts take the layout's cart keys (summary last), then the
+# marker. ARGV: cart TTL, marker TTL, promo code or '', then (product id,
+# quantity, encoded item) triples. Returns 1 if merged, 0 if merged before.
+_MERGED = """
+local marker = KEYS[#KEYS]
+if redis.call('SISMEMBER', marker, 'merged') == 1 then
+    return 0
+end
+"""
+
+_MERGE_DONE = """
+redis.call('DEL', KEYS[#KEYS - 1])
+redis.call('SADD', marker, 'merged')
+redis.call('EXPIRE', marker, ARGV[2])
+return 1
+"""
+
+_MERGE = {
+    redis_cart.SPLIT: _MERGED + """
+for i = 4, #ARGV, 3 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+    redis.call('HSETNX', KEYS[2], ARGV[i], ARGV[i + 2])
+end
+if ARGV[3] ~= '' then
+    redis.call('SET', KEYS[3], ARGV[3], 'NX')
+end
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[1])
+end
+""" + _MERGE_DONE,
+    redis_cart.COMPACT: _MERGED + """
+for i = 4, #ARGV, 3 do
+    local qty = tonumber(ARGV[i + 1])
+    local rest = ARGV[i + 2]
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    if current then
+        local current_qty, current_rest = string.match(current, '^(%-?%d+)|(.*)$')
+        qty = qty + tonumber(current_qty)
+        rest = current_rest
+    end
+    redis.call('HSET', KEYS[1], ARGV[i], qty .. '|' .. rest)
+end
+if ARGV[3] ~= '' then
+    redis.call('HSETNX', KEYS[1], 'promo', ARGV[3])
+end
+redis.call('HSETNX', KEYS[1], 'v', '""" + str(scripts.COMPACT_SCHEMA_VERSION) + """')
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+""" + _MERGE_DONE,
+}
+
+_move = redis_cart.redis_client.register_script(_MOVE)
+_merge = {layout: redis_cart.redis_client.register_script(src) for layout, src in _MERGE.items()}
+
+
+def _split(old_key):
+    """``(session_id, suffix)`` of an untagged cart key, or None for any other key."""
+    if not old_key.startswith("cart:") or old_key.startswith("cart:{"):
+        return None
+    session_id, _, rest = old_key[len("cart:"):].partition(":")
+    suffix = f":{rest}" if rest else ""
+    if not session_id or suffix not in (*_SUFFIXES, _CACHE_SUFFIX):
+        return None
+    return session_id, suffix
+
+
+def _new_key(session_id, suffix):
+    return f"cart:{{{session_id}}}{suffix}"
+
+
+def _old_key(session_id, suffix):
+    return f"cart:{session_id}{suffix}"
+
+
+def _marker_key(session_id):
+    return _new_key(session_id, ":migrated")
+
+
+def iter_old_key_pages(count=SCAN_COUNT):
+    page = []
+    for key in redis_cart.redis_client.scan_iter(match="cart:*", count=count):
+        if _split(key):
+            page.append(key)
+        if len(page) >= count:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def _delete(pipe, keys):
+    # One key per DEL: a cluster pipeline cannot split a multi-key DEL.
+    for key in keys:
+        pipe.delete(key)
+
+
+def migrate_page(old_keys):
+    """Move the carts of ``old_keys``; returns ``(keys moved, carts merged, old keys kept)``.
+
+    All old keys of a session are moved together, whichever of them are
+    on the page; a session with a hash-tagged key already is merged
+    (``merge_carts``).
+    """
+    client = redis_cart.redis_client
+    session_ids = list(dict.fromkeys(_split(key)[0] for key in old_keys))
+    pipe = client.pipeline(transaction=False)
+    for session_id in session_ids:
+        for suffix in _SUFFIXES:
+            pipe.dump(_old_key(session_id, suffix))
+            pipe.pttl(_old_key(session_id, suffix))
+    replies = pipe.execute()
+
+    carts = {}
+    width = 2 * len(_SUFFIXES)
+    for index, session_id in enumerate(session_ids):
+        page = replies[width * index:width * (index + 1)]
+        # RESTORE takes 0 for "no expiry".
+        dumped = [(data, max(ttl, 0)) for data, ttl in zip(page[::2], page[1::2])]
+        if any(data is not None for data, _ in dumped):
+            carts[session_id] = dumped
+
+    pipe = client.pipeline(transaction=False)
+    for session_id, dumped in carts.items():
+        args = [MARKER_TTL]
+        for data, ttl in dumped:
+            args += [ttl, data or ""]
+        _move(keys=[*(_new_key(session_id, suffix) for suffix in _SUFFIXES), _marker_key(session_id)],
+              args=args, client=pipe)
+    results = pipe.execute()
+
+    moved = 0
+    merging = []
+    pipe = client.pipeline(transaction=False)
+    for (session_id, dumped), result in zip(carts.items(), results):
+        if result < 0:
+            merging.append(session_id)
+            continue
+        present = [suffix for suffix, (data, _) in zip(_SUFFIXES, dumped) if data is not None]
+        moved += len(present) if result else 0
+        _delete(pipe, [_old_key(session_id, suffix) for suffix in present])
+    _delete(pipe, [_old_key(session_id, _CACHE_SUFFIX) for session_id in session_ids if session_id not in merging])
+    pipe.execute()
+
+    merged, kept = merge_carts(merging) if merging else (0, 0)
+    return moved, merged, kept
+
+
+def _parse_old_cart(compact, qtys, details):
+    """``({product_id: item}, suffixes of old keys with entries that could not be used)``."""
+    items = {}
+    for field, value in compact.items():
+        if field not in redis_cart._META_FIELDS:
+            items[int(field)] = redis_cart._decode_compact_item(field, value)
+    for field, qty in qtys.items():
+        if int(field) not in items and field in details:
+            items[int(field)] = {**json.loads(details[field]), "quantity": int(qty)}
+    unused = [
+        suffix
+        for suffix, fields in ((":qty", qtys), (":details", details))
+        if any(int(field) not in items for field in fields)
+    ]
+    return items, unused
+
+
+def merge_carts(session_ids):
+    """Add the old-key carts of ``session_ids`` into their hash-tagged carts.
+
+    Quantities are summed; item details and a promo code already in the new
+    cart are kept. Returns ``(carts merged, old keys kept)``: old keys are
+    deleted once the merge is written, except those holding entries the
+    merge could not use. Merging a session twice adds nothing.
+    """
+    client = redis_cart.redis_client
+    session_ids = list(session_ids)
+    pipe = client.pipeline(transaction=False)
+    for session_id in session_ids:
+        pipe.hgetall(_old_key(session_id, ""))
+        pipe.hgetall(_old_key(session_id, ":qty"))
+        pipe.hgetall(_old_key(session_id, ":details"))
+        pipe.get(_old_key(session_id, ":promo_code"))
+    replies = pipe.execute()
+
+    merge = _merge[redis_cart.CART_STORAGE]
+    kept = {}
+    pipe = client.pipeline(transaction=False)
+    for index, session_id in enumerate(session_ids):
+        compact, qtys, details, promo_code = replies[4 * index:4 * index + 4]
+        items, kept[session_id] = _parse_old_cart(compact, qtys, details)
+        args = [redis_cart.CART_TTL, MARKER_TTL, promo_code or compact.get("promo") or ""]
+        for product_id, item in items.items():
+            args += [product_id, item["quantity"], redis_cart._encode_item(product_id, item["name"], item["price"])]
+        merge(keys=[*redis_cart._cart_keys(session_id), _marker_key(session_id)], args=args, client=pipe)
+    if redis_cart.CART_PERSISTENCE:
+        pipe.sadd(redis_cart.DIRTY_KEY, *session_ids)
+    merged = sum(pipe.execute()[:len(session_ids)])
+
+    pipe = client.pipeline(transaction=False)
+    for session_id in session_ids:
+        _delete(pipe, [
+            _old_key(session_id, suffix)
+            for suffix in (*_SUFFIXES, _CACHE_SUFFIX)
+            if suffix not in kept[session_id]
+        ])
+    pipe.execute()
+    return merged, sum(len(unused) for unused in kept.values())
+
+
+def migrate_dirty_set():
+    """Carry queued session ids over to the hash-tagged dirty set."""
+    client = redis_cart.redis_client
+    session_ids = set()
+    for key in _OLD_DIRTY_KEYS:
+        session_ids |= client.smembers(key)
+    emptied = set()
+    for key in _OLD_EMPTIED_KEYS:
+        emptied |= client.smembers(key)
+    if session_ids:
+        client.sadd(redis_cart.DIRTY_KEY, *session_ids)
+    if emptied:
+        client.sadd(redis_cart.EMPTIED_KEY, *emptied)
+    for key in (*_OLD_DIRTY_KEYS, *_OLD_EMPTIED_KEYS):
+        client.delete(key)
+    return len(session_ids)
+
+
+def migrate(count=SCAN_COUNT, pause=0.0):
+    """One throttled pass; returns ``(keys moved, carts merged, old keys kept, dirty ids moved)``."""
+    moved = merged = kept = 0
+    for old_keys in iter_old_key_pages(count):
+        page_moved, page_merged, page_kept = migrate_page(old_keys)
+        moved += page_moved
+        merged += page_merged
+        kept += page_kept
+        if pause:
+            time.sleep(pause)
+    return moved, merged, kept, migrate_dirty_set()
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+
+
+
+def _session_script(prefix, product_id, rounds):
+    """The request mix one simulated shopper sends: add once, then browse and click +."""
+    yield "post", f"{prefix}add/", {"product_id": product_id, "name": f"Load item {product_id}", "price": 9.99}
+    for _ in range(rounds):
+        yield "get", f"{prefix}get/", None
+        yield "post", f"{prefix}increment/", {"product_id": product_id, "action": "inc"}
+    yield "post", f"{prefix}checkout/", {}
+
+
+def _summary(samples, elapsed):
+    samples.sort()
+
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(len(samples) * q))], 3)
+
+    return {
+        "requests": len(samples),
+        "requests_per_sec": round(len(samples) / elapsed, 1),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the cart API through the WSGI handler (sync views) and the ASGI "
+        "handler (async views) against the configured Redis and database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=200)
+        parser.add_argument("--rounds", type=int, default=10, help="get/increment pairs per session")
+        parser.add_argument("--concurrency", type=int, default=32)
+
+    def handle(self, *args, **options):
+        # The test clients address the app as "testserver".
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            results = {
+                "wsgi_sync": self._run_sync(options["sessions"], options["rounds"], options["concurrency"]),
+                "asgi_async": asyncio.run(
+                    self._run_async(options["sessions"], options["rounds"], options["concurrency"])
+                ),
+            }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def _run_sync(self, sessions, rounds, concurrency):
+        def shopper(index):
+            client = Client()
+            samples = []
+            for method, path, body in _session_script("/api/cart/", index, rounds):
+                start = time.perf_counter()
+                if method == "get":
+                    client.get(path)
+                else:
+                    client.post(path, body, content_type="application/json")
+                samples.append((time.perf_counter() - start) * 1000)
+            return samples
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = [s for batch in pool.map(shopper, range(sessions)) for s in batch]
+        return _summary(samples, time.perf_counter() - start)
+
+    async def _run_async(self, sessions, rounds, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def shopper(index):
+            async with semaphore:
+                client = AsyncClient()
+                samples = []
+                for method, path, body in _session_script("/api/cart/async/", index, rounds):
+                    start = time.perf_counter()
+                    if method == "get":
+                        await client.get(path)
+                    else:
+                        await client.post(path, body, content_type="application/json")
+                    samples.append((time.perf_counter() - start) * 1000)
+                return samples
+
+        start = time.perf_counter()
+        batches = await asyncio.gather(*(shopper(i) for i in range(sessions)))
+        samples = [s for batch in batches for s in batch]
+        return _summary(samples, time.perf_counter() - start)
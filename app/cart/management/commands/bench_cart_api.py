@@ -0,0 +1,266 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+
+from cart import redis_cart
+from core import client_cache, rate_limit, redis_metrics
+from inventory import product_cache
+from inventory.models import Category, Product
+
+DEFAULT_MIX = "add=25,get=25,increment=15,decrement=5,set_quantity=5,remove=5,promo=5,checkout=10,clear=5"
+
+# op -> (method, path under the cart prefix); covers every route in cart/urls.py.
+ENDPOINTS = {
+    "add": ("post", "add/"),
+    "get": ("get", "get/"),
+    "clear": ("delete", "get/"),
+    "remove": ("post", "delete/"),
+    "increment": ("post", "increment/"),
+    "decrement": ("post", "increment/"),
+    "set_quantity": ("post", "update/qty/"),
+    "promo": ("post", "promo/"),
+    "checkout": ("post", "checkout/"),
+}
+PREFIXES = {"sync": "/api/cart/", "async": "/api/cart/async/"}
+BENCH_SLUG_PREFIX = "bench-"
+
+
+def _parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        op, _, weight = part.partition("=")
+        op = op.strip()
+        if op not in ENDPOINTS:
+            raise CommandError(f"Unknown op {op!r} in --mix; choose from {', '.join(ENDPOINTS)}.")
+        try:
+            mix[op] = float(weight)
+        except ValueError:
+            raise CommandError(f"Bad weight for {op!r} in --mix.")
+    if not any(mix.values()):
+        raise CommandError("--mix needs at least one positive weight.")
+    return mix
+
+
+def _make_catalog(size, seed):
+    """Replace the synthetic catalog with ``size`` products; returns their (id, name, price)."""
+    rng = random.Random(seed)
+    Product.objects.filter(slug__startswith=BENCH_SLUG_PREFIX).delete()
+    category, _ = Category.objects.get_or_create(
+        slug=f"{BENCH_SLUG_PREFIX}category", defaults={"name": "Bench category", "is_active": True}
+    )
+    Product.objects.bulk_create(
+        Product(
+            category=category,
+            name=f"Bench product {i}",
+            slug=f"{BENCH_SLUG_PREFIX}{i}",
+            price=Decimal(rng.randrange(100, 100000)) / 100,
+            is_active=rng.random() > 0.05,
+        )
+        for i in range(size)
+    )
+    # bulk_create skips the write-through signals.
+    product_cache.rebuild_catalog()
+    return list(
+        Product.objects.filter(slug__startswith=BENCH_SLUG_PREFIX).order_by("id").values_list("id", "name", "price")
+    )
+
+
+def _plan_session(rng, catalog, mix, length):
+    """A reproducible request sequence for one shopper; the first request opens the session."""
+    ops, weights = zip(*mix.items())
+    in_cart = []
+    plan = []
+    for step in range(length):
+        op = "add" if step == 0 else rng.choices(ops, weights)[0]
+        if op == "add" or not in_cart:
+            product_id = rng.choice(catalog)[0]
+        else:
+            product_id = rng.choice(in_cart)
+
+        if op == "add":
+            body = {"product_id": product_id, "quantity": rng.randint(1, 3)}
+            if product_id not in in_cart:
+                in_cart.append(product_id)
+        elif op == "increment":
+            body = {"product_id": product_id, "action": "inc"}
+        elif op == "decrement":
+            body = {"product_id": product_id, "action": "dec"}
+        elif op == "set_quantity":
+            body = {"product_id": product_id, "quantity": rng.randint(1, 5)}
+        elif op == "remove":
+            body = {"product_id": product_id}
+            if product_id in in_cart:
+                in_cart.remove(product_id)
+        elif op == "promo":
+            body = {"promo_code": rng.choice(["WELCOME10", "SPRING", "VIP"])}
+        elif op == "clear":
+            body = None
+            in_cart.clear()
+        else:
+            body = {} if op == "checkout" else None
+        plan.append((op, body))
+    return plan
+
+
+def _percentile(sorted_samples, q):
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * q))]
+
+
+def _summarize(samples, elapsed=None):
+    latencies = sorted(sample[1] for sample in samples)
+    summary = {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if sample[2] >= 500),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(_percentile(latencies, 0.50), 3),
+        "p95_ms": round(_percentile(latencies, 0.95), 3),
+        "p99_ms": round(_percentile(latencies, 0.99), 3),
+        "redis_commands_per_request": round(statistics.fmean(sample[3] for sample in samples), 3),
+        "redis_round_trips_per_request": round(statistics.fmean(sample[4] for sample in samples), 3),
+    }
+    if elapsed is not None:
+        summary["elapsed_s"] = round(elapsed, 3)
+        summary["requests_per_sec"] = round(len(samples) / elapsed, 1)
+    return summary
+
+
+def _report(samples, elapsed):
+    by_op = defaultdict(list)
+    for sample in samples:
+        by_op[sample[0]].append(sample)
+    report = _summarize(samples, elapsed)
+    report["endpoints"] = {op: _summarize(by_op[op]) for op in ENDPOINTS if by_op[op]}
+    return report
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a reproducible mixed workload against every cart endpoint and report "
+        "throughput, latency percentiles and Redis ops per request as JSON. "
+        "Run with --settings=core.settings_bench for SQLite and optionally fakeredis."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=200)
+        parser.add_argument("--requests-per-session", type=int, default=20)
+        parser.add_argument("--catalog-size", type=int, default=500)
+        parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Comma separated op=weight (default {DEFAULT_MIX}).")
+        parser.add_argument("--variant", choices=["sync", "async", "both"], default="both")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--no-setup", action="store_true",
+                            help="Skip migrate and catalog generation; reuse the existing bench catalog.")
+        parser.add_argument("--output", help="Also write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        mix = _parse_mix(options["mix"])
+        if options["no_setup"]:
+            catalog = list(
+                Product.objects.filter(slug__startswith=BENCH_SLUG_PREFIX)
+                .order_by("id")
+                .values_list("id", "name", "price")
+            )
+            if not catalog:
+                raise CommandError("No bench catalog found; run once without --no-setup.")
+        else:
+            call_command("migrate", interactive=False, verbosity=0)
+            catalog = _make_catalog(options["catalog_size"], options["seed"])
+
+        plans = [
+            _plan_session(random.Random(options["seed"] * 100003 + index), catalog, mix,
+                          options["requests_per_session"])
+            for index in range(options["sessions"])
+        ]
+        variants = ["sync", "async"] if options["variant"] == "both" else [options["variant"]]
+
+        report = {
+            "config": {
+                "sessions": options["sessions"],
+                "requests_per_session": options["requests_per_session"],
+                "catalog_size": len(catalog),
+                "mix": mix,
+                "concurrency": options["concurrency"],
+                "seed": options["seed"],
+                "database": settings.DATABASES["default"]["ENGINE"].rsplit(".", 1)[-1],
+                "cart_storage": redis_cart.CART_STORAGE,
+                "cart_coalesce_window_ms": redis_cart.CART_COALESCE_WINDOW_MS,
+            },
+            "variants": {},
+        }
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            for variant in variants:
+                if variant == "sync":
+                    samples, elapsed = self._run_sync(plans, options["concurrency"])
+                else:
+                    samples, elapsed = asyncio.run(self._run_async(plans, options["concurrency"]))
+                report["variants"][variant] = _report(samples, elapsed)
+        report["ttl"] = redis_cart.ttl_stats()
+        report["rate_limit"] = rate_limit.stats()
+        report["product_local_cache"] = product_cache.local_cache_stats()
+        report["client_cache"] = client_cache.cache_stats(settings.REDIS_CACHED_CLIENT)
+        if redis_cart.CART_COALESCE_WINDOW_MS:
+            redis_cart.flush_pending_quantities()
+            report["coalesce"] = redis_cart.coalesce_stats()
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        self.stdout.write(output)
+
+    def _run_sync(self, plans, concurrency):
+        prefix = PREFIXES["sync"]
+
+        def shopper(plan):
+            client = Client(raise_request_exception=False)
+            samples = []
+            for op, body in plan:
+                method, path = ENDPOINTS[op]
+                with redis_metrics.track() as stats:
+                    start = time.perf_counter()
+                    if method == "post":
+                        response = client.post(prefix + path, body, content_type="application/json")
+                    else:
+                        response = getattr(client, method)(prefix + path)
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+                samples.append((op, elapsed_ms, response.status_code, stats.command_count, stats.round_trips))
+            return samples
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = [sample for batch in pool.map(shopper, plans) for sample in batch]
+        return samples, time.perf_counter() - start
+
+    async def _run_async(self, plans, concurrency):
+        prefix = PREFIXES["async"]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def shopper(plan):
+            async with semaphore:
+                client = AsyncClient(raise_request_exception=False)
+                samples = []
+                for op, body in plan:
+                    method, path = ENDPOINTS[op]
+                    with redis_metrics.track() as stats:
+                        start = time.perf_counter()
+                        if method == "post":
+                            response = await client.post(prefix + path, body, content_type="application/json")
+                        else:
+                            response = await getattr(client, method)(prefix + path)
+                        elapsed_ms = (time.perf_counter() - start) * 1000
+                    samples.append((op, elapsed_ms, response.status_code, stats.command_count, stats.round_trips))
+                return samples
+
+        start = time.perf_counter()
+        batches = await asyncio.gather(*(shopper(plan) for plan in plans))
+        return [sample for batch in batches for sample in batch], time.perf_counter() - start
@@ -0,0 +1,70 @@
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from cart import redis_cart
+from core import redis_metrics
+
+
+class Command(BaseCommand):
+    help = "Compare reading many carts one by one with the pipelined redis_cart.get_carts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=10_000)
+        parser.add_argument("--items", type=int, default=4, help="items per cart")
+        parser.add_argument("--chunk-sizes", default="100,500,2000")
+
+    def handle(self, *args, **options):
+        prefix = f"bench-batch-{uuid.uuid4().hex[:8]}"
+        session_ids = [f"{prefix}-{i}" for i in range(options["sessions"])]
+        self._seed(session_ids, options["items"])
+        try:
+            results = {
+                "sessions": len(session_ids),
+                "items_per_cart": options["items"],
+                "cart_storage": redis_cart.CART_STORAGE,
+                "sequential": self._measure(lambda: [redis_cart.get_cart_with_promo_code(s) for s in session_ids]),
+            }
+            for chunk_size in (int(size) for size in options["chunk_sizes"].split(",")):
+                results[f"get_carts_chunk_{chunk_size}"] = self._measure(
+                    lambda: redis_cart.get_carts(session_ids, chunk_size=chunk_size)
+                )
+        finally:
+            for start in range(0, len(session_ids), 1000):
+                pipe = redis_cart.redis_client.pipeline(transaction=False)
+                for session_id in session_ids[start:start + 1000]:
+                    pipe.delete(*redis_cart._cart_keys(session_id))
+                pipe.execute()
+
+        for result in results.values():
+            if isinstance(result, dict):
+                result["per_cart_us"] = round(result["total_ms"] * 1000 / len(session_ids), 2)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def _seed(self, session_ids, items):
+        pipe = redis_cart.redis_client.pipeline(transaction=False)
+        for count, session_id in enumerate(session_ids, 1):
+            for product_id in range(items):
+                redis_cart._scripts[redis_cart.CART_STORAGE]["add_item"](
+                    keys=redis_cart._cart_keys(session_id),
+                    args=[redis_cart.CART_TTL, product_id, 1,
+                          redis_cart._encode_item(product_id, f"Bench item {product_id}", 9.99)],
+                    client=pipe,
+                )
+            if count % 500 == 0:
+                pipe.execute()
+        pipe.execute()
+
+    def _measure(self, read):
+        with redis_metrics.track() as stats:
+            start = time.perf_counter()
+            read()
+            total_ms = (time.perf_counter() - start) * 1000
+        return {
+            "total_ms": round(total_ms, 2),
+            "round_trips": stats.round_trips,
+            "redis_commands": stats.command_count,
+        }
+
@@ -0,0 +1,155 @@
+import json
+import statistics
+import time
+import uuid
+
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cart import redis_cart
+from core import redis_metrics
+
+
+# Pre-script implementations, kept verbatim in shape (same commands, same
+# number of round trips) so the comparison stays honest.
+
+def legacy_add_to_cart(client, session_id, product_id, quantity, name, price):
+    qty_key = redis_cart._qty_key(session_id)
+    details_key = redis_cart._details_key(session_id)
+    pipe = client.pipeline()
+    pipe.hincrby(qty_key, product_id, quantity)
+    if not client.hexists(details_key, product_id):
+        product_data = {"product_id": product_id, "name": name, "price": float(price)}
+        pipe.hset(details_key, product_id, json.dumps(product_data))
+    _legacy_refresh_pipe(pipe, session_id)
+    pipe.execute()
+
+
+def legacy_decrement_quantity(client, session_id, product_id, step=1):
+    qty_key = redis_cart._qty_key(session_id)
+    new_qty = client.hincrby(qty_key, product_id, -step)
+    if new_qty < 1:
+        client.hdel(qty_key, product_id)
+        client.hdel(redis_cart._details_key(session_id), product_id)
+    pipe = client.pipeline()
+    _legacy_refresh_pipe(pipe, session_id)
+    pipe.execute()
+
+
+def legacy_remove_cart(client, session_id, product_id):
+    qty_key = redis_cart._qty_key(session_id)
+    pipe = client.pipeline()
+    pipe.hdel(qty_key, product_id)
+    pipe.hdel(redis_cart._details_key(session_id), product_id)
+    if client.hlen(qty_key) == 0:
+        pipe.delete(redis_cart._promo_key(session_id))
+    _legacy_refresh_pipe(pipe, session_id)
+    pipe.execute()
+
+
+def legacy_remove_from_cart(client, session_id, product_id):
+    qty_key = redis_cart._qty_key(session_id)
+    client.hdel(qty_key, product_id)
+    client.hdel(redis_cart._details_key(session_id), product_id)
+    if client.hlen(qty_key) == 0:
+        client.delete(redis_cart._promo_key(session_id))
+    pipe = client.pipeline()
+    _legacy_refresh_pipe(pipe, session_id)
+    pipe.execute()
+
+
+def _legacy_refresh_pipe(pipe, session_id):
+    for key in redis_cart._cart_keys(session_id):
+        pipe.expire(key, redis_cart.CART_TTL)
+
+
+class Command(BaseCommand):
+    help = "Compare round trips and latency of the legacy and script-based cart operations."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=2000)
+        parser.add_argument("--items", type=int, default=5)
+
+    def handle(self, *args, **options):
+        client = redis.Redis(
+            connection_pool=redis.ConnectionPool(
+                connection_class=redis_metrics.InstrumentedConnection,
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT,
+                db=settings.REDIS_DB,
+                decode_responses=True,
+            )
+        )
+        client.ping()
+
+        original_client = redis_cart.redis_client
+        redis_cart.redis_client = client
+        try:
+            results = self._run(client, options["iterations"], options["items"])
+        finally:
+            redis_cart.redis_client = original_client
+
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def _run(self, client, iterations, items):
+        ops = {
+            "add": (
+                lambda sid, pid: legacy_add_to_cart(client, sid, pid, 1, "Bench item", 9.99),
+                lambda sid, pid: redis_cart.add_to_cart(sid, pid, 1, "Bench item", 9.99),
+            ),
+            "decrement": (
+                lambda sid, pid: legacy_decrement_quantity(client, sid, pid),
+                lambda sid, pid: redis_cart.decrement_quantity(sid, pid),
+            ),
+            "remove_cart": (
+                lambda sid, pid: legacy_remove_cart(client, sid, pid),
+                lambda sid, pid: redis_cart.remove_cart(sid, pid),
+            ),
+            "remove_from_cart": (
+                lambda sid, pid: legacy_remove_from_cart(client, sid, pid),
+                lambda sid, pid: redis_cart.remove_from_cart(sid, pid),
+            ),
+        }
+
+        # Warm up the script cache so SCRIPT LOAD is not billed to the first sample.
+        warmup_sid = f"bench-{uuid.uuid4().hex}"
+        for _, scripted in ops.values():
+            scripted(warmup_sid, 1)
+        redis_cart.clear_cart(warmup_sid)
+
+        results = {}
+        for name, (legacy, scripted) in ops.items():
+            results[name] = {
+                "legacy": self._measure(client, legacy, iterations, items),
+                "script": self._measure(client, scripted, iterations, items),
+            }
+        return results
+
+    def _measure(self, client, op, iterations, items):
+        samples = []
+        round_trips = 0
+        commands = 0
+        for i in range(iterations):
+            session_id = f"bench-{uuid.uuid4().hex}"
+            # Every op runs against a populated cart.
+            for pid in range(items):
+                redis_cart.add_to_cart(session_id, pid, 2, "Bench item", 9.99)
+
+            with redis_metrics.track() as stats:
+                start = time.perf_counter()
+                op(session_id, i % items)
+                samples.append((time.perf_counter() - start) * 1000)
+            round_trips += stats.round_trips
+            commands += stats.command_count
+
+            redis_cart.clear_cart(session_id)
+
+        samples.sort()
+        return {
+            "round_trips_per_op": round_trips / iterations,
+            "commands_per_op": commands / iterations,
+            "mean_ms": round(statistics.fmean(samples), 4),
+            "p50_ms": round(samples[len(samples) // 2], 4),
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 4),
+        }
@@ -0,0 +1,59 @@
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from cart import redis_cart
+
+
+class Command(BaseCommand):
+    help = "Compare Redis memory and read latency of the split and compact cart layouts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=10000)
+        parser.add_argument("--items", type=int, default=5)
+        parser.add_argument("--project-to", type=int, default=1_000_000,
+                            help="Number of sessions to extrapolate memory usage to.")
+
+    def handle(self, *args, **options):
+        original_storage = redis_cart.CART_STORAGE
+        results = {}
+        try:
+            for layout in (redis_cart.SPLIT, redis_cart.COMPACT):
+                redis_cart.CART_STORAGE = layout
+                results[layout] = self._measure(options["sessions"], options["items"], options["project_to"])
+        finally:
+            redis_cart.CART_STORAGE = original_storage
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def _measure(self, sessions, items, project_to):
+        client = redis_cart.redis_client
+        prefix = uuid.uuid4().hex
+        session_ids = [f"bench-{prefix}-{i}" for i in range(sessions)]
+
+        for session_id in session_ids:
+            for pid in range(items):
+                redis_cart.add_to_cart(session_id, pid, 1, f"Bench product {pid}", 19.99)
+            redis_cart.set_cart_promo_code(session_id, "BENCH10")
+
+        pipe = client.pipeline(transaction=False)
+        for session_id in session_ids:
+            for key in redis_cart._cart_keys(session_id):
+                pipe.memory_usage(key, samples=0)
+        memory = sum(usage or 0 for usage in pipe.execute())
+
+        start = time.perf_counter()
+        for session_id in session_ids:
+            redis_cart.get_cart_with_promo_code(session_id)
+        read_ms = (time.perf_counter() - start) * 1000 / sessions
+
+        for session_id in session_ids:
+            redis_cart.clear_cart(session_id)
+
+        per_cart = memory / sessions
+        return {
+            "bytes_per_cart": round(per_cart, 1),
+            f"projected_mb_at_{project_to}": round(per_cart * project_to / 1024 / 1024, 1),
+            "read_ms_per_cart": round(read_ms, 4),
+        }
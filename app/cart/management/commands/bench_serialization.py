@@ -0,0 +1,77 @@
+import json
+import time
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from cart import pricing
+from cart.serializers import CartResponseSerializer, cart_response_data
+from inventory.models import Product
+from inventory.serializers import ProductSerializer
+
+try:
+    from core.renderers import ORJSONRenderer
+except ImproperlyConfigured:  # no orjson
+    ORJSONRenderer = None
+
+
+class Command(BaseCommand):
+    help = "Microseconds per item of the serializer + JSONRenderer path against plain dicts + ORJSONRenderer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=200, help="cart items / products per response")
+        parser.add_argument("--repeat", type=int, default=200)
+
+    def handle(self, *args, **options):
+        items = options["items"]
+        cart_items = [
+            {"product_id": pid, "name": f"Bench item {pid}", "price": 9.99, "quantity": pid % 5 + 1}
+            for pid in range(items)
+        ]
+        summary = pricing.price_cart(cart_items, "BENCH")
+        products = [Product(id=pid, name=f"Bench product {pid}", price=Decimal("19.99")) for pid in range(items)]
+        rows = [(product.id, product.name, product.price) for product in products]
+
+        cart_cases = {
+            "serializer": lambda: CartResponseSerializer(
+                {"items": cart_items, "promo_code": "BENCH", "summary": summary}
+            ).data,
+            "dict": lambda: cart_response_data(cart_items, "BENCH", summary),
+        }
+        product_cases = {
+            "serializer": lambda: ProductSerializer(products, many=True).data,
+            # What ProductListAPIView builds from values_list().
+            "dict": lambda: [{"id": pid, "name": name, "price": str(price)} for pid, name, price in rows],
+        }
+        renderers = {"json": JSONRenderer()}
+        if ORJSONRenderer is not None:
+            renderers["orjson"] = ORJSONRenderer()
+
+        results = {"items": items, "repeat": options["repeat"]}
+        for endpoint, cases in (("cart", cart_cases), ("products", product_cases)):
+            expected = JSONRenderer().render(cases["serializer"]())
+            results[endpoint] = {}
+            for case, build in cases.items():
+                for name, renderer in renderers.items():
+                    if renderer.render(build()) != expected:
+                        raise AssertionError(f"{endpoint}: {case} + {name} renders a different body")
+                    results[endpoint][f"{case}+{name}"] = self._measure(build, renderer, items, options["repeat"])
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def _measure(self, build, renderer, items, repeat):
+        serialize = render = 0.0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            data = build()
+            built = time.perf_counter()
+            renderer.render(data)
+            serialize += built - start
+            render += time.perf_counter() - built
+        per_item = 1e6 / (repeat * items)
+        return {
+            "serialize_us_per_item": round(serialize * per_item, 3),
+            "render_us_per_item": round(render * per_item, 3),
+            "total_us_per_item": round((serialize + render) * per_item, 3),
+        }
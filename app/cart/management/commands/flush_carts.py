@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart import persistence
+
+
+class Command(BaseCommand):
+    help = "Copy the Redis carts of signed-in users that changed since the last flush to the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=persistence.FLUSH_BATCH_SIZE)
+        parser.add_argument("--loop", action="store_true", help="Keep flushing, one pass per --interval.")
+        parser.add_argument("--interval", type=float, default=5, help="Seconds between passes with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            taken, saved = persistence.flush_all(options["batch_size"])
+            if taken or not options["loop"]:
+                self.stdout.write(f"Flushed {taken} dirty sessions, saved {saved} user carts.")
+            if not options["loop"]:
+                return
+            time.sleep(max(0, options["interval"] - (time.monotonic() - started)))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cart import key_migration, redis_cart
+
+
+class Command(BaseCommand):
+    help = "Move carts stored under plain keys to the hash-tagged keys used with CART_KEY_HASH_TAGS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=key_migration.SCAN_COUNT, help="SCAN COUNT hint per page.")
+        parser.add_argument("--pause-ms", type=int, default=10, help="Sleep after every page.")
+
+    def handle(self, *args, **options):
+        if not redis_cart.CART_KEY_HASH_TAGS:
+            raise CommandError("CART_KEY_HASH_TAGS is off; carts already use the plain keys.")
+        moved, merged, kept, dirty = key_migration.migrate(
+            count=options["count"], pause=options["pause_ms"] / 1000
+        )
+        self.stdout.write(
+            f"Moved {moved} cart keys, merged {merged} carts written since the switch, requeued {dirty} dirty carts."
+        )
+        if kept:
+            self.stdout.write(self.style.WARNING(
+                f"Kept {kept} old cart keys with entries that could not be merged; inspect them before deleting."
+            ))
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart import scanner
+
+
+class Command(BaseCommand):
+    help = (
+        "Snapshot live Redis carts into CartSnapshot with a throttled SCAN and mark "
+        "expired carts as abandoned; or, with --listen, follow expiry notifications."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=scanner.SCAN_COUNT, help="SCAN COUNT hint per page.")
+        parser.add_argument("--pause-ms", type=int, default=10, help="Sleep after every page.")
+        parser.add_argument("--max-carts-per-second", type=int, default=5000,
+                            help="Upper bound on carts read per second; 0 disables the limit.")
+        parser.add_argument("--loop", action="store_true", help="Keep scanning, one pass per --interval.")
+        parser.add_argument("--interval", type=int, default=300, help="Seconds between passes with --loop.")
+        parser.add_argument("--listen", action="store_true",
+                            help="Mark carts expired from keyevent notifications instead of scanning.")
+        parser.add_argument("--configure-notifications", action="store_true",
+                            help="With --listen: add 'Ex' to notify-keyspace-events on the server.")
+
+    def handle(self, *args, **options):
+        if options["listen"]:
+            if options["configure_notifications"]:
+                scanner.enable_expiry_notifications()
+            self.stdout.write("Listening for expired carts...")
+            scanner.listen_expired()
+            return
+
+        while True:
+            started = time.monotonic()
+            seen, stored, expired = scanner.scan_pass(
+                count=options["count"],
+                pause=options["pause_ms"] / 1000,
+                max_rate=options["max_carts_per_second"] or None,
+            )
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"Scanned {seen} carts, stored {stored} snapshots, marked {expired} expired in {elapsed:.1f}s."
+            )
+            if not options["loop"]:
+                return
+            time.sleep(max(0, options["interval"] - elapsed))
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40, unique=True)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('total_quantity', models.PositiveIntegerField(default=0)),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('promo_code', models.CharField(blank=True, default='', max_length=200)),
+                ('first_seen_at', models.DateTimeField(auto_now_add=True)),
+                ('last_seen_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('expired_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0002_cart_cartitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartsnapshot',
+            name='end_reason',
+            field=models.CharField(blank=True, choices=[('cleared', 'Cleared'), ('checked_out', 'Checked out')], default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='cartsnapshot',
+            name='ended_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
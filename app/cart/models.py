@@ -1,3 +1,52 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class CartSnapshot(models.Model):
+    """Last state of a Redis cart seen by the ``scan_carts`` worker."""
+    session_key = models.CharField(max_length=40, unique=True)
+    item_count = models.PositiveIntegerField(default=0)
+    total_quantity = models.PositiveIntegerField(default=0)
+    value = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    promo_code = models.CharField(max_length=200, blank=True, default='')
+    first_seen_at = models.DateTimeField(auto_now_add=True)
+    last_seen_at = models.DateTimeField()
+    expires_at = models.DateTimeField(null=True, blank=True)
+    # Set once the cart is gone from Redis without a checkout: an abandoned cart.
+    expired_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Set when the cart was emptied on purpose; it only counts if seen again after that.
+    ended_at = models.DateTimeField(null=True, blank=True)
+    end_reason = models.CharField(max_length=20, blank=True, default='', choices=[
+        ('cleared', 'Cleared'),
+        ('checked_out', 'Checked out'),
+    ])
+
+    def __str__(self):
+        return self.session_key
+
+
+class Cart(models.Model):
+    """Durable copy of a signed-in user's Redis cart, written behind by ``cart.persistence``."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='cart')
+    promo_code = models.CharField(max_length=200, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Cart of {self.user}'
+
+
+class CartItem(models.Model):
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
+    # Not a foreign key: a write-behind flush must not fail on a product deleted meanwhile.
+    product_id = models.PositiveIntegerField()
+    name = models.CharField(max_length=50)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product_id'], name='cart_item_unique_product'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.name}'
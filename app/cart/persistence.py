@@ -0,0 +1,229 @@
+"""Write-behind copy of signed-in users' Redis carts in PostgreSQL.
+
+With ``CART_PERSISTENCE``, every cart mutation adds its session id to
+``redis_cart.DIRTY_KEY`` in the same round trip. ``flush_dirty`` (run by
+``manage.py flush_carts``) takes a batch of those ids, resolves which
+sessions belong to a user with one pipelined session read, reads their
+carts with one pipeline and upserts them with a few bulk statements, so
+database writes scale with flush batches rather than clicks. Anonymous
+sessions are dropped from the queue.
+
+On login the anonymous Redis cart is merged with the user's saved cart
+into the new session's cart in one pipeline (``merge_on_login``). Redis
+carts idle out long before a signed-in session does, so a mutation or
+read that finds the cart missing puts the saved cart back under it
+(``restore_saved_cart``); otherwise the next flush would save the nearly
+empty Redis cart over it. The miss costs one session read for anonymous
+carts, once per cart.
+
+A cart missing from Redis at flush time is only saved (as empty) if it
+was emptied on purpose (``redis_cart.EMPTIED_KEY``); otherwise it expired
+while the flusher was behind, and the saved cart is newer than nothing.
+Nor is the saved cart restored under a cart that was just emptied.
+
+Flushes use a single worker: a batch is moved to ``FLUSHING_KEY`` first
+and removed only after the database commit, so a crash replays it.
+"""
+from decimal import Decimal
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, get_user_model
+from django.db import transaction
+from django.db.models import Q
+
+from . import redis_cart
+from .models import Cart, CartItem
+
+FLUSHING_KEY = f"{redis_cart.DIRTY_KEY}:flushing"  # same slot as DIRTY_KEY when hash-tagged
+EMPTIED_FLUSHING_KEY = f"{redis_cart.EMPTIED_KEY}:flushing"
+FLUSH_BATCH_SIZE = 500
+
+# KEYS: dirty, flushing, emptied, emptied flushing. Returns {batch, emptied in batch}.
+_take_batch = redis_cart.redis_client.register_script("""
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    local ids = redis.call('SPOP', KEYS[1], ARGV[1])
+    if #ids == 0 then
+        return {{}, {}}
+    end
+    redis.call('SADD', KEYS[2], unpack(ids))
+    for _, id in ipairs(ids) do
+        redis.call('SMOVE', KEYS[3], KEYS[4], id)
+    end
+end
+return {redis.call('SMEMBERS', KEYS[2]), redis.call('SMEMBERS', KEYS[4])}
+""")
+
+
+def _session_users(session_ids):
+    """``{session_id: user_id}`` for the signed-in sessions among ``session_ids``."""
+    store = import_module(settings.SESSION_ENGINE).SessionStore
+    if hasattr(store, "load_many"):
+        sessions = store.load_many(session_ids)
+    else:
+        sessions = {session_id: store(session_id).load() for session_id in session_ids}
+    return {
+        session_id: int(data[SESSION_KEY])
+        for session_id, data in sessions.items()
+        if SESSION_KEY in data
+    }
+
+
+def save_carts(user_carts):
+    """Upsert ``{user_id: (items, promo_code)}`` into Cart/CartItem with bulk statements."""
+    if not user_carts:
+        return
+    with transaction.atomic():
+        Cart.objects.bulk_create(
+            [Cart(user_id=user_id, promo_code=promo_code or "") for user_id, (_, promo_code) in user_carts.items()],
+            update_conflicts=True,
+            unique_fields=["user"],
+            update_fields=["promo_code", "updated_at"],
+        )
+        cart_ids = dict(Cart.objects.filter(user_id__in=user_carts).values_list("user_id", "id"))
+
+        items = []
+        stale = Q()
+        for user_id, (cart_items, _) in user_carts.items():
+            cart_id = cart_ids[user_id]
+            items += [
+                CartItem(
+                    cart_id=cart_id,
+                    product_id=item["product_id"],
+                    name=item["name"],
+                    price=Decimal(str(item["price"])),
+                    quantity=item["quantity"],
+                )
+                for item in cart_items
+            ]
+            stale |= Q(cart_id=cart_id) & ~Q(product_id__in=[item["product_id"] for item in cart_items])
+        # One DELETE for every item that left any of the carts.
+        CartItem.objects.filter(stale).delete()
+        if items:
+            CartItem.objects.bulk_create(
+                items,
+                update_conflicts=True,
+                unique_fields=["cart", "product_id"],
+                update_fields=["name", "price", "quantity"],
+            )
+
+
+def flush_dirty(batch_size=FLUSH_BATCH_SIZE):
+    """Persist one batch of dirty carts; returns ``(sessions taken, carts saved)``."""
+    session_ids, emptied = _take_batch(
+        keys=[redis_cart.DIRTY_KEY, FLUSHING_KEY, redis_cart.EMPTIED_KEY, EMPTIED_FLUSHING_KEY], args=[batch_size]
+    )
+    if not session_ids:
+        return 0, 0
+    emptied = set(emptied)
+    users = _session_users(session_ids)
+    # Sessions can outlive their user; a missing one would fail the whole batch.
+    existing = set(get_user_model().objects.filter(pk__in=set(users.values())).values_list("pk", flat=True))
+    users = {session_id: user_id for session_id, user_id in users.items() if user_id in existing}
+    user_carts = {}
+    for session_id, cart_items, promo_code in redis_cart.iter_carts(users):
+        if not cart_items and promo_code is None and session_id not in emptied:
+            continue  # expired, not emptied: keep the saved cart
+        user_carts[users[session_id]] = (cart_items, promo_code)
+    save_carts(user_carts)
+    pipe = redis_cart.redis_client.pipeline(transaction=False)
+    pipe.delete(FLUSHING_KEY)
+    pipe.delete(EMPTIED_FLUSHING_KEY)
+    pipe.execute()
+    return len(session_ids), len(user_carts)
+
+
+def flush_all(batch_size=FLUSH_BATCH_SIZE):
+    taken = saved = 0
+    while True:
+        batch_taken, batch_saved = flush_dirty(batch_size)
+        taken += batch_taken
+        saved += batch_saved
+        if batch_taken < batch_size:
+            return taken, saved
+
+
+def _saved_cart(user_id):
+    cart = Cart.objects.filter(user_id=user_id).prefetch_related("items").first()
+    if cart is None:
+        return [], None
+    items = [
+        {"product_id": item.product_id, "name": item.name, "price": item.price, "quantity": item.quantity}
+        for item in cart.items.all()
+    ]
+    return items, cart.promo_code or None
+
+
+def merge_on_login(old_session_id, session_id, user_id):
+    """Move the anonymous cart to the signed-in session, on top of the saved cart.
+
+    Items in the anonymous cart win over saved ones for the same product.
+    The merged cart is written, the old one deleted and the session marked
+    dirty in one pipeline.
+    """
+    anonymous_items, anonymous_promo = [], None
+    if old_session_id:
+        anonymous_items, anonymous_promo = redis_cart.get_cart_with_promo_code(old_session_id)
+    saved_items, saved_promo = _saved_cart(user_id)
+    if not anonymous_items and not saved_items:
+        return
+
+    merged = {item["product_id"]: item for item in saved_items}
+    merged.update((item["product_id"], item) for item in anonymous_items)
+
+    scripts_ = redis_cart._scripts[redis_cart.CART_STORAGE]
+    pipe = redis_cart.redis_client.pipeline(transaction=False)
+    scripts_["clear"](keys=redis_cart._cart_keys(session_id), args=[redis_cart.CART_TTL], client=pipe)
+    _queue_write(pipe, session_id, merged.values(), anonymous_promo or saved_promo)
+    if old_session_id:
+        scripts_["clear"](keys=redis_cart._cart_keys(old_session_id), args=[redis_cart.CART_TTL], client=pipe)
+    pipe.sadd(redis_cart.DIRTY_KEY, session_id)
+    pipe.execute()
+
+
+def restore_saved_cart(session_id):
+    """Put the saved cart of a signed-in ``session_id`` back under its Redis cart.
+
+    Called after a Redis miss. Items and a promo code already in Redis (the
+    change that found the cart missing) win over saved ones. A cart emptied
+    since the last flush is not restored. Returns True if anything was
+    written.
+    """
+    user_id = _session_users([session_id]).get(session_id)
+    if user_id is None or _emptied(session_id):
+        return False
+    saved_items, saved_promo = _saved_cart(user_id)
+    cart_items, promo_code = redis_cart._parse_cart(redis_cart._run("read", session_id))
+    present = {item["product_id"] for item in cart_items}
+    missing = [item for item in saved_items if item["product_id"] not in present]
+    saved_promo = None if promo_code else saved_promo
+    if not missing and not saved_promo:
+        return False
+
+    pipe = redis_cart.redis_client.pipeline(transaction=False)
+    _queue_write(pipe, session_id, missing, saved_promo)
+    pipe.execute()
+    return True
+
+
+def _emptied(session_id):
+    pipe = redis_cart.redis_client.pipeline(transaction=False)
+    pipe.sismember(redis_cart.EMPTIED_KEY, session_id)
+    pipe.sismember(EMPTIED_FLUSHING_KEY, session_id)
+    return any(pipe.execute())
+
+
+def _queue_write(pipe, session_id, cart_items, promo_code):
+    scripts_ = redis_cart._scripts[redis_cart.CART_STORAGE]
+    keys = redis_cart._cart_keys(session_id)
+    for item in cart_items:
+        scripts_["update_item"](
+            keys=keys,
+            args=[
+                redis_cart.CART_TTL, item["product_id"], item["quantity"],
+                redis_cart._encode_item(item["product_id"], item["name"], item["price"]),
+            ],
+            client=pipe,
+        )
+    if promo_code:
+        scripts_["set_promo_code"](keys=keys, args=[redis_cart.CART_TTL, promo_code], client=pipe)
@@ -0,0 +1,82 @@
+"""Cart totals, computed server-side with ``Decimal``.
+
+Promo codes come from ``CART_PROMO_CODES``: code -> rule, where a rule is
+``{"percent": "10"}`` or ``{"amount": "5.00"}``, optionally with a
+``"min_subtotal"``. Codes are matched case-insensitively; an unknown code
+or one below its minimum is kept on the cart but not applied. The
+discount never exceeds the subtotal.
+
+``redis_cart`` caches the summary next to the cart as JSON (``dumps`` /
+``loads``), with amounts as strings so they round-trip exactly.
+"""
+import json
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+
+CENT = Decimal("0.01")
+
+_LINE_AMOUNTS = ("unit_price", "line_total")
+_AMOUNTS = ("subtotal", "discount", "total")
+
+
+def _money(value):
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def get_promo_rule(promo_code):
+    if not promo_code:
+        return None
+    rules = getattr(settings, "CART_PROMO_CODES", {})
+    return rules.get(promo_code.strip().upper())
+
+
+def discount_for(subtotal, promo_code):
+    """Discount of ``promo_code`` on ``subtotal``; zero when it does not apply."""
+    rule = get_promo_rule(promo_code)
+    if rule is None or subtotal < _money(rule.get("min_subtotal", 0)):
+        return Decimal("0.00")
+    if "percent" in rule:
+        discount = _money(subtotal * Decimal(str(rule["percent"])) / 100)
+    else:
+        discount = _money(rule.get("amount", 0))
+    return min(discount, subtotal)
+
+
+def price_cart(cart_items, promo_code=None):
+    lines = []
+    subtotal = Decimal("0.00")
+    for item in cart_items:
+        unit_price = _money(item["price"])
+        line_total = unit_price * item["quantity"]
+        subtotal += line_total
+        lines.append({
+            "product_id": item["product_id"],
+            "quantity": item["quantity"],
+            "unit_price": unit_price,
+            "line_total": line_total,
+        })
+    discount = discount_for(subtotal, promo_code)
+    return {
+        "lines": lines,
+        "item_count": sum(line["quantity"] for line in lines),
+        "subtotal": subtotal,
+        "promo_code": promo_code,
+        "promo_applied": discount > 0,
+        "discount": discount,
+        "total": subtotal - discount,
+    }
+
+
+def dumps(summary):
+    return json.dumps(summary, default=str, separators=(",", ":"))
+
+
+def loads(raw):
+    summary = json.loads(raw)
+    for field in _AMOUNTS:
+        summary[field] = Decimal(summary[field])
+    for line in summary["lines"]:
+        for field in _LINE_AMOUNTS:
+            line[field] = Decimal(line[field])
+    return summary
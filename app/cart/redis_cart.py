@@ -1,51 +1,300 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import nullcontext
+from decimal import Decimal
+
 from django.conf import settings
 import redis
 import json
 
+from . import pricing, scripts
+from .coalesce import DeltaBuffer
+
 redis_client = settings.REDIS_CLIENT
 
 CART_TTL = 60 * 30  # 30 minutes
 
+SPLIT = "split"
+COMPACT = "compact"
+
+# "split" keeps qty, details and promo code under three keys per cart;
+# "compact" packs the whole cart into one hash and migrates split carts
+# lazily on first touch.
+CART_STORAGE = getattr(settings, "CART_STORAGE", SPLIT)
+
+# Registered once; redis-py runs them with EVALSHA and falls back to
+# SCRIPT LOAD on NOSCRIPT (e.g. after a server restart or failover).
+_scripts = {
+    SPLIT: {name: redis_client.register_script(src) for name, src in scripts.SPLIT.items()},
+    COMPACT: {name: redis_client.register_script(src) for name, src in scripts.COMPACT.items()},
+}
+
+_META_FIELDS = ("v", "promo")
+
+# Write-behind window for +/- clicks in milliseconds; 0 writes every click.
+CART_COALESCE_WINDOW_MS = getattr(settings, "CART_COALESCE_WINDOW_MS", 0)
+
+ALWAYS = "always"
+LAZY = "lazy"
+
+# "always" refreshes the cart TTL on every mutation; "lazy" at most once
+# per CART_TTL_REFRESH_AFTER seconds per session and worker, so a cart
+# never has less than CART_TTL - CART_TTL_REFRESH_AFTER left.
+CART_TTL_STRATEGY = getattr(settings, "CART_TTL_STRATEGY", ALWAYS)
+CART_TTL_REFRESH_AFTER = getattr(settings, "CART_TTL_REFRESH_AFTER", 5 * 60)
+_MAX_TRACKED_SESSIONS = 100_000
+
+_ttl_lock = threading.Lock()
+_last_refresh = OrderedDict()  # session_id -> monotonic time of the last refresh
+_ttl_counters = {"expires_sent": 0, "expires_avoided": 0}
+
+# Operations that must refresh (or never touch) the TTL regardless of strategy.
+_ALWAYS_REFRESH = ("refresh_ttl",)
+_NO_TOUCH = ("read", "read_priced", "clear")
+
+# Mutations add the session to DIRTY_KEY in the same round trip; the
+# ``flush_carts`` worker copies signed-in users' carts to the database.
+CART_PERSISTENCE = getattr(settings, "CART_PERSISTENCE", False)
+
+# cart:{sid}:qty instead of cart:sid:qty, so every script's keys share
+# a cluster slot; cart/key_migration.py moves carts stored the old way.
+CART_KEY_HASH_TAGS = getattr(settings, "CART_KEY_HASH_TAGS", False)
+DIRTY_KEY = "carts:{dirty}" if CART_KEY_HASH_TAGS else "carts:dirty"
+# Sessions whose cart was emptied on purpose since the last flush, so the
+# flusher can tell them from carts that expired (same slot as DIRTY_KEY).
+EMPTIED_KEY = f"{DIRTY_KEY}:emptied"
+_NOT_DIRTY = ("read", "refresh_ttl")
+_MAY_EMPTY = ("remove_item", "change_quantity", "reconcile")
+
 
 def _details_key(session_id):
     return f"{_cart_key(session_id)}:details"
 
 
 def _cart_key(session_id):
+    if CART_KEY_HASH_TAGS:
+        return f"cart:{{{session_id}}}"
     return f"cart:{session_id}"
 
 
-def _refresh_cart_ttl_pipe(pipe, session_id):
-    pipe.expire(_qty_key(session_id), CART_TTL)
-    pipe.expire(_details_key(session_id), CART_TTL)
-    pipe.expire(f"{_cart_key(session_id)}:promo_code", CART_TTL)
+def _promo_key(session_id):
+    return f"{_cart_key(session_id)}:promo_code"
 
 
 def _qty_key(session_id):
     return f"{_cart_key(session_id)}:qty"
 
 
-def add_to_cart(session_id, product_id, quantity, name, price):
-    qty_key = _qty_key(session_id)
-    details_key = _details_key(session_id)
-    pipe = redis_client.pipeline()
-    pipe.hincrby(details_key, product_id, quantity)
-
-    if not redis_client.hexists(details_key, product_id):
-        product_data = {
-            "product_id": product_id,
-            "name": name,
-            "price": float(price),
-
-        }
-        pipe.hset(details_key, product_id, json.dumps(product_data))
-    _refresh_cart_ttl_pipe(pipe, session_id)
+def _summary_key(session_id):
+    return f"{_cart_key(session_id)}:summary"
+
+
+def _cart_keys(session_id):
+    split_keys = [_qty_key(session_id), _details_key(session_id), _promo_key(session_id)]
+    if CART_STORAGE == COMPACT:
+        return [_cart_key(session_id), *split_keys, _summary_key(session_id)]
+    return [*split_keys, _summary_key(session_id)]
+
+
+def _ttl_arg(name, session_id):
+    """TTL argument for the scripts: negative means "only keys without one" (lazy mode)."""
+    if name in _NO_TOUCH:
+        if name == "clear" and CART_TTL_STRATEGY == LAZY:
+            with _ttl_lock:
+                _last_refresh.pop(session_id, None)
+        return CART_TTL
+
+    touched_keys = 1 if CART_STORAGE == COMPACT else 3
+    if CART_TTL_STRATEGY != LAZY or name in _ALWAYS_REFRESH:
+        with _ttl_lock:
+            _ttl_counters["expires_sent"] += touched_keys
+        return CART_TTL
+
+    now = time.monotonic()
+    with _ttl_lock:
+        last = _last_refresh.get(session_id)
+        if last is not None and now - last < CART_TTL_REFRESH_AFTER:
+            _ttl_counters["expires_avoided"] += touched_keys
+            return -CART_TTL
+        _last_refresh[session_id] = now
+        _last_refresh.move_to_end(session_id)
+        if len(_last_refresh) > _MAX_TRACKED_SESSIONS:
+            _last_refresh.popitem(last=False)
+        _ttl_counters["expires_sent"] += touched_keys
+    return CART_TTL
+
+
+def ttl_stats():
+    with _ttl_lock:
+        return {"strategy": CART_TTL_STRATEGY, **_ttl_counters, "tracked_sessions": len(_last_refresh)}
+
+
+def _taking_deltas(name, session_id):
+    """This session's buffered clicks, kept visible to readers until they are written."""
+    if _delta_buffer is None or name == "read":
+        return nullcontext({})
+    return _delta_buffer.writing([session_id])
+
+
+def _run(name, session_id, *args):
+    # A request without a session has no cart worth persisting.
+    mark_dirty = CART_PERSISTENCE and session_id and name not in _NOT_DIRTY
+    with _taking_deltas(name, session_id) as pending:
+        deltas = pending.get(session_id)
+        if not deltas and not mark_dirty:
+            return _scripts[CART_STORAGE][name](
+                keys=_cart_keys(session_id),
+                args=[_ttl_arg(name, session_id), *args],
+                client=redis_client,
+            )
+
+        pipe = redis_client.pipeline(transaction=False)
+        if mark_dirty:
+            # Same round trip: was the cart still in Redis before this change?
+            pipe.exists(*_cart_keys(session_id)[:-1])
+        if deltas:
+            # Buffered clicks go first, in the same round trip, so the
+            # operation sees the quantities the user saw.
+            _queue_deltas(pipe, session_id, deltas)
+        _scripts[CART_STORAGE][name](
+            keys=_cart_keys(session_id), args=[_ttl_arg(name, session_id), *args], client=pipe
+        )
+        if mark_dirty:
+            _queue_dirty(pipe, name, session_id)
+        results = pipe.execute()
+        index = bool(mark_dirty) + (len(deltas) if deltas else 0)
+        if mark_dirty and not results[0] and name != "clear":
+            _restore_saved(session_id)
+        if mark_dirty and name in _MAY_EMPTY:
+            found = results[index + 1]
+            if index in getattr(pipe, "resent", ()):
+                # The script was re-sent after NOSCRIPT, so it ran after the check.
+                found = redis_client.exists(*_cart_keys(session_id)[:-1])
+            if not found:
+                _mark_emptied([session_id])
+        return results[index]
+
+
+def _queue_dirty(pipe, name, session_id):
+    """Queue the session for the flusher; a change that may empty the cart also asks if it did."""
+    if name == "clear":
+        pipe.sadd(EMPTIED_KEY, session_id)
+    elif name in _MAY_EMPTY:
+        pipe.exists(*_cart_keys(session_id)[:-1])
+    pipe.sadd(DIRTY_KEY, session_id)
+
+
+def _mark_emptied(session_ids):
+    # Queued again: a flush may have taken the session since the change.
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.sadd(EMPTIED_KEY, *session_ids)
+    pipe.sadd(DIRTY_KEY, *session_ids)
     pipe.execute()
 
 
-def get_cart(session_id):
-    qtys = redis_client.hgetall(_qty_key(session_id))
-    details = redis_client.hgetall(_details_key(session_id))
+def _restore_saved(session_id):
+    """After a Redis miss, put a signed-in session's saved cart back under it.
+
+    Returns True if anything was restored. Only with ``CART_PERSISTENCE``;
+    see ``persistence.restore_saved_cart``.
+    """
+    if not (CART_PERSISTENCE and session_id):
+        return False
+    from . import persistence
+
+    return persistence.restore_saved_cart(session_id)
+
+
+def _queue_deltas(pipe, session_id, deltas):
+    for product_id, delta in deltas.items():
+        _scripts[CART_STORAGE]["change_quantity"](
+            keys=_cart_keys(session_id),
+            args=[_ttl_arg("change_quantity", session_id), product_id, delta],
+            client=pipe,
+        )
+
+
+def _flush_deltas(pending):
+    pipe = redis_client.pipeline(transaction=False)
+    for session_id, deltas in pending.items():
+        _queue_deltas(pipe, session_id, deltas)
+    dirty = [session_id for session_id in pending if session_id]
+    if CART_PERSISTENCE and dirty:
+        # Did a decrement empty the cart?
+        for session_id in dirty:
+            pipe.exists(*_cart_keys(session_id)[:-1])
+        pipe.sadd(DIRTY_KEY, *dirty)
+    results = pipe.execute()
+    if CART_PERSISTENCE and dirty:
+        exists = results[-len(dirty) - 1:-1]
+        if getattr(pipe, "resent", ()):
+            pipe = redis_client.pipeline(transaction=False)
+            for session_id in dirty:
+                pipe.exists(*_cart_keys(session_id)[:-1])
+            exists = pipe.execute()
+        emptied = [session_id for session_id, found in zip(dirty, exists) if not found]
+        if emptied:
+            _mark_emptied(emptied)
+
+
+_delta_buffer = DeltaBuffer(CART_COALESCE_WINDOW_MS, _flush_deltas) if CART_COALESCE_WINDOW_MS else None
+
+
+def _read_settled(session_ids, read):
+    """``(read(), {session_id: buffered deltas})``, never missing or double counting a flush."""
+    if _delta_buffer is None:
+        return read(), {}
+    return _delta_buffer.read(session_ids, read)
+
+
+def _apply_pending(cart_items, deltas):
+    """Read-your-writes: fold a session's buffered clicks into ``cart_items``."""
+    if not deltas:
+        return cart_items
+    applied = []
+    for item in cart_items:
+        quantity = item["quantity"] + deltas.get(item["product_id"], 0)
+        if quantity >= 1:
+            applied.append({**item, "quantity": quantity})
+    return applied
+
+
+def _encode_item(product_id, name, price):
+    if CART_STORAGE == COMPACT:
+        cents = int((Decimal(str(price)) * 100).to_integral_value())
+        return f"{cents}|{name}"
+    return json.dumps({
+        "product_id": product_id,
+        "name": name,
+        "price": float(price),
+    })
+
+
+def _decode_compact_item(product_id, value):
+    qty, cents, name = value.split("|", 2)
+    return {
+        "product_id": int(product_id),
+        "name": name,
+        "price": int(cents) / 100,
+        "quantity": int(qty),
+    }
+
+
+def _parse_cart(raw):
+    if CART_STORAGE == COMPACT:
+        fields = dict(zip(raw[::2], raw[1::2]))
+        cart_items = [
+            _decode_compact_item(pid, value)
+            for pid, value in fields.items()
+            if pid not in _META_FIELDS
+        ]
+        return cart_items, fields.get("promo")
+
+    qtys = dict(zip(raw[0][::2], raw[0][1::2]))
+    details = dict(zip(raw[1][::2], raw[1][1::2]))
+    promo_code = raw[2] if len(raw) > 2 else None
 
     cart_items = []
     for pid, qty in qtys.items():
@@ -55,107 +304,183 @@ def get_cart(session_id):
         data = json.loads(detail_json)
         data['quantity'] = int(qty)
         cart_items.append(data)
-    return cart_items
+    return cart_items, promo_code
 
 
-def remove_cart(session_id, product_id):
-    qty_key = _qty_key(session_id)
-    details_key = _details_key(session_id)
-    promote_key = f"{_cart_key(session_id)}:promote"
+def _read_cart(session_id):
+    cart_items, promo_code = _read_settled_cart(session_id)
+    if not cart_items and promo_code is None and _restore_saved(session_id):
+        cart_items, promo_code = _read_settled_cart(session_id)
+    return cart_items, promo_code
 
-    pipe = redis_client.pipeline()
-    pipe.hdel(qty_key, product_id)
-    pipe.hdel(details_key, product_id)
 
-    if redis_client.hlen(qty_key) == 0:
-        pipe.delete(promote_key)
+def _read_settled_cart(session_id):
+    raw, pending = _read_settled([session_id], lambda: _run("read", session_id))
+    cart_items, promo_code = _parse_cart(raw)
+    return _apply_pending(cart_items, pending.get(session_id)), promo_code
 
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
+
+def _refresh_cart_ttl(session_id):
+    _run("refresh_ttl", session_id)
+
+
+def add_to_cart(session_id, product_id, quantity, name, price):
+    return _run("add_item", session_id, product_id, quantity, _encode_item(product_id, name, price))
+
+
+def get_cart(session_id):
+    cart_items, _ = _read_cart(session_id)
+    return cart_items
+
+
+def get_cart_with_promo_code(session_id):
+    return _read_cart(session_id)
+
+
+def _split_priced(raw):
+    """Split a ``read_priced`` reply into the plain read reply and the cached summary."""
+    if CART_STORAGE == COMPACT:
+        return raw[0], raw[1]
+    return raw[:3], raw[3]
+
+
+def _price(raw, deltas):
+    """``(items, promo_code, summary, store)`` from a ``read_priced`` reply and the buffered deltas."""
+    cart_raw, cached = _split_priced(raw)
+    cart_items, promo_code = _parse_cart(cart_raw)
+    applied = _apply_pending(cart_items, deltas)
+    if applied is not cart_items:
+        # Buffered clicks are not in Redis yet: price what the user sees, don't cache it.
+        return applied, promo_code, pricing.price_cart(applied, promo_code), False
+    if cached:
+        return cart_items, promo_code, pricing.loads(cached), False
+    return cart_items, promo_code, pricing.price_cart(cart_items, promo_code), bool(cart_items)
+
+
+def get_priced_cart(session_id):
+    """Return ``(items, promo_code, summary)``.
+
+    The summary is cached next to the cart until its next mutation, so
+    repeated reads are one round trip and no recomputation.
+    """
+    cart_items, promo_code, summary = _read_priced(session_id)
+    if not cart_items and promo_code is None and _restore_saved(session_id):
+        cart_items, promo_code, summary = _read_priced(session_id)
+    return cart_items, promo_code, summary
+
+
+def _read_priced(session_id):
+    nonce = uuid.uuid4().hex
+    keys = _cart_keys(session_id)
+    raw, pending = _read_settled(
+        [session_id],
+        lambda: _scripts[CART_STORAGE]["read_priced"](keys=keys, args=[CART_TTL, nonce], client=redis_client),
+    )
+    cart_items, promo_code, summary, store = _price(raw, pending.get(session_id))
+    if store:
+        _scripts[CART_STORAGE]["store_summary"](
+            keys=keys, args=[CART_TTL, nonce, pricing.dumps(summary)], client=redis_client
+        )
+    return cart_items, promo_code, summary
+
+
+BATCH_CHUNK_SIZE = 500
+
+
+def iter_carts(session_ids, chunk_size=BATCH_CHUNK_SIZE):
+    """Yield ``(session_id, items, promo_code)``, reading ``chunk_size`` carts per round trip.
+
+    Only one chunk of raw replies is held at a time, so memory stays
+    bounded however many sessions are asked for.
+    """
+    session_ids = list(session_ids)
+    for start in range(0, len(session_ids), chunk_size):
+        chunk = session_ids[start:start + chunk_size]
+        replies, pending = _read_settled(chunk, lambda: _read_chunk(chunk))
+        for session_id, raw in zip(chunk, replies):
+            cart_items, promo_code = _parse_cart(raw)
+            yield session_id, _apply_pending(cart_items, pending.get(session_id)), promo_code
+
+
+def _read_chunk(session_ids):
+    read = _scripts[CART_STORAGE]["read"]
+    pipe = redis_client.pipeline(transaction=False)
+    for session_id in session_ids:
+        read(keys=_cart_keys(session_id), args=[CART_TTL], client=pipe)
+    return pipe.execute()
+
+
+def get_carts(session_ids, chunk_size=BATCH_CHUNK_SIZE):
+    """Return ``{session_id: {"items": [...], "promo_code": ...}}`` for many sessions."""
+    return {
+        session_id: {"items": cart_items, "promo_code": promo_code}
+        for session_id, cart_items, promo_code in iter_carts(session_ids, chunk_size)
+    }
+
+
+def remove_cart(session_id, product_id):
+    return _run("remove_item", session_id, product_id)
 
 
 def clear_cart(session_id):
-    pipe = redis_client.pipeline()
-    pipe.delete(_qty_key(session_id))
-    pipe.delete(_details_key(session_id))
-    pipe.delete(f"{_cart_key(session_id)}:promo_code")
-    pipe.execute()
+    _run("clear", session_id)
 
 
-def get_cart_promo_code(session_id):
-    key = f"cart:{session_id}:promo_code"
-    return redis_client.get(key)
+def _change_quantity(session_id, product_id, delta):
+    if _delta_buffer is not None:
+        _delta_buffer.add(session_id, int(product_id), delta)
+    else:
+        _run("change_quantity", session_id, product_id, delta)
 
 
 def increment_quantity(session_id, product_id, step=1):
-    pipe = redis_client.pipeline()
-    pipe.hincrby(_qty_key(session_id), product_id, step)
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
+    _change_quantity(session_id, product_id, step)
     return True
 
 
 def decrement_quantity(session_id, product_id, step=1):
-    qty_key = _qty_key(session_id)
-    details_key = _details_key(session_id)
-    new_qty = redis_client.hincrby(qty_key, product_id, -step)
-    if new_qty < 1:
-        pipe = redis_client.pipeline()
-        redis_client.hdel(qty_key, product_id)
-        redis_client.hdel(_details_key, product_id)
-        _refresh_cart_ttl_pipe(pipe,session_id)
-        pipe.execute()
-    else:
-        pipe = redis_client.pipeline()
-        _refresh_cart_ttl_pipe(pipe, session_id)
-        pipe.execute()
+    _change_quantity(session_id, product_id, -step)
     return True
 
 
-def set_quantity(session_id, product_id, quantity):
-    key = _cart_key(session_id)
-    existing = redis_client.hget(key, product_id)
+def flush_pending_quantities():
+    """Write all buffered clicks now; returns how many item deltas were written."""
+    return _delta_buffer.flush() if _delta_buffer is not None else 0
 
-    if not existing:
-        return False
 
-    data = json.loads(existing)
-    data["quantity"] = quantity
-    redis_client.hset(key, product_id, json.dumps(data))
+def coalesce_stats():
+    return _delta_buffer.stats() if _delta_buffer is not None else None
 
-    pipe = redis_client.pipeline()
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
 
-    return True
+def set_quantity(session_id, product_id, quantity):
+    return bool(_run("set_quantity", session_id, product_id, quantity))
 
 
 def set_cart_promo_code(session_id, promo_code):
-    pipe = redis_client.pipeline()
-    pipe.set(f"{_cart_key(session_id)}:promo_code", promo_code)
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
+    _run("set_promo_code", session_id, promo_code)
 
 
 def update_cart_item(session_id, product_id, name, price, quantity):
-    pipe = redis_client.pipeline()
-    details = {
-        "product_id": product_id,
-        "name": name,
-        "price": float(price),
-    }
-
-    redis_client.hset(_details_key(session_id), product_id, json.dumps(details))
-    redis_client.hset(_qty_key(session_id), product_id, quantity)
-    _refresh_cart_ttl_pipe(pipe,session_id)
-    pipe.execute()
+    _run("update_item", session_id, product_id, quantity, _encode_item(product_id, name, price))
 
 
 def remove_from_cart(session_id, product_id):
-    redis_client.hdel(_qty_key(session_id), product_id)
-    redis_client.hdel(_details_key(session_id), product_id)
+    return remove_cart(session_id, product_id)
+
+
+def _reconcile_args(removals, updates):
+    removals = list(removals)
+    args = [len(removals), *removals]
+    for product_id, name, price in updates:
+        args += [product_id, _encode_item(product_id, name, price)]
+    return args
+
 
-    if redis_client.hlen(_qty_key(session_id)) == 0:
-        redis_client.delete(f"{_cart_key(session_id)}:promo_code")
+def reconcile_cart(session_id, removals=(), updates=()):
+    """Apply checkout corrections in one round trip.
 
-        _refresh_cart_ttl(session_id)
+    ``removals`` are product ids to drop, ``updates`` are
+    ``(product_id, name, price)`` triples whose stored details are replaced
+    while the quantity is kept. The promo code goes with the last item.
+    """
+    _run("reconcile", session_id, *_reconcile_args(removals, updates))
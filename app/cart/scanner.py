@@ -0,0 +1,190 @@
+"""Abandoned-cart analytics from the live Redis carts.
+
+``scan_pass`` walks the carts with incremental SCAN (never KEYS), reads
+each page of carts and their TTLs in one pipeline and upserts a
+``CartSnapshot`` per cart in one statement. Carts whose last seen expiry
+has passed without being seen again are marked expired. ``listen_expired``
+marks them as they expire instead, from keyspace notifications. Carts the
+shopper cleared or checked out are stamped by ``mark_ended`` and never
+count as abandoned, unless they are seen again with items afterwards.
+
+Both are throttled by the caller's ``pause`` and ``max_rate`` so a pass
+is spread out and never monopolizes the Redis the shoppers are using.
+"""
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import redis_cart
+from .models import CartSnapshot
+
+SCAN_COUNT = 500
+EXPIRED_FLUSH_INTERVAL = 1.0
+
+CLEARED = "cleared"
+CHECKED_OUT = "checked_out"
+
+_SNAPSHOT_FIELDS = [
+    "item_count", "total_quantity", "value", "promo_code", "last_seen_at", "expires_at", "expired_at",
+]
+
+
+def _primary_key(session_id):
+    if redis_cart.CART_STORAGE == redis_cart.COMPACT:
+        return redis_cart._cart_key(session_id)
+    return redis_cart._qty_key(session_id)
+
+
+def session_id_from_key(key):
+    """Session id of a cart's primary key, or None for any other key."""
+    prefix, suffix = _primary_key("\0").split("\0")
+    if not key.startswith(prefix) or not key.endswith(suffix):
+        return None
+    session_id = key[len(prefix):len(key) - len(suffix)]
+    return session_id if session_id and not set(session_id) & set(":{}") else None
+
+
+def iter_session_pages(count=SCAN_COUNT):
+    """Yield lists of session ids, about ``count`` at a time.
+
+    ``scan_iter`` walks every primary in turn on Redis Cluster.
+    """
+    page = []
+    for key in redis_cart.redis_client.scan_iter(match=_primary_key("*"), count=count, _type="hash"):
+        session_id = session_id_from_key(key)
+        if session_id:
+            page.append(session_id)
+        if len(page) >= count:
+            yield list(dict.fromkeys(page))
+            page = []
+    if page:
+        yield list(dict.fromkeys(page))
+
+
+def _read_page(session_ids):
+    read = redis_cart._scripts[redis_cart.CART_STORAGE]["read"]
+    pipe = redis_cart.redis_client.pipeline(transaction=False)
+    for session_id in session_ids:
+        keys = redis_cart._cart_keys(session_id)
+        read(keys=keys, args=[redis_cart.CART_TTL], client=pipe)
+        pipe.ttl(keys[0])
+    replies = pipe.execute()
+    return zip(session_ids, replies[::2], replies[1::2])
+
+
+def snapshot_page(session_ids, now=None):
+    """Upsert the snapshots of ``session_ids``; returns how many carts were stored."""
+    now = now or timezone.now()
+    snapshots = []
+    for session_id, raw, ttl in _read_page(session_ids):
+        cart_items, promo_code = redis_cart._parse_cart(raw)
+        if not cart_items:
+            continue
+        snapshots.append(CartSnapshot(
+            session_key=session_id,
+            item_count=len(cart_items),
+            total_quantity=sum(item["quantity"] for item in cart_items),
+            value=sum(Decimal(str(item["price"])) * item["quantity"] for item in cart_items),
+            promo_code=promo_code or "",
+            last_seen_at=now,
+            expires_at=now + timedelta(seconds=ttl) if ttl >= 0 else None,
+            expired_at=None,
+        ))
+    if snapshots:
+        CartSnapshot.objects.bulk_create(
+            snapshots,
+            update_conflicts=True,
+            unique_fields=["session_key"],
+            update_fields=_SNAPSHOT_FIELDS,
+        )
+    return len(snapshots)
+
+
+def _not_ended():
+    # A snapshot seen before the cart was cleared keeps last_seen_at < ended_at,
+    # even when the scan that wrote it finished after the clear.
+    return Q(ended_at__isnull=True) | Q(ended_at__lt=F("last_seen_at"))
+
+
+def mark_ended(session_id, reason):
+    """Record that the cart of ``session_id`` was emptied on purpose (``CLEARED`` or ``CHECKED_OUT``)."""
+    return CartSnapshot.objects.filter(session_key=session_id).update(ended_at=timezone.now(), end_reason=reason)
+
+
+async def amark_ended(session_id, reason):
+    return await CartSnapshot.objects.filter(session_key=session_id).aupdate(
+        ended_at=timezone.now(), end_reason=reason
+    )
+
+
+def mark_expired(now=None):
+    """Carts whose last seen expiry has passed are gone from Redis: mark them abandoned."""
+    now = now or timezone.now()
+    return CartSnapshot.objects.filter(_not_ended(), expired_at__isnull=True, expires_at__lt=now).update(
+        expired_at=F("expires_at")
+    )
+
+
+def scan_pass(count=SCAN_COUNT, pause=0.0, max_rate=None):
+    """One throttled pass over all carts. Returns ``(carts_seen, carts_stored, expired)``."""
+    seen = stored = 0
+    for session_ids in iter_session_pages(count):
+        started = time.monotonic()
+        stored += snapshot_page(session_ids)
+        seen += len(session_ids)
+        delay = pause
+        if max_rate:
+            delay = max(delay, len(session_ids) / max_rate - (time.monotonic() - started))
+        if delay > 0:
+            time.sleep(delay)
+    return seen, stored, mark_expired()
+
+
+def enable_expiry_notifications():
+    """Add keyevent (E) and expired (x) flags to ``notify-keyspace-events``."""
+    client = redis_cart.redis_client
+    current = client.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+    flags = set(current) | {"E", "x"}
+    if flags != set(current):
+        client.config_set("notify-keyspace-events", "".join(sorted(flags)))
+
+
+def listen_expired(stop=lambda: False):
+    """Mark snapshots expired as Redis expires their carts (blocks until ``stop()``).
+
+    Needs ``notify-keyspace-events`` with ``Ex``. Expired session ids are
+    written in one UPDATE per ``EXPIRED_FLUSH_INTERVAL``.
+    """
+    client = redis_cart.redis_client
+    # A cluster only has db 0. Keyspace events stay on the node that
+    # expired the key, so on a cluster rely on scan passes instead.
+    pool = getattr(client, "connection_pool", None)
+    db = pool.connection_kwargs.get("db", 0) if pool else 0
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(f"__keyevent@{db}__:expired")
+    pending = set()
+    last_flush = time.monotonic()
+    try:
+        while not stop():
+            message = pubsub.get_message(timeout=EXPIRED_FLUSH_INTERVAL)
+            if message:
+                session_id = session_id_from_key(message["data"])
+                if session_id:
+                    pending.add(session_id)
+            if pending and time.monotonic() - last_flush >= EXPIRED_FLUSH_INTERVAL:
+                _mark_sessions_expired(pending)
+                last_flush = time.monotonic()
+    finally:
+        if pending:
+            _mark_sessions_expired(pending)
+        pubsub.close()
+
+
+def _mark_sessions_expired(session_ids):
+    CartSnapshot.objects.filter(_not_ended(), session_key__in=session_ids, expired_at__isnull=True).update(
+        expired_at=timezone.now()
+    )
+    session_ids.clear()
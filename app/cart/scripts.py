@@ -0,0 +1,345 @@
+"""Lua sources for the server-side cart operations in ``redis_cart``.
+
+There is one script per operation for each storage layout. All scripts
+take the cart TTL as ``ARGV[1]`` and share the same remaining ``ARGV``
+contract, so ``redis_cart`` only has to pick the layout's keys and item
+encoding; every operation is a single atomic EVALSHA round trip.
+
+A positive TTL refreshes the expiry of every cart key. A negative TTL is
+the lazy mode of ``CART_TTL_STRATEGY``: the caller refreshed recently, so
+only keys that have no expiry yet (just created) get one.
+
+Both layouts pass the cached pricing summary (``cart.pricing``) as the
+last key. Every mutation deletes it; ``read_priced`` returns it, or claims
+it with a ``#<nonce>`` placeholder that ``store_summary`` only replaces if
+no mutation deleted it in between, so a summary priced from an older cart
+is never stored.
+
+split layout, KEYS: qty hash, details hash (JSON per item), promo code,
+summary.
+
+compact layout, KEYS: cart hash, then the three split keys so that carts
+written before the switch are migrated on first touch, then the summary. Items are stored
+as ``<pid> -> "<qty>|<price cents>|<name>"`` next to the ``v`` (schema
+version) and ``promo`` fields, so one key and one EXPIRE cover the cart.
+"""
+
+COMPACT_SCHEMA_VERSION = 1
+
+# The summary (last key) was just deleted, or expires with the cart anyway.
+_SPLIT_TOUCH = """
+local ttl = tonumber(ARGV[1])
+for i = 1, #KEYS - 1 do
+    if ttl > 0 then
+        redis.call('EXPIRE', KEYS[i], ttl)
+    elseif redis.call('TTL', KEYS[i]) == -1 then
+        redis.call('EXPIRE', KEYS[i], -ttl)
+    end
+end
+"""
+
+_INVALIDATE_SUMMARY = """
+redis.call('DEL', KEYS[#KEYS])
+"""
+
+# Returns the cached summary, or claims the slot for ARGV[2] and returns false.
+# The placeholder is short-lived in case the claiming reader never stores.
+_READ_SUMMARY = """
+local function read_summary(exists)
+    local summary = redis.call('GET', KEYS[#KEYS])
+    if summary and string.sub(summary, 1, 1) ~= '#' then
+        return summary
+    end
+    if exists then
+        redis.call('SET', KEYS[#KEYS], '#' .. ARGV[2], 'EX', 60)
+    end
+    return false
+end
+"""
+
+# ARGV: ttl, nonce, summary JSON. Expires with the cart's first key.
+_STORE_SUMMARY = """
+if redis.call('GET', KEYS[#KEYS]) ~= '#' .. ARGV[2] then
+    return 0
+end
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl <= 0 then
+    redis.call('DEL', KEYS[#KEYS])
+    return 0
+end
+redis.call('SET', KEYS[#KEYS], ARGV[3], 'PX', ttl)
+return 1
+"""
+
+SPLIT = {
+    # ARGV: ttl, product_id, quantity, details_json
+    "add_item": _INVALIDATE_SUMMARY + """
+local qty = redis.call('HINCRBY', KEYS[1], ARGV[2], ARGV[3])
+redis.call('HSETNX', KEYS[2], ARGV[2], ARGV[4])
+""" + _SPLIT_TOUCH + """
+return qty
+""",
+    # ARGV: ttl, product_id, delta
+    # Items that drop below one are removed from both hashes.
+    "change_quantity": _INVALIDATE_SUMMARY + """
+local qty = redis.call('HINCRBY', KEYS[1], ARGV[2], ARGV[3])
+if qty < 1 then
+    redis.call('HDEL', KEYS[1], ARGV[2])
+    redis.call('HDEL', KEYS[2], ARGV[2])
+    qty = 0
+end
+""" + _SPLIT_TOUCH + """
+return qty
+""",
+    # ARGV: ttl, product_id, quantity
+    "set_quantity": _INVALIDATE_SUMMARY + """
+if redis.call('HEXISTS', KEYS[2], ARGV[2]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+""" + _SPLIT_TOUCH + """
+return 1
+""",
+    # ARGV: ttl, product_id, quantity, details_json
+    "update_item": _INVALIDATE_SUMMARY + """
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+redis.call('HSET', KEYS[2], ARGV[2], ARGV[4])
+""" + _SPLIT_TOUCH + """
+return 1
+""",
+    # ARGV: ttl, product_id
+    # The promo code is dropped together with the last item.
+    "remove_item": _INVALIDATE_SUMMARY + """
+local removed = redis.call('HDEL', KEYS[1], ARGV[2])
+redis.call('HDEL', KEYS[2], ARGV[2])
+if redis.call('HLEN', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[3])
+end
+""" + _SPLIT_TOUCH + """
+return removed
+""",
+    # ARGV: ttl, promo_code
+    "set_promo_code": _INVALIDATE_SUMMARY + """
+redis.call('SET', KEYS[3], ARGV[2])
+""" + _SPLIT_TOUCH + """
+return 1
+""",
+    # ARGV: ttl, removal count, removed product ids..., then
+    # (product_id, details_json) pairs for items whose details changed.
+    "reconcile": _INVALIDATE_SUMMARY + """
+local removals = tonumber(ARGV[2])
+for i = 3, removals + 2 do
+    redis.call('HDEL', KEYS[1], ARGV[i])
+    redis.call('HDEL', KEYS[2], ARGV[i])
+end
+for i = removals + 3, #ARGV, 2 do
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 1 then
+        redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+    end
+end
+if removals > 0 and redis.call('HLEN', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[3])
+end
+""" + _SPLIT_TOUCH + """
+return 1
+""",
+    # ARGV: ttl
+    "refresh_ttl": _SPLIT_TOUCH + """
+return 1
+""",
+    # ARGV: ttl
+    "clear": """
+return redis.call('DEL', KEYS[1], KEYS[2], KEYS[3], KEYS[4])
+""",
+    # ARGV: ttl
+    # Returns {qty pairs, details pairs, promo code}.
+    "read": """
+return {
+    redis.call('HGETALL', KEYS[1]),
+    redis.call('HGETALL', KEYS[2]),
+    redis.call('GET', KEYS[3]),
+}
+""",
+    # ARGV: ttl, nonce
+    # Returns {qty pairs, details pairs, promo code, cached summary or nil}.
+    "read_priced": _READ_SUMMARY + """
+return {
+    redis.call('HGETALL', KEYS[1]),
+    redis.call('HGETALL', KEYS[2]),
+    redis.call('GET', KEYS[3]),
+    read_summary(redis.call('EXISTS', KEYS[1]) == 1),
+}
+""",
+    "store_summary": _STORE_SUMMARY,
+}
+
+# Moves a split-layout cart into the compact hash, keeping its TTL.
+_COMPACT_MIGRATE = """
+local function migrate()
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return
+    end
+    if redis.call('EXISTS', KEYS[2], KEYS[4]) == 0 then
+        return
+    end
+    local ttl = redis.call('PTTL', KEYS[2])
+    if ttl < 0 then
+        ttl = redis.call('PTTL', KEYS[4])
+    end
+    local qtys = redis.call('HGETALL', KEYS[2])
+    for i = 1, #qtys, 2 do
+        local raw = redis.call('HGET', KEYS[3], qtys[i])
+        if raw then
+            local item = cjson.decode(raw)
+            local cents = math.floor(item.price * 100 + 0.5)
+            redis.call('HSET', KEYS[1], qtys[i],
+                qtys[i + 1] .. '|' .. string.format('%d', cents) .. '|' .. item.name)
+        end
+    end
+    local promo = redis.call('GET', KEYS[4])
+    if promo then
+        redis.call('HSET', KEYS[1], 'promo', promo)
+    end
+    redis.call('HSET', KEYS[1], 'v', '""" + str(COMPACT_SCHEMA_VERSION) + """')
+    if ttl > 0 then
+        redis.call('PEXPIRE', KEYS[1], ttl)
+    end
+    redis.call('DEL', KEYS[2], KEYS[3], KEYS[4])
+end
+migrate()
+"""
+
+_COMPACT_TOUCH = """
+local ttl = tonumber(ARGV[1])
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+elseif redis.call('TTL', KEYS[1]) == -1 then
+    redis.call('EXPIRE', KEYS[1], -ttl)
+end
+"""
+
+_COMPACT_SPLIT_ITEM = """
+local function split_item(value)
+    return string.match(value, '^(%-?%d+)|(.*)$')
+end
+"""
+
+COMPACT = {
+    # ARGV: ttl, product_id, quantity, "<price cents>|<name>"
+    "add_item": _INVALIDATE_SUMMARY + _COMPACT_MIGRATE + _COMPACT_SPLIT_ITEM + """
+local qty = tonumber(ARGV[3])
+local current = redis.call('HGET', KEYS[1], ARGV[2])
+local rest = ARGV[4]
+if current then
+    local current_qty, current_rest = split_item(current)
+    qty = qty + tonumber(current_qty)
+    rest = current_rest
+end
+redis.call('HSET', KEYS[1], ARGV[2], qty .. '|' .. rest)
+redis.call('HSETNX', KEYS[1], 'v', '""" + str(COMPACT_SCHEMA_VERSION) + """')
+""" + _COMPACT_TOUCH + """
+return qty
+""",
+    # ARGV: ttl, product_id, delta
+    "change_quantity": _INVALIDATE_SUMMARY + _COMPACT_MIGRATE + _COMPACT_SPLIT_ITEM + """
+local current = redis.call('HGET', KEYS[1], ARGV[2])
+if not current then
+    return 0
+end
+local current_qty, rest = split_item(current)
+local qty = tonumber(current_qty) + tonumber(ARGV[3])
+if qty < 1 then
+    redis.call('HDEL', KEYS[1], ARGV[2])
+    qty = 0
+else
+    redis.call('HSET', KEYS[1], ARGV[2], qty .. '|' .. rest)
+end
+""" + _COMPACT_TOUCH + """
+return qty
+""",
+    # ARGV: ttl, product_id, quantity
+    "set_quantity": _INVALIDATE_SUMMARY + _COMPACT_MIGRATE + _COMPACT_SPLIT_ITEM + """
+local current = redis.call('HGET', KEYS[1], ARGV[2])
+if not current then
+    return 0
+end
+local _, rest = split_item(current)
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3] .. '|' .. rest)
+""" + _COMPACT_TOUCH + """
+return 1
+""",
+    # ARGV: ttl, product_id, quantity, "<price cents>|<name>"
+    "update_item": _INVALIDATE_SUMMARY + _COMPACT_MIGRATE + """
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3] .. '|' .. ARGV[4])
+redis.call('HSETNX', KEYS[1], 'v', '""" + str(COMPACT_SCHEMA_VERSION) + """')
+""" + _COMPACT_TOUCH + """
+return 1
+""",
+    # ARGV: ttl, product_id
+    # The promo code is dropped together with the last item.
+    "remove_item": _INVALIDATE_SUMMARY + _COMPACT_MIGRATE + """
+local removed = redis.call('HDEL', KEYS[1], ARGV[2])
+local items = redis.call('HLEN', KEYS[1])
+    - redis.call('HEXISTS', KEYS[1], 'v')
+    - redis.call('HEXISTS', KEYS[1], 'promo')
+if items <= 0 then
+    redis.call('DEL', KEYS[1])
+else
+    """ + _COMPACT_TOUCH + """
+end
+return removed
+""",
+    # ARGV: ttl, promo_code
+    "set_promo_code": _INVALIDATE_SUMMARY + _COMPACT_MIGRATE + """
+redis.call('HSET', KEYS[1], 'promo', ARGV[2])
+redis.call('HSETNX', KEYS[1], 'v', '""" + str(COMPACT_SCHEMA_VERSION) + """')
+""" + _COMPACT_TOUCH + """
+return 1
+""",
+    # ARGV: ttl, removal count, removed product ids..., then
+    # (product_id, "<price cents>|<name>") pairs for items whose details changed.
+    "reconcile": _INVALIDATE_SUMMARY + _COMPACT_MIGRATE + _COMPACT_SPLIT_ITEM + """
+local removals = tonumber(ARGV[2])
+for i = 3, removals + 2 do
+    redis.call('HDEL', KEYS[1], ARGV[i])
+end
+for i = removals + 3, #ARGV, 2 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    if current then
+        local qty = split_item(current)
+        redis.call('HSET', KEYS[1], ARGV[i], qty .. '|' .. ARGV[i + 1])
+    end
+end
+local items = redis.call('HLEN', KEYS[1])
+    - redis.call('HEXISTS', KEYS[1], 'v')
+    - redis.call('HEXISTS', KEYS[1], 'promo')
+if removals > 0 and items <= 0 then
+    redis.call('DEL', KEYS[1])
+else
+    """ + _COMPACT_TOUCH + """
+end
+return 1
+""",
+    # ARGV: ttl
+    "refresh_ttl": _COMPACT_MIGRATE + _COMPACT_TOUCH + """
+return 1
+""",
+    # ARGV: ttl
+    "clear": """
+return redis.call('DEL', KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5])
+""",
+    # ARGV: ttl
+    # Returns the flat HGETALL of the cart hash.
+    "read": _COMPACT_MIGRATE + """
+return redis.call('HGETALL', KEYS[1])
+""",
+    # ARGV: ttl, nonce
+    # Returns {flat HGETALL of the cart hash, cached summary or nil}.
+    "read_priced": _COMPACT_MIGRATE + _READ_SUMMARY + """
+return {
+    redis.call('HGETALL', KEYS[1]),
+    read_summary(redis.call('EXISTS', KEYS[1]) == 1),
+}
+""",
+    "store_summary": _STORE_SUMMARY,
+}
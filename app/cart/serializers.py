@@ -1,5 +1,8 @@
+from django.conf import settings
 from rest_framework import serializers
 
+from .pricing import CENT
+
 
 class CartItemSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
@@ -8,11 +11,82 @@ class CartItemSerializer(serializers.Serializer):
     quantity = serializers.IntegerField()
 
 
+class CartLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField()
+    unit_price = serializers.DecimalField(max_digits=12, decimal_places=2)
+    line_total = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class CartSummarySerializer(serializers.Serializer):
+    lines = CartLineSerializer(many=True)
+    item_count = serializers.IntegerField()
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+    promo_code = serializers.CharField(allow_null=True)
+    promo_applied = serializers.BooleanField()
+    discount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class CartResponseSerializer(serializers.Serializer):
+    items = CartItemSerializer(many=True)
+    promo_code = serializers.CharField(allow_null=True)
+    summary = CartSummarySerializer()
+
+
+def _amount(value):
+    return format(value.quantize(CENT), "f")
+
+
+CART_FAST_SERIALIZATION = getattr(settings, "CART_FAST_SERIALIZATION", False)
+
+
+def cart_response(items, promo_code, summary):
+    """The cart response body, per ``CART_FAST_SERIALIZATION``."""
+    if CART_FAST_SERIALIZATION:
+        return cart_response_data(items, promo_code, summary)
+    return CartResponseSerializer({"items": items, "promo_code": promo_code, "summary": summary}).data
+
+
+def cart_response_data(items, promo_code, summary):
+    """``CartResponseSerializer(...).data`` built directly, without per-field serializers."""
+    return {
+        "items": [
+            {
+                "product_id": int(item["product_id"]),
+                "name": str(item["name"]),
+                "price": float(item["price"]),
+                "quantity": int(item["quantity"]),
+            }
+            for item in items
+        ],
+        "promo_code": promo_code,
+        "summary": {
+            "lines": [
+                {
+                    "product_id": line["product_id"],
+                    "quantity": line["quantity"],
+                    "unit_price": _amount(line["unit_price"]),
+                    "line_total": _amount(line["line_total"]),
+                }
+                for line in summary["lines"]
+            ],
+            "item_count": summary["item_count"],
+            "subtotal": _amount(summary["subtotal"]),
+            "promo_code": summary["promo_code"],
+            "promo_applied": summary["promo_applied"],
+            "discount": _amount(summary["discount"]),
+            "total": _amount(summary["total"]),
+        },
+    }
+
+
 class AddToCartSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
-    name = serializers.CharField()
-    price = serializers.FloatField()
     quantity = serializers.IntegerField(min_value=1, default=1)
+    # Ignored: name and price are filled in from the product catalog.
+    name = serializers.CharField(required=False)
+    price = serializers.FloatField(required=False)
 
 
 class RemoveFromCartSerializer(serializers.Serializer):
@@ -33,6 +107,12 @@ class CartPromoSerializer(serializers.Serializer):
     promo_code = serializers.CharField(max_length=200)
 
 
+class CartBatchSerializer(serializers.Serializer):
+    session_ids = serializers.ListField(
+        child=serializers.CharField(max_length=40), min_length=1, max_length=5000
+    )
+
+
 class CheckoutResponseItemSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
     name = serializers.CharField()
@@ -40,3 +120,10 @@ class CheckoutResponseItemSerializer(serializers.Serializer):
     quantity = serializers.IntegerField()
     valid = serializers.BooleanField()
     error = serializers.CharField(allow_blank=True)
+
+
+class CheckoutResponseSerializer(serializers.Serializer):
+    items = CheckoutResponseItemSerializer(many=True)
+    promo_code = serializers.CharField(allow_null=True)
+    summary = CartSummarySerializer()
+    reserved_until = serializers.DateTimeField(allow_null=True)
@@ -0,0 +1,13 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from . import persistence, redis_cart
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    if not redis_cart.CART_PERSISTENCE or request is None or not hasattr(request, "session"):
+        return
+    persistence.merge_on_login(
+        getattr(request.session, "previous_session_key", None), request.session.session_key, user.pk
+    )
@@ -1,3 +1,620 @@
-from django.test import TestCase
+"""Cart tests. The Redis ones need the in-process fakeredis of the bench settings:
 
-# Create your tests here.
+    BENCH_FAKE_REDIS=1 python manage.py test --settings=core.settings_bench
+"""
+import json
+import os
+from collections import OrderedDict
+from contextlib import ExitStack
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, get_user_model
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from core import rate_limit, redis_metrics
+from core.tests import fake_cluster, needs_fakeredis
+from inventory import product_cache
+from inventory.models import Category, Product
+
+from . import async_redis_cart, checks, coalesce, key_migration, persistence, pricing, redis_cart, scanner, serializers
+from .models import Cart, CartSnapshot
+
+fake_redis = skipUnless(os.environ.get("BENCH_FAKE_REDIS"), "needs BENCH_FAKE_REDIS=1 --settings=core.settings_bench")
+
+redis_client = settings.REDIS_CLIENT
+
+SESSION = "s" * 32
+
+
+def round_trips(operation, *args, **kwargs):
+    with redis_metrics.track() as stats:
+        operation(*args, **kwargs)
+    return stats.round_trips
+
+
+async def async_round_trips(operation, *args, **kwargs):
+    with redis_metrics.track() as stats:
+        await operation(*args, **kwargs)
+    return stats.round_trips
+
+
+@fake_redis
+class CartRoundTripTests(TestCase):
+    """Every cart operation on a warm connection is one Redis round trip."""
+
+    def setUp(self):
+        redis_client.flushall()
+        redis_cart.add_to_cart(SESSION, 1, 1, "Tea", "1.50")
+        redis_cart.add_to_cart(SESSION, 2, 1, "Cake", "4.00")
+
+    def assertOneRoundTrip(self, operation, *args):
+        operation(*args)  # loads the script
+        self.assertEqual(round_trips(operation, *args), 1, operation.__name__)
+
+    @mock.patch.object(redis_cart, "CART_PERSISTENCE", True)
+    def test_mutations(self):
+        self.assertOneRoundTrip(redis_cart.add_to_cart, SESSION, 3, 1, "Jam", "3.00")
+        self.assertOneRoundTrip(redis_cart.increment_quantity, SESSION, 1)
+        self.assertOneRoundTrip(redis_cart.decrement_quantity, SESSION, 1)
+        self.assertOneRoundTrip(redis_cart.set_quantity, SESSION, 1, 4)
+        self.assertOneRoundTrip(redis_cart.set_cart_promo_code, SESSION, "SPRING")
+        self.assertOneRoundTrip(redis_cart.remove_cart, SESSION, 3)
+        self.assertEqual(redis_client.smembers(redis_cart.DIRTY_KEY), {SESSION})
+
+    def test_script_flush_is_recovered_without_replaying(self):
+        redis_cart.increment_quantity(SESSION, 1)
+        redis_client.script_flush()
+        redis_cart.increment_quantity(SESSION, 1)
+        self.assertEqual(redis_cart.get_cart(SESSION)[0]["quantity"], 3)
+
+    def test_warm_priced_read(self):
+        first = redis_cart.get_priced_cart(SESSION)  # prices the cart and stores the summary
+        with redis_metrics.track() as stats:
+            second = redis_cart.get_priced_cart(SESSION)
+        self.assertEqual(stats.round_trips, 1)
+        self.assertEqual(second, first)
+
+    def test_checkout_reconcile(self):
+        redis_cart.reconcile_cart(SESSION, updates=[(1, "Tea", "1.50")])
+        self.assertEqual(round_trips(
+            redis_cart.reconcile_cart, SESSION, removals=[2], updates=[(1, "Green tea", "2.00")]
+        ), 1)
+        self.assertEqual(redis_cart.get_cart(SESSION), [
+            {"product_id": 1, "name": "Green tea", "price": 2.0, "quantity": 1},
+        ])
+
+    async def test_async_mutation_and_priced_read(self):
+        await async_redis_cart.add_to_cart(SESSION, 3, 1, "Jam", "3.00")
+        self.assertEqual(await async_round_trips(async_redis_cart.add_to_cart, SESSION, 3, 1, "Jam", "3.00"), 1)
+        await async_redis_cart.get_priced_cart(SESSION)
+        self.assertEqual(await async_round_trips(async_redis_cart.get_priced_cart, SESSION), 1)
+        await async_redis_cart.reconcile_cart(SESSION, removals=[3])
+        self.assertEqual(await async_round_trips(async_redis_cart.reconcile_cart, SESSION, removals=[2]), 1)
+
+
+@fake_redis
+@mock.patch.object(rate_limit, "_limiters", {})
+class CheckoutRoundTripTests(TestCase):
+    """A checkout costs the same round trips whatever the size of the cart."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Pantry", slug="pantry", is_active=True)
+        cls.product_ids = [
+            product.id for product in Product.objects.bulk_create(
+                Product(category=category, name=f"Item {n}", slug=f"item-{n}", price="2.00", stock=100, is_active=True)
+                for n in range(50)
+            )
+        ]
+
+    def setUp(self):
+        redis_client.flushall()
+        product_cache._local.clear()
+
+    def checkout(self, product_ids):
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session.create()
+        for product_id in product_ids:
+            # Stale name and price, so every line needs a correction.
+            redis_cart.add_to_cart(session.session_key, product_id, 1, "Old name", "0.01")
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        with redis_metrics.track() as stats:
+            response = self.client.post("/api/cart/checkout/")
+        self.assertEqual(response.status_code, 200)
+        return stats.round_trips
+
+    def test_round_trips_do_not_grow_with_the_cart(self):
+        self.checkout(self.product_ids)  # builds the catalog snapshot, loads stock and scripts
+        self.assertEqual(self.checkout(self.product_ids[:1]), self.checkout(self.product_ids))
+
+    def test_original_response_shape_is_kept_next_to_v2(self):
+        self.checkout(self.product_ids[:2])
+        for prefix in ("/api/cart/", "/api/cart/async/"):
+            items = self.client.post(prefix + "checkout/").json()
+            self.assertEqual([item["name"] for item in items], ["Item 0", "Item 1"])
+            self.assertEqual(set(items[0]), {"product_id", "name", "price", "quantity", "valid", "error"})
+            data = self.client.post(prefix + "checkout/v2/").json()
+            self.assertEqual(set(data), {"items", "promo_code", "summary", "reserved_until"})
+            self.assertEqual(data["items"], items)
+            self.assertEqual(data["summary"]["total"], "4.00")
+
+
+class CartResponseTests(SimpleTestCase):
+    items = [
+        {"product_id": 1, "name": "Tea", "price": 1.5, "quantity": 3},
+        {"product_id": 2, "name": "Cake", "price": 4.0, "quantity": 1},
+    ]
+
+    def test_fast_serialization_renders_the_same_json(self):
+        summary = pricing.price_cart(self.items, "WELCOME10")
+        expected = serializers.CartResponseSerializer(
+            {"items": self.items, "promo_code": "WELCOME10", "summary": summary}
+        ).data
+        for fast in (False, True):
+            with mock.patch.object(serializers, "CART_FAST_SERIALIZATION", fast):
+                data = serializers.cart_response(self.items, "WELCOME10", summary)
+            self.assertEqual(json.dumps(data), json.dumps(expected))
+
+class DeltaBufferTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(coalesce.DeltaBuffer, "_ensure_worker"))
+        self.written = []
+        self.buffer = coalesce.DeltaBuffer(100, self.written.append)
+
+    def test_flush_writes_net_deltas_once(self):
+        for session_id, product_id, delta in (("a", 1, 1), ("a", 1, 1), ("a", 2, 1), ("a", 2, -1), ("b", 3, -1)):
+            self.buffer.add(session_id, product_id, delta)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.written, [{"a": {1: 2}, "b": {3: -1}}])
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.written), 1)
+
+    def test_read_applies_only_what_redis_has_not_seen(self):
+        self.buffer.add("a", 1, 2)
+        self.buffer.add("b", 1, 5)
+        self.assertEqual(self.buffer.read(["a"], lambda: "redis"), ("redis", {"a": {1: 2}}))
+
+    def test_read_is_repeated_when_a_write_overlaps_it(self):
+        self.buffer.add("a", 1, 2)
+        reads = []
+
+        def read():
+            reads.append(len(reads))
+            if len(reads) == 1:
+                self.buffer.flush()
+            return reads[-1]
+
+        self.assertEqual(self.buffer.read(["a"], read), (1, {}))
+
+    def test_failed_write_is_dropped_and_logged(self):
+        self.buffer.add("a", 1, 1)
+        self.buffer._flush = mock.Mock(side_effect=ConnectionError)
+        with self.assertLogs("cart.coalesce", "ERROR"):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.stats()["pending_sessions"], 0)
+        self.assertEqual(self.buffer.read(["a"], lambda: None), (None, {}))
+
+    def test_failure_before_the_write_starts_is_logged(self):
+        with mock.patch.object(self.buffer, "writing", side_effect=RuntimeError), \
+                self.assertLogs("cart.coalesce", "ERROR"):
+            self.assertEqual(self.buffer.flush(), 0)
+
+class LazyTtlTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        for name, value in (
+            ("CART_TTL_STRATEGY", redis_cart.LAZY),
+            ("CART_STORAGE", redis_cart.SPLIT),
+            ("_last_refresh", OrderedDict()),
+            ("_ttl_counters", {"expires_sent": 0, "expires_avoided": 0}),
+        ):
+            self.enterContext(mock.patch.object(redis_cart, name, value))
+        self.enterContext(mock.patch.object(redis_cart.time, "monotonic", lambda: self.now))
+
+    def test_refresh_at_most_once_per_interval(self):
+        ttl = redis_cart.CART_TTL
+        self.assertEqual(redis_cart._ttl_arg("add_item", SESSION), ttl)
+        self.now += redis_cart.CART_TTL_REFRESH_AFTER - 1
+        self.assertEqual(redis_cart._ttl_arg("change_quantity", SESSION), -ttl)
+        self.assertEqual(redis_cart._ttl_arg("add_item", "other"), ttl)
+        self.now += 1
+        self.assertEqual(redis_cart._ttl_arg("add_item", SESSION), ttl)
+        self.assertEqual(redis_cart._ttl_counters, {"expires_sent": 9, "expires_avoided": 3})
+
+    def test_refresh_ttl_and_reads(self):
+        redis_cart._ttl_arg("add_item", SESSION)
+        self.assertEqual(redis_cart._ttl_arg("refresh_ttl", SESSION), redis_cart.CART_TTL)
+        self.assertEqual(redis_cart._ttl_arg("read", SESSION), redis_cart.CART_TTL)
+        self.assertEqual(redis_cart._ttl_counters, {"expires_sent": 6, "expires_avoided": 0})
+
+    def test_clear_forgets_the_session(self):
+        redis_cart._ttl_arg("add_item", SESSION)
+        redis_cart._ttl_arg("clear", SESSION)
+        self.assertEqual(redis_cart._ttl_arg("add_item", SESSION), redis_cart.CART_TTL)
+
+    def test_tracked_sessions_are_bounded(self):
+        with mock.patch.object(redis_cart, "_MAX_TRACKED_SESSIONS", 2):
+            for session_id in ("a", "b", "c"):
+                redis_cart._ttl_arg("add_item", session_id)
+        self.assertEqual(list(redis_cart._last_refresh), ["b", "c"])
+
+    @fake_redis
+    def test_skipped_refresh_still_expires_new_keys(self):
+        redis_client.flushall()
+        redis_cart.add_to_cart(SESSION, 1, 1, "Tea", "1.50")
+        qty_key = redis_cart._qty_key(SESSION)
+        redis_client.expire(qty_key, 60)
+        redis_cart.set_cart_promo_code(SESSION, "WELCOME10")
+        self.assertLessEqual(redis_client.ttl(qty_key), 60)
+        self.assertGreater(redis_client.ttl(redis_cart._promo_key(SESSION)), 60)
+
+def quantities(cart_items):
+    return sorted((item["product_id"], item["quantity"]) for item in cart_items)
+
+
+@fake_redis
+class CartPersistenceTests(TestCase):
+    """Write-behind of signed-in carts: flush, login merge, restore after expiry, crash replay."""
+
+    def setUp(self):
+        self.enterContext(mock.patch.object(redis_cart, "CART_PERSISTENCE", True))
+        redis_client.flushall()
+        self.user = get_user_model().objects.create_user("shopper")
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(self.user.pk)
+        session.create()
+        self.session_id = session.session_key
+        redis_cart.add_to_cart(self.session_id, 1, 2, "Tea", "1.50")
+
+    def saved(self):
+        cart = Cart.objects.get(user=self.user)
+        return sorted((item.product_id, item.quantity) for item in cart.items.all()), cart.promo_code
+
+    def expire(self):
+        redis_client.delete(*redis_cart._cart_keys(self.session_id))
+
+    def test_flush_saves_signed_in_carts_only(self):
+        redis_cart.set_cart_promo_code(self.session_id, "SPRING")
+        redis_cart.add_to_cart("anonymous", 1, 1, "Tea", "1.50")
+        self.assertEqual(persistence.flush_all(), (2, 1))
+        self.assertEqual(self.saved(), ([(1, 2)], "SPRING"))
+        self.assertEqual(persistence.flush_all(), (0, 0))
+
+    def test_expired_cart_is_restored_on_read_and_on_change(self):
+        persistence.flush_all()
+        self.expire()
+        self.assertEqual(quantities(redis_cart.get_cart(self.session_id)), [(1, 2)])
+        self.expire()
+        redis_cart.add_to_cart(self.session_id, 2, 1, "Cake", "4.00")
+        self.assertEqual(quantities(redis_cart.get_cart(self.session_id)), [(1, 2), (2, 1)])
+
+    def test_expired_cart_does_not_overwrite_the_saved_one(self):
+        persistence.flush_all()
+        redis_cart.add_to_cart(self.session_id, 2, 1, "Cake", "4.00")
+        self.expire()  # the flusher was down for longer than CART_TTL
+        self.assertEqual(persistence.flush_all(), (1, 0))
+        self.assertEqual(self.saved(), ([(1, 2)], ""))
+
+    def test_emptied_cart_is_saved_empty_and_not_restored(self):
+        persistence.flush_all()
+        redis_cart.remove_cart(self.session_id, 1)
+        self.assertEqual(redis_cart.get_cart(self.session_id), [])
+        persistence.flush_all()
+        self.assertEqual(self.saved(), ([], ""))
+        self.assertEqual(redis_cart.get_cart(self.session_id), [])
+
+    def test_cleared_cart_is_saved_empty(self):
+        persistence.flush_all()
+        redis_cart.clear_cart(self.session_id)
+        self.assertEqual(redis_cart.get_cart(self.session_id), [])
+        persistence.flush_all()
+        self.assertEqual(self.saved(), ([], ""))
+
+    def test_crash_replays_the_batch(self):
+        with mock.patch.object(persistence, "save_carts", side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                persistence.flush_dirty()
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(persistence.flush_dirty(), (1, 1))
+        self.assertEqual(self.saved(), ([(1, 2)], ""))
+        self.assertFalse(redis_client.exists(persistence.FLUSHING_KEY))
+
+    @mock.patch.object(rate_limit, "_limiters", {})
+    def test_login_merges_the_anonymous_cart_into_the_saved_one(self):
+        persistence.save_carts({self.user.pk: ([
+            {"product_id": 1, "name": "Tea", "price": "1.50", "quantity": 2},
+            {"product_id": 3, "name": "Jam", "price": "3.00", "quantity": 1},
+        ], "SPRING")})
+        anonymous = import_module(settings.SESSION_ENGINE).SessionStore()
+        anonymous.create()
+        redis_cart.add_to_cart(anonymous.session_key, 1, 5, "Tea", "1.50")
+        redis_cart.add_to_cart(anonymous.session_key, 2, 1, "Cake", "4.00")
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = anonymous.session_key
+
+        self.client.force_login(self.user)
+        session_id = self.client.session.session_key
+        self.assertNotEqual(session_id, anonymous.session_key)
+        cart_items, promo_code = redis_cart.get_cart_with_promo_code(session_id)
+        self.assertEqual(quantities(cart_items), [(1, 5), (2, 1), (3, 1)])
+        self.assertEqual(promo_code, "SPRING")
+        self.assertEqual(redis_cart.get_cart(anonymous.session_key), [])
+
+
+@fake_redis
+@mock.patch.object(rate_limit, "_limiters", {})
+class AbandonedCartTests(TestCase):
+    """Only carts that expire in Redis are abandoned, not the ones cleared or checked out."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Tea", slug="tea", is_active=True)
+        cls.product = Product.objects.create(
+            category=category, name="Green", slug="green", price="1.50", stock=5, is_active=True,
+        )
+
+    def setUp(self):
+        redis_client.flushall()
+        product_cache._local.clear()
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session.create()
+        self.session_id = session.session_key
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = self.session_id
+        redis_cart.add_to_cart(self.session_id, self.product.id, 1, "Green", "1.50")
+        self.assertEqual(scanner.snapshot_page([self.session_id]), 1)
+
+    def expire_all(self):
+        later = timezone.now() + timedelta(seconds=redis_cart.CART_TTL + 1)
+        scanner.mark_expired(now=later)
+        scanner._mark_sessions_expired({self.session_id})
+        return CartSnapshot.objects.get(session_key=self.session_id)
+
+    def test_expired_cart_is_abandoned(self):
+        self.assertIsNotNone(self.expire_all().expired_at)
+
+    def test_checked_out_cart_is_not_abandoned(self):
+        self.assertEqual(self.client.post("/api/cart/checkout/").status_code, 200)
+        self.assertEqual(self.client.post("/api/cart/checkout/complete/").status_code, 200)
+        snapshot = self.expire_all()
+        self.assertIsNone(snapshot.expired_at)
+        self.assertEqual(snapshot.end_reason, scanner.CHECKED_OUT)
+
+    def test_cleared_cart_is_not_abandoned(self):
+        self.assertEqual(self.client.delete("/api/cart/get/").status_code, 200)
+        self.assertIsNone(self.expire_all().expired_at)
+
+    def test_cart_filled_again_after_a_clear_can_be_abandoned(self):
+        self.client.delete("/api/cart/get/")
+        redis_cart.add_to_cart(self.session_id, self.product.id, 1, "Green", "1.50")
+        scanner.snapshot_page([self.session_id])
+        self.assertIsNotNone(self.expire_all().expired_at)
+
+
+@fake_redis
+@mock.patch.object(rate_limit, "_limiters", {})
+class AsyncViewCsrfTests(TestCase):
+    """The async views check CSRF like DRF's SessionAuthentication: only for signed-in sessions."""
+
+    def setUp(self):
+        redis_client.flushall()
+        self.client = Client(enforce_csrf_checks=True)
+
+    def test_anonymous_session_needs_no_token(self):
+        self.assertEqual(self.client.delete("/api/cart/async/get/").status_code, 200)
+
+    def test_signed_in_session_needs_a_token(self):
+        self.client.force_login(get_user_model().objects.create_user("shopper"))
+        response = self.client.delete("/api/cart/async/get/")
+        self.assertEqual(response.status_code, 403)
+        self.assertIn("CSRF Failed", response.json()["detail"])
+
+        token = "t" * 32
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = token
+        response = self.client.delete("/api/cart/async/get/", headers={"X-CSRFToken": token})
+        self.assertEqual(response.status_code, 200)
+
+    def test_safe_methods_need_no_token(self):
+        self.client.force_login(get_user_model().objects.create_user("shopper"))
+        self.assertEqual(self.client.get("/api/cart/async/get/").status_code, 200)
+
+
+@fake_redis
+@mock.patch.object(redis_cart, "CART_PERSISTENCE", True)
+class MigrateCartKeysTests(TestCase):
+    def setUp(self):
+        redis_client.flushall()
+
+    def hash_tagged(self):
+        return mock.patch.multiple(
+            redis_cart, CART_KEY_HASH_TAGS=True, DIRTY_KEY="carts:{dirty}", EMPTIED_KEY="carts:{dirty}:emptied",
+        )
+
+    def migrate(self):
+        out = StringIO()
+        call_command("migrate_cart_keys", stdout=out)
+        return out.getvalue()
+
+    def test_moves_plain_keys(self):
+        redis_cart.add_to_cart("a", 1, 2, "Tea", "1.50")
+        redis_cart.set_cart_promo_code("a", "SPRING")
+        with self.hash_tagged():
+            output = self.migrate()
+            self.assertEqual(redis_cart.get_cart_with_promo_code("a"), (
+                [{"product_id": 1, "name": "Tea", "price": 1.5, "quantity": 2}], "SPRING",
+            ))
+            self.assertEqual(redis_client.smembers("carts:{dirty}"), {"a"})
+        self.assertIn("Moved 3 cart keys, merged 0 carts", output)
+        self.assertEqual(redis_client.keys("cart:a*"), [])
+        self.assertFalse(redis_client.exists("carts:dirty"))
+
+    def test_merges_into_a_cart_written_since_the_switch(self):
+        redis_cart.add_to_cart("b", 1, 1, "Tea", "1.50")
+        redis_cart.add_to_cart("b", 2, 3, "Cake", "4.00")
+        redis_cart.set_cart_promo_code("b", "OLD")
+        with self.hash_tagged():
+            redis_cart.add_to_cart("b", 1, 4, "Green tea", "2.00")
+            redis_cart.set_cart_promo_code("b", "NEW")
+            output = self.migrate()
+            cart_items, promo_code = redis_cart.get_cart_with_promo_code("b")
+        self.assertIn("merged 1 carts", output)
+        self.assertEqual(sorted(cart_items, key=lambda item: item["product_id"]), [
+            {"product_id": 1, "name": "Green tea", "price": 2.0, "quantity": 5},
+            {"product_id": 2, "name": "Cake", "price": 4.0, "quantity": 3},
+        ])
+        self.assertEqual(promo_code, "NEW")
+        self.assertEqual(redis_client.keys("cart:b*"), [])
+
+    def test_keeps_the_old_promo_code_if_the_new_cart_has_none(self):
+        redis_cart.add_to_cart("c", 1, 1, "Tea", "1.50")
+        redis_cart.set_cart_promo_code("c", "OLD")
+        with self.hash_tagged():
+            redis_cart.add_to_cart("c", 2, 1, "Cake", "4.00")
+            self.migrate()
+            cart_items, promo_code = redis_cart.get_cart_with_promo_code("c")
+        self.assertEqual(len(cart_items), 2)
+        self.assertEqual(promo_code, "OLD")
+
+    def test_cart_written_while_the_page_is_read_is_merged_not_overwritten(self):
+        redis_cart.add_to_cart("d", 1, 1, "Tea", "1.50")
+        move = key_migration._move
+
+        def write_then_move(**kwargs):
+            redis_cart.add_to_cart("d", 2, 1, "Cake", "4.00")
+            return move(**kwargs)
+
+        with self.hash_tagged(), mock.patch.object(key_migration, "_move", side_effect=write_then_move):
+            output = self.migrate()
+            cart_items = redis_cart.get_cart("d")
+        self.assertIn("merged 1 carts", output)
+        self.assertEqual(sorted(item["product_id"] for item in cart_items), [1, 2])
+
+    def test_rerun_after_a_crash_adds_nothing_twice(self):
+        redis_cart.add_to_cart("e", 1, 2, "Tea", "1.50")
+        redis_cart.add_to_cart("f", 1, 2, "Tea", "1.50")
+        with self.hash_tagged():
+            redis_cart.add_to_cart("f", 1, 1, "Tea", "1.50")
+            # Stopped after the copies were written, before the old keys were deleted.
+            with mock.patch.object(key_migration, "_delete", side_effect=ConnectionError):
+                with self.assertRaises(ConnectionError):
+                    self.migrate()
+                with self.assertRaises(ConnectionError):
+                    key_migration.merge_carts(["f"])
+            output = self.migrate()
+            quantities = [redis_cart.get_cart(session_id)[0]["quantity"] for session_id in "ef"]
+        self.assertIn("Moved 0 cart keys, merged 0 carts", output)
+        self.assertEqual(quantities, [2, 3])
+        self.assertEqual(redis_client.keys("cart:e*") + redis_client.keys("cart:f*"), [])
+
+    def test_keeps_old_keys_it_cannot_merge(self):
+        redis_cart.add_to_cart("g", 1, 1, "Tea", "1.50")
+        redis_client.hset("cart:g:details", "7", json.dumps({"product_id": 7, "name": "Jam", "price": 3.0}))
+        with self.hash_tagged():
+            redis_cart.add_to_cart("g", 2, 1, "Cake", "4.00")
+            output = self.migrate()
+            self.assertEqual(len(redis_cart.get_cart("g")), 2)
+        self.assertIn("Kept 1 old cart keys", output)
+        self.assertEqual(redis_client.keys("cart:g:*"), ["cart:g:details"])
+
+    def test_refuses_without_hash_tags(self):
+        with self.assertRaisesMessage(CommandError, "CART_KEY_HASH_TAGS is off"):
+            self.migrate()
+
+
+@fake_redis
+@needs_fakeredis
+class MigrateCartKeysOnClusterTests(TestCase):
+    """The migration on three stub primaries, where old and new keys live on different nodes."""
+
+    def setUp(self):
+        self.client, self.nodes = fake_cluster()
+        scripts_ = {
+            layout: {name: self.client.register_script(script.script) for name, script in by_name.items()}
+            for layout, by_name in redis_cart._scripts.items()
+        }
+        merge = {
+            layout: self.client.register_script(script.script) for layout, script in key_migration._merge.items()
+        }
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch.multiple(
+                redis_cart, redis_client=self.client, _scripts=scripts_,
+                CART_KEY_HASH_TAGS=True, DIRTY_KEY="carts:{dirty}",
+            ))
+            stack.enter_context(mock.patch.multiple(
+                key_migration, _move=self.client.register_script(key_migration._MOVE), _merge=merge,
+            ))
+            self.addCleanup(stack.pop_all().close)
+
+    def write_old_cart(self, session_id, quantity, promo_code=None):
+        self.client.hset(f"cart:{session_id}:qty", "1", quantity)
+        self.client.hset(f"cart:{session_id}:details", "1", redis_cart._encode_item(1, "Tea", "1.50"))
+        if promo_code:
+            self.client.set(f"cart:{session_id}:promo_code", promo_code)
+        self.client.sadd("carts:dirty", session_id)
+
+    def test_moves_and_merges_across_nodes(self):
+        self.write_old_cart("a", 2, "SPRING")
+        self.write_old_cart("b", 2)
+        redis_cart.add_to_cart("b", 1, 1, "Tea", "1.50")
+        nodes = {self.client.get_node_from_key(key).port for key in self.client.scan_iter(match="cart:*")}
+        self.assertGreater(len(nodes), 1)
+
+        out = StringIO()
+        call_command("migrate_cart_keys", stdout=out)
+        self.assertIn("Moved 3 cart keys, merged 1 carts written since the switch, requeued 2 dirty carts", out.getvalue())
+        self.assertEqual(redis_cart.get_cart_with_promo_code("a"), (
+            [{"product_id": 1, "name": "Tea", "price": 1.5, "quantity": 2}], "SPRING",
+        ))
+        self.assertEqual(redis_cart.get_cart("b")[0]["quantity"], 3)
+        self.assertEqual(sorted(self.client.scan_iter(match="cart:[ab]:*")), [])
+        self.assertEqual(key_migration.merge_carts(["b"]), (0, 0))
+        self.assertEqual(redis_cart.get_cart("b")[0]["quantity"], 3)
+
+
+class CartKeySlotCheckTests(SimpleTestCase):
+    def run_check(self, **patches):
+        with mock.patch.multiple(redis_cart, **patches):
+            return [error.id for error in checks.check_cart_key_slots(None)]
+
+    def test_single_node_needs_nothing(self):
+        self.assertEqual(self.run_check(CART_KEY_HASH_TAGS=False), [])
+
+    @override_settings(REDIS_CLUSTER=True)
+    def test_cluster_without_hash_tags(self):
+        self.assertEqual(self.run_check(CART_KEY_HASH_TAGS=False), ["cart.E001"])
+
+    def run_tagged_check(self, flushing_key):
+        with mock.patch.multiple(
+            persistence, FLUSHING_KEY=flushing_key, EMPTIED_FLUSHING_KEY="carts:{dirty}:emptied:flushing",
+        ):
+            return self.run_check(
+                CART_KEY_HASH_TAGS=True, DIRTY_KEY="carts:{dirty}", EMPTIED_KEY="carts:{dirty}:emptied",
+            )
+
+    @override_settings(REDIS_CLUSTER=True)
+    def test_cluster_with_hash_tags(self):
+        self.assertEqual(self.run_tagged_check("carts:{dirty}:flushing"), [])
+
+    @override_settings(REDIS_CLUSTER=True)
+    def test_cluster_with_keys_in_several_slots(self):
+        self.assertEqual(self.run_tagged_check("carts:dirty:flushing"), ["cart.E002"])
+
+
+class CartPersistenceCheckTests(SimpleTestCase):
+    def run_check(self, persistence_on):
+        with mock.patch.object(redis_cart, "CART_PERSISTENCE", persistence_on):
+            return [error.id for error in checks.check_cart_persistence(None)]
+
+    def test_redis_session_engine(self):
+        with self.settings(SESSION_ENGINE="core.redis_session"):
+            self.assertEqual(self.run_check(True), [])
+
+    def test_engine_without_the_previous_session_key(self):
+        with self.settings(SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies"):
+            self.assertEqual(self.run_check(True), ["cart.E003"])
+            self.assertEqual(self.run_check(False), [])
@@ -1,6 +1,7 @@
 from django.urls import path
 
 from .views import *
+from .async_views import *
 
 urlpatterns = [
     path("add/", AddToCartView.as_view()),
@@ -10,5 +11,19 @@ urlpatterns = [
     path("update/qty/", SetQuantityView.as_view()),
     path("promo/", CartPromoView.as_view()),
     path("checkout/", CartCheckoutView.as_view()),
+    path("checkout/v2/", CartCheckoutV2View.as_view()),
+    path("checkout/complete/", CartCheckoutCompleteView.as_view()),
+    path("batch/", CartBatchView.as_view()),
+
+    # Native async variants, for deployments served through core.asgi.
+    path("async/add/", AsyncAddToCartView.as_view()),
+    path("async/get/", AsyncCartView.as_view()),
+    path("async/delete/", AsyncRemoveFromCartView.as_view()),
+    path("async/increment/", AsyncUpdateQuantityView.as_view()),
+    path("async/update/qty/", AsyncSetQuantityView.as_view()),
+    path("async/promo/", AsyncCartPromoView.as_view()),
+    path("async/checkout/", AsyncCartCheckoutView.as_view()),
+    path("async/checkout/v2/", AsyncCartCheckoutV2View.as_view()),
+    path("async/checkout/complete/", AsyncCartCheckoutCompleteView.as_view()),
 
 ]
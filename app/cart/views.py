@@ -2,52 +2,73 @@ from django.shortcuts import render
 from .serializers import *
 from drf_spectacular.utils import extend_schema
 from rest_framework.views import APIView
-from . import redis_cart
-from inventory.models import Product
+from . import pricing, redis_cart, scanner
+from inventory import product_cache, stock
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 
 
 class CartView(APIView):
     @extend_schema(
-        responses={200: CartItemSerializer(many=True)},
-        description="Get all cart items for the current session.",
+        responses={200: CartResponseSerializer},
+        description="Get all cart items for the current session, with line totals, subtotal and promo discount.",
     )
     def get(self, request):
         session_id = request.session.session_key
-        cart_data = redis_cart.get_cart(session_id)
-        promo_code = redis_cart.get_cart_promo_code(session_id)
-        return Response(
-            {"items": cart_data, "promo_code": promo_code},
-        )
+        cart_data, promo_code, summary = redis_cart.get_priced_cart(session_id)
+        return Response(cart_response(cart_data, promo_code, summary))
 
     def delete(self, request):
         session_id = request.session.session_key
         redis_cart.clear_cart(session_id)
+        if session_id:
+            stock.release(session_id)
+            scanner.mark_ended(session_id, scanner.CLEARED)
         return Response({"message": "Cart cleared."}, status=status.HTTP_200_OK)
 
 
+class CartBatchView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        request=CartBatchSerializer,
+        responses={200: None},
+        description="Staff only. Carts of many sessions, read in pipelined chunks.",
+    )
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session_ids = list(dict.fromkeys(serializer.validated_data["session_ids"]))
+        return Response({"carts": redis_cart.get_carts(session_ids)})
+
+
 class AddToCartView(APIView):
     @extend_schema(
         request=AddToCartSerializer,
         responses={200: None},
-        description="Add a product to the cart. Product data is sent from client.",
+        description="Add a product to the cart. Name and price come from the product catalog, not the client.",
     )
     def post(self, request):
+        serializer = AddToCartSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        # ✅ In-process LRU over the Redis catalog snapshot: no I/O when warm
+        product = product_cache.get_product(data["product_id"])
+        if not product or not product["is_active"]:
+            return Response({"error": "Product not found."}, status=404)
+
         if not request.session.session_key:
             request.session.create()
         session_id = request.session.session_key
 
-        serializer = AddToCartSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-
-        data = serializer.validated_data
         redis_cart.add_to_cart(
             session_id,
-            product_id=data["product_id"],
+            product_id=product["id"],
             quantity=data["quantity"],
-            name=data["name"],
-            price=data["price"],
+            name=product["name"],
+            price=product["price"],
         )
 
         return Response({"message": "Added to cart."}, status=status.HTTP_200_OK)
@@ -79,8 +100,11 @@ class UpdateQuantityView(APIView):
     )
     def post(self, request):
         session_id = request.session.session_key
-        product_id = request.data.get("product_id")
-        action = request.data.get("action", "inc")  # "inc" or "dec"
+
+        serializer = UpdateQuantitySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product_id = serializer.validated_data["product_id"]
+        action = serializer.validated_data["action"]
 
         if action == "inc":
             redis_cart.increment_quantity(session_id, product_id)
@@ -132,47 +156,98 @@ class CartPromoView(APIView):
 class CartCheckoutView(APIView):
     @extend_schema(
         responses={200: CheckoutResponseItemSerializer(many=True)},
-        description="Validate and sanitize the cart before checkout. Removes missing products and updates price/name if needed.",
+        description="Validate and sanitize the cart before checkout. Removes missing products and updates price/name if needed. "
+                    "Returns the items only; checkout/v2/ adds the promo code, the price summary and the stock reservation.",
     )
     def post(self, request):
+        return Response(CheckoutResponseItemSerializer(self.checkout(request)["items"], many=True).data)
+
+    def checkout(self, request):
         session_id = request.session.session_key
-        cart_items = redis_cart.get_cart(session_id)
+        cart_items, promo_code = redis_cart.get_cart_with_promo_code(session_id)
 
         if not cart_items:
-            return Response([])
+            return {"items": [], "promo_code": None, "summary": pricing.price_cart([]), "reserved_until": None}
 
         product_ids = [item["product_id"] for item in cart_items]
 
-        # ✅ Single DB hit: get all products that are still active
-        products = Product.objects.filter(id__in=product_ids, is_active=True)
-        product_map = {product.id: product for product in products}
+        # ✅ Served from the Redis catalog snapshot: no DB hit when warm
+        product_map = {
+            pid: product
+            for pid, product in product_cache.get_products(product_ids).items()
+            if product["is_active"]
+        }
 
         cleaned_cart = []
+        removals = []
+        updates = []
 
         for item in cart_items:
             product_id = item["product_id"]
             product = product_map.get(product_id)
 
             if not product:
-                redis_cart.remove_from_cart(session_id, product_id)
+                removals.append(product_id)
                 continue
 
             # Check if Redis-stored name/price differs
-            if item["name"] != product.name or float(item["price"]) != float(
-                product.price
+            if item["name"] != product["name"] or float(item["price"]) != float(
+                product["price"]
             ):
-                redis_cart.update_cart_item(
-                    session_id,
-                    product_id,
-                    product.name,
-                    product.price,
-                    item["quantity"],
-                )
-                item["name"] = product.name
-                item["price"] = float(product.price)
+                updates.append((product_id, product["name"], product["price"]))
+                item["name"] = product["name"]
+                item["price"] = float(product["price"])
 
             item["valid"] = True
             item["error"] = ""
             cleaned_cart.append(item)
 
-        return Response(cleaned_cart)
+        # ✅ Single Redis round trip for all corrections, whatever the cart size
+        if removals or updates:
+            redis_cart.reconcile_cart(session_id, removals=removals, updates=updates)
+
+        # ✅ Held on atomic Redis counters: no row locks, however hot the SKU
+        reserved_until = None
+        if cleaned_cart:
+            try:
+                reserved_until = stock.reserve(
+                    session_id, {item["product_id"]: item["quantity"] for item in cleaned_cart}
+                )
+            except stock.InsufficientStock as exc:
+                stock.release(session_id)
+                for item in cleaned_cart:
+                    if item["product_id"] in exc.shortages:
+                        item["valid"] = False
+                        item["error"] = f"Only {exc.shortages[item['product_id']]} left in stock."
+
+        # The promo code goes with the last item.
+        promo_code = promo_code if cleaned_cart else None
+        summary = pricing.price_cart(cleaned_cart, promo_code)
+        return {"items": cleaned_cart, "promo_code": promo_code, "summary": summary, "reserved_until": reserved_until}
+
+
+class CartCheckoutV2View(CartCheckoutView):
+    @extend_schema(
+        responses={200: CheckoutResponseSerializer},
+        description="Validate and sanitize the cart before checkout, reserve its stock and price the result.",
+    )
+    def post(self, request):
+        return Response(CheckoutResponseSerializer(self.checkout(request)).data)
+
+
+class CartCheckoutCompleteView(APIView):
+    @extend_schema(
+        responses={200: None, 409: None},
+        description="Complete the checkout: the units held by the last checkout become a sale and the cart is emptied. "
+                    "409 if the reservation expired; check out again.",
+    )
+    def post(self, request):
+        session_id = request.session.session_key
+        # Held units move to "sold"; reconcile_stock writes them back to Product.stock.
+        if not session_id or not stock.commit(session_id):
+            return Response(
+                {"error": "No live stock reservation; check out again."}, status=status.HTTP_409_CONFLICT
+            )
+        redis_cart.clear_cart(session_id)
+        scanner.mark_ended(session_id, scanner.CHECKED_OUT)
+        return Response({"message": "Order placed."})
@@ -0,0 +1,183 @@
+"""Client-side caching of hot read-mostly keys with RESP3 ``CLIENT TRACKING``.
+
+``TrackingCache`` keeps one RESP3 connection per worker with tracking on:
+Redis remembers the keys it read and pushes an ``invalidate`` message on
+that connection as soon as one of them is written, by any client or
+script. Replies are kept in a bounded LRU keyed by the full command, so
+a repeated read is answered from memory; pending invalidations are
+drained from the socket (a non-blocking poll, no round trip) before
+every lookup. Lookups never wait on a miss's round trip; a reply is only
+stored if no invalidation arrived while it was being fetched.
+
+If the tracking connection drops, the invalidations sent meanwhile are
+lost: the cache is emptied and the read goes to the regular pool
+(``fallback``); the next read reconnects and turns tracking back on. A
+server without RESP3 disables the cache for the life of the process.
+
+Only the plain reads below go through it; everything else keeps using
+``REDIS_CLIENT``.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+from redis.exceptions import ConnectionError, ResponseError, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+_UNAVAILABLE = object()
+
+
+class TrackingCache:
+    def __init__(self, fallback, connection_class, max_size, **connection_kwargs):
+        self.fallback = fallback
+        self.max_size = max_size
+        self._connection = connection_class(protocol=3, **connection_kwargs)
+        self._connection.register_connect_callback(self._on_connect)
+        # _io_lock serializes use of the tracking connection; _lock guards the
+        # entries and is never held across network I/O. Order: _io_lock first.
+        self._io_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (command, key, *args) -> reply
+        self._by_key = {}  # key -> set of entries holding it
+        self._generation = 0  # bumped by every invalidation and flush
+        self._disabled = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.fallbacks = 0
+
+    def _on_connect(self, connection):
+        # Anything cached before this connection was not tracked by it.
+        with self._lock:
+            self._flush()
+        connection._parser.set_invalidation_push_handler(self._on_invalidate)
+        connection.send_command("CLIENT", "TRACKING", "ON")
+        connection.read_response()
+
+    def _on_invalidate(self, message):
+        keys = message[1]
+        with self._lock:
+            if keys is None:  # FLUSHDB / FLUSHALL
+                self._flush()
+                return
+            self._generation += 1
+            for key in keys:
+                for entry in self._by_key.pop(key, ()):
+                    self._entries.pop(entry, None)
+                    self.invalidations += 1
+
+    def _flush(self):
+        # Callers hold self._lock.
+        self._generation += 1
+        self._entries.clear()
+        self._by_key.clear()
+
+    def _drain(self):
+        connection = self._connection
+        while connection._sock is not None and connection.can_read(timeout=0):
+            connection.read_response(push_request=True)
+
+    def _fetch(self, command, key, *args):
+        """``(generation, reply)``; invalidations before the send are already in the reply."""
+        with self._lock:
+            generation = self._generation
+        self._connection.send_command(command, key, *args)
+        return generation, self._connection.read_response()
+
+    def _use_connection(self, operation, *args):
+        """Run ``operation`` on the tracking connection; callers hold ``_io_lock``.
+
+        Returns ``_UNAVAILABLE`` if the connection failed or the server cannot
+        track, after emptying the cache.
+        """
+        if self._disabled:
+            return _UNAVAILABLE
+        try:
+            self._connection.connect()  # no-op while connected
+            return operation(*args)
+        except (ConnectionError, TimeoutError, OSError):
+            self._connection.disconnect()
+        except ResponseError:
+            if self._connection._sock is not None:
+                raise  # the command itself failed, e.g. WRONGTYPE
+            # Connecting failed: no HELLO 3 / CLIENT TRACKING on this server.
+            logger.warning("Client-side caching disabled: server does not support RESP3 tracking.")
+            self._connection.disconnect()
+            self._disabled = True
+        with self._lock:
+            self._flush()
+        return _UNAVAILABLE
+
+    def _store(self, entry, key, reply):
+        self._entries[entry] = reply
+        self._by_key.setdefault(key, set()).add(entry)
+        if len(self._entries) > self.max_size:
+            evicted, _ = self._entries.popitem(last=False)
+            holders = self._by_key[evicted[1]]
+            holders.discard(evicted)
+            if not holders:
+                del self._by_key[evicted[1]]
+
+    def _read(self, command, key, *args):
+        entry = (command, key, *args)
+        if not self._disabled:
+            # While another thread's fetch holds the connection, it reads the
+            # pending invalidations itself; don't queue behind its round trip.
+            if self._io_lock.acquire(blocking=False):
+                try:
+                    self._use_connection(self._drain)
+                finally:
+                    self._io_lock.release()
+            with self._lock:
+                if entry in self._entries:
+                    self._entries.move_to_end(entry)
+                    self.hits += 1
+                    return self._entries[entry]
+                self.misses += 1
+
+            with self._io_lock:
+                fetched = self._use_connection(self._fetch, command, key, *args)
+            if fetched is not _UNAVAILABLE:
+                generation, reply = fetched
+                with self._lock:
+                    # An invalidation drained after the reply but before this
+                    # store would otherwise be lost: keep the reply uncached.
+                    if self._generation == generation:
+                        self._store(entry, key, reply)
+                return reply
+            with self._lock:
+                self.fallbacks += 1
+        return self.fallback.execute_command(command, key, *args)
+
+    def get(self, name):
+        return self._read("GET", name)
+
+    def hget(self, name, field):
+        return self._read("HGET", name, field)
+
+    def hmget(self, name, fields):
+        reply = self._read("HMGET", name, *fields)
+        return list(reply)
+
+    def hgetall(self, name):
+        return dict(self._read("HGETALL", name))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": not self._disabled,
+                "max_size": self.max_size,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "fallbacks": self.fallbacks,
+            }
+
+
+def cache_stats(client):
+    """``TrackingCache.stats()``, or None when ``client`` is a plain client."""
+    if isinstance(client, TrackingCache):
+        return client.stats()
+    return None
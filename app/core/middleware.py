@@ -0,0 +1,92 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+
+from . import rate_limit, redis_metrics
+
+
+class RedisMetricsMiddleware:
+    """Record Redis traffic and latency per endpoint; in DEBUG also as X-Redis-* headers.
+
+    Works for sync and async views alike, so it should sit first in
+    MIDDLEWARE to cover the Redis work of every other middleware too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with redis_metrics.track() as stats:
+            response = self.get_response(request)
+        return self._finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with redis_metrics.track() as stats:
+            response = await self.get_response(request)
+        return self._finish(request, response, stats, time.perf_counter() - start)
+
+    def _finish(self, request, response, stats, duration):
+        match = request.resolver_match
+        endpoint = f"{request.method} /{match.route}" if match else "unmatched"
+        redis_metrics.observe_request(endpoint, duration, stats)
+
+        if settings.DEBUG:
+            response["X-Redis-Commands"] = stats.command_count
+            response["X-Redis-Round-Trips"] = stats.round_trips
+            response["X-Redis-Bytes-Sent"] = stats.bytes_sent
+            response["X-Redis-Bytes-Received"] = stats.bytes_received
+            response["X-Redis-Time-Ms"] = f"{stats.seconds * 1000:.3f}"
+            if stats.commands:
+                response["X-Redis-Command-Counts"] = ",".join(
+                    f"{command}={count}" for command, count in sorted(stats.commands.items())
+                )
+        return response
+
+
+class RateLimitMiddleware:
+    """Answer 429 once a client's IP or session bucket is empty (see core.rate_limit).
+
+    Sits before SessionMiddleware so a throttled request costs no session load.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if rate_limit.applies_to(request):
+            retry_after = rate_limit.check(request)
+            if retry_after:
+                return self._throttled(retry_after)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if rate_limit.applies_to(request):
+            retry_after = await rate_limit.acheck(request)
+            if retry_after:
+                return self._throttled(retry_after)
+        return await self.get_response(request)
+
+    def _throttled(self, retry_after):
+        response = JsonResponse(
+            {"detail": f"Request was throttled. Expected available in {retry_after} seconds."}, status=429
+        )
+        response["Retry-After"] = retry_after
+        return response
@@ -0,0 +1,175 @@
+"""Token-bucket rate limiting on Redis, per client IP and per session.
+
+Each bucket is one Redis hash refilled and debited by a single script on
+the server clock, so every worker shares the same limit. To keep most
+requests off Redis, a worker takes a small lease of tokens at a time
+(``RATE_LIMIT_LEASE`` of the burst) and spends it locally; it only goes
+back to Redis once the lease is used up. Leases are debited from the
+shared bucket when taken, so the limit holds across workers; a client
+close to its limit only gets single tokens and is checked on every
+request.
+
+    RATE_LIMITS = {"ip": (rate per second, burst), "session": (...)}
+
+A scope set to None is not limited; ``RATE_LIMIT_PATHS`` are the path
+prefixes covered by ``core.middleware.RateLimitMiddleware``.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.settings import api_settings
+
+redis_client = settings.REDIS_CLIENT
+async_redis_client = settings.REDIS_ASYNC_CLIENT
+
+RATE_LIMITS = getattr(settings, "RATE_LIMITS", {})
+RATE_LIMIT_PATHS = tuple(getattr(settings, "RATE_LIMIT_PATHS", ()))
+RATE_LIMIT_LEASE = getattr(settings, "RATE_LIMIT_LEASE", 0.1)
+LEASE_SECONDS = 5.0  # unused lease tokens are dropped after this
+_MAX_LEASES = 100_000
+
+# ARGV: rate per second, burst, tokens wanted. Returns {granted, retry after ms}.
+_TOKEN_BUCKET = """
+local rate, burst, wanted = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local elapsed = math.max(0, now - (tonumber(bucket[2]) or now))
+tokens = math.min(burst, tokens + elapsed * rate)
+local granted = math.min(wanted, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+if granted > 0 then
+    return {granted, 0}
+end
+return {0, math.ceil((1 - tokens) / rate * 1000)}
+"""
+_token_bucket = redis_client.register_script(_TOKEN_BUCKET)
+_async_token_bucket = async_redis_client.register_script(_TOKEN_BUCKET)
+
+_counters = {"local": 0, "redis": 0, "throttled": 0}
+
+
+class RateLimiter:
+    def __init__(self, scope, rate, burst, lease_fraction=RATE_LIMIT_LEASE):
+        self.scope = scope
+        self.rate = rate
+        self.burst = burst
+        self.lease = max(1, int(burst * lease_fraction))
+        self._lock = threading.Lock()
+        self._leases = OrderedDict()  # identity -> [tokens left, expires at]
+
+    def key(self, identity):
+        return f"ratelimit:{self.scope}:{identity}"
+
+    def args(self):
+        return [self.rate, self.burst, self.lease]
+
+    def take_local(self, identity):
+        """Spend a leased token without Redis; False if there is none left."""
+        with self._lock:
+            lease = self._leases.get(identity)
+            if lease is None or lease[0] < 1 or lease[1] < time.monotonic():
+                return False
+            lease[0] -= 1
+            return True
+
+    def store_lease(self, identity, granted):
+        """Keep the tokens of a grant beyond the one spent on this request."""
+        if granted <= 1:
+            return
+        with self._lock:
+            self._leases[identity] = [granted - 1, time.monotonic() + LEASE_SECONDS]
+            self._leases.move_to_end(identity)
+            if len(self._leases) > _MAX_LEASES:
+                self._leases.popitem(last=False)
+
+
+_limiters = {
+    scope: RateLimiter(scope, *limit)
+    for scope, limit in RATE_LIMITS.items()
+    if limit is not None
+}
+
+
+def client_ip(request):
+    """REMOTE_ADDR, or the address NUM_PROXIES hops back in X-Forwarded-For."""
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+    num_proxies = api_settings.NUM_PROXIES
+    if forwarded and num_proxies:
+        addresses = [address.strip() for address in forwarded.split(",")]
+        return addresses[-min(num_proxies, len(addresses))]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def applies_to(request):
+    return bool(_limiters) and request.path.startswith(RATE_LIMIT_PATHS)
+
+
+def _identities(request):
+    # The raw cookie, so a throttled request never loads its session.
+    identities = {"ip": client_ip(request), "session": request.COOKIES.get(settings.SESSION_COOKIE_NAME)}
+    return [
+        (limiter, identities[scope])
+        for scope, limiter in _limiters.items()
+        if identities.get(scope)
+    ]
+
+
+def _pending(request):
+    """Buckets that cannot be served from a local lease."""
+    pending = []
+    for limiter, identity in _identities(request):
+        if limiter.take_local(identity):
+            _counters["local"] += 1
+        else:
+            pending.append((limiter, identity))
+    return pending
+
+
+def _verdict(pending, results):
+    """Retry-after in seconds if any bucket is empty, else None."""
+    retry_after = 0
+    for (limiter, identity), (granted, retry_ms) in zip(pending, results):
+        if granted:
+            limiter.store_lease(identity, granted)
+        else:
+            retry_after = max(retry_after, retry_ms)
+    if retry_after:
+        _counters["throttled"] += 1
+        return max(1, math.ceil(retry_after / 1000))
+    return None
+
+
+def check(request):
+    """Spend a token from every bucket of ``request``; returns seconds to wait if throttled."""
+    pending = _pending(request)
+    if not pending:
+        return None
+    _counters["redis"] += 1
+    # One round trip for the IP and session buckets together.
+    pipe = redis_client.pipeline(transaction=False)
+    for limiter, identity in pending:
+        _token_bucket(keys=[limiter.key(identity)], args=limiter.args(), client=pipe)
+    return _verdict(pending, pipe.execute())
+
+
+async def acheck(request):
+    pending = _pending(request)
+    if not pending:
+        return None
+    _counters["redis"] += 1
+    pipe = async_redis_client.pipeline(transaction=False)
+    for limiter, identity in pending:
+        await _async_token_bucket(keys=[limiter.key(identity)], args=limiter.args(), client=pipe)
+    return _verdict(pending, await pipe.execute())
+
+
+def stats():
+    """Buckets checked locally and on Redis, and requests throttled, by this process."""
+    return dict(_counters)
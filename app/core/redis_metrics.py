@@ -0,0 +1,323 @@
+"""Per-request Redis instrumentation and Prometheus metrics.
+
+The connection classes below count every command, round trip, byte and
+second spent on Redis I/O into the ``RequestStats`` of the current
+context (a ``contextvars`` variable, so it follows a request through
+threads and coroutines). ``core.middleware.RedisMetricsMiddleware`` opens
+one per request and folds it into the per-endpoint series rendered by
+``render_prometheus``. Series live in process memory: every worker
+exposes its own, as usual for a pull-based scrape.
+"""
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+from collections import Counter
+
+import redis
+import redis.asyncio
+
+_current_stats = contextvars.ContextVar("redis_request_stats", default=None)
+
+
+class RequestStats:
+    __slots__ = ("commands", "round_trips", "bytes_sent", "bytes_received", "seconds")
+
+    def __init__(self):
+        self.commands = Counter()
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+
+    @property
+    def command_count(self):
+        return sum(self.commands.values())
+
+    def merge(self, other):
+        self.commands.update(other.commands)
+        self.round_trips += other.round_trips
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.seconds += other.seconds
+
+
+@contextlib.contextmanager
+def track():
+    """Collect the Redis traffic of the enclosed block into a fresh ``RequestStats``.
+
+    Nested blocks also count towards the enclosing one.
+    """
+    parent = _current_stats.get()
+    stats = RequestStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+        if parent is not None:
+            parent.merge(stats)
+
+
+def _command_name(args):
+    name = args[0]
+    if isinstance(name, bytes):
+        name = name.decode()
+    return str(name).split(" ", 1)[0].upper()
+
+
+def _packed_size(command):
+    if isinstance(command, (bytes, str, memoryview)):
+        return len(command)
+    return sum(len(chunk) for chunk in command)
+
+
+def _reply_size(response):
+    """Approximate reply payload in bytes; protocol framing is not counted."""
+    if isinstance(response, (bytes, str)):
+        return len(response)
+    if isinstance(response, (list, tuple)):
+        return sum(_reply_size(item) for item in response)
+    if isinstance(response, dict):
+        return sum(_reply_size(k) + _reply_size(v) for k, v in response.items())
+    return 8 if response is not None else 0
+
+
+def _count_commands(commands):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.commands.update(_command_name(args) for args in commands)
+
+
+class _InstrumentedConnectionMixin:
+    # Single commands go through send_command, pipelines through
+    # pack_commands; both end in send_packed_command (one round trip).
+    def send_command(self, *args, **kwargs):
+        _count_commands([args])
+        return super().send_command(*args, **kwargs)
+
+    def pack_commands(self, commands):
+        commands = list(commands)
+        _count_commands(commands)
+        return super().pack_commands(commands)
+
+    def send_packed_command(self, command, check_health=True):
+        stats = _current_stats.get()
+        if stats is None:
+            return super().send_packed_command(command, check_health=check_health)
+        if not isinstance(command, (bytes, str, memoryview, list, tuple)):
+            command = list(command)
+        start = time.perf_counter()
+        try:
+            return super().send_packed_command(command, check_health=check_health)
+        finally:
+            stats.seconds += time.perf_counter() - start
+            stats.round_trips += 1
+            stats.bytes_sent += _packed_size(command)
+
+    def read_response(self, *args, **kwargs):
+        stats = _current_stats.get()
+        if stats is None:
+            return super().read_response(*args, **kwargs)
+        start = time.perf_counter()
+        response = super().read_response(*args, **kwargs)
+        stats.seconds += time.perf_counter() - start
+        stats.bytes_received += _reply_size(response)
+        return response
+
+
+class _AsyncInstrumentedConnectionMixin:
+    async def send_command(self, *args, **kwargs):
+        _count_commands([args])
+        return await super().send_command(*args, **kwargs)
+
+    def pack_commands(self, commands):
+        commands = list(commands)
+        _count_commands(commands)
+        return super().pack_commands(commands)
+
+    async def send_packed_command(self, command, check_health=True):
+        stats = _current_stats.get()
+        if stats is None:
+            return await super().send_packed_command(command, check_health=check_health)
+        if not isinstance(command, (bytes, str, memoryview, list, tuple)):
+            command = list(command)
+        start = time.perf_counter()
+        try:
+            return await super().send_packed_command(command, check_health=check_health)
+        finally:
+            stats.seconds += time.perf_counter() - start
+            stats.round_trips += 1
+            stats.bytes_sent += _packed_size(command)
+
+    async def read_response(self, *args, **kwargs):
+        stats = _current_stats.get()
+        if stats is None:
+            return await super().read_response(*args, **kwargs)
+        start = time.perf_counter()
+        response = await super().read_response(*args, **kwargs)
+        stats.seconds += time.perf_counter() - start
+        stats.bytes_received += _reply_size(response)
+        return response
+
+
+class InstrumentedConnection(_InstrumentedConnectionMixin, redis.Connection):
+    pass
+
+
+class InstrumentedUnixDomainSocketConnection(_InstrumentedConnectionMixin, redis.UnixDomainSocketConnection):
+    pass
+
+
+class AsyncInstrumentedConnection(_AsyncInstrumentedConnectionMixin, redis.asyncio.Connection):
+    pass
+
+
+class AsyncInstrumentedUnixDomainSocketConnection(
+    _AsyncInstrumentedConnectionMixin, redis.asyncio.UnixDomainSocketConnection
+):
+    pass
+
+
+# Log-linear (HDR-style) bucket bounds in seconds: four sub-buckets per
+# power of two from ~31us to 16s, i.e. at most ~19% relative error.
+HISTOGRAM_BOUNDS = [2 ** (exponent / 4) for exponent in range(-60, 17)]
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bucket bound containing the ``q`` quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BOUNDS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class _EndpointSeries:
+    __slots__ = ("duration", "redis_seconds", "commands", "round_trips", "bytes_sent", "bytes_received")
+
+    def __init__(self):
+        self.duration = Histogram()
+        self.redis_seconds = Histogram()
+        self.commands = Counter()
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+_series = {}
+_series_lock = threading.Lock()
+
+
+def observe_request(endpoint, duration, stats):
+    with _series_lock:
+        series = _series.get(endpoint)
+        if series is None:
+            series = _series[endpoint] = _EndpointSeries()
+        series.duration.observe(duration)
+        series.redis_seconds.observe(stats.seconds)
+        series.commands.update(stats.commands)
+        series.round_trips += stats.round_trips
+        series.bytes_sent += stats.bytes_sent
+        series.bytes_received += stats.bytes_received
+
+
+def reset():
+    with _series_lock:
+        _series.clear()
+
+
+POOL_METRICS = [
+    ("max_connections", "gauge"),
+    ("created", "gauge"),
+    ("in_use", "gauge"),
+    ("idle", "gauge"),
+    ("waits", "counter"),
+    ("wait_seconds", "counter"),
+    ("timeouts", "counter"),
+]
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _render_histogram(lines, name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(HISTOGRAM_BOUNDS, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound:.6g}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.9g}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+def render_prometheus(pools=None, client_cache=None):
+    """Prometheus text exposition of the endpoint series plus ``pools``.
+
+    ``pools`` maps a client label to a ``redis_pool.pool_stats`` dict;
+    ``client_cache`` is a ``TrackingCache.stats()`` dict, if enabled.
+    """
+    with _series_lock:
+        snapshot = sorted(_series.items())
+        lines = []
+        metrics = [
+            ("http_request_duration_seconds", "histogram", "Request latency by endpoint.", "duration"),
+            ("http_request_redis_seconds", "histogram", "Redis I/O time per request by endpoint.", "redis_seconds"),
+        ]
+        for name, kind, help_text, attr in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for endpoint, series in snapshot:
+                _render_histogram(lines, name, f'endpoint="{_label(endpoint)}"', getattr(series, attr))
+
+        lines.append("# HELP redis_commands_total Redis commands sent, by endpoint and command.")
+        lines.append("# TYPE redis_commands_total counter")
+        for endpoint, series in snapshot:
+            for command, count in sorted(series.commands.items()):
+                lines.append(f'redis_commands_total{{endpoint="{_label(endpoint)}",command="{command}"}} {count}')
+
+        counters = [
+            ("redis_round_trips_total", "Redis network round trips.", "round_trips"),
+            ("redis_bytes_sent_total", "Bytes written to Redis.", "bytes_sent"),
+            ("redis_bytes_received_total", "Approximate reply payload bytes read from Redis.", "bytes_received"),
+        ]
+        for name, help_text, attr in counters:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for endpoint, series in snapshot:
+                lines.append(f'{name}{{endpoint="{_label(endpoint)}"}} {getattr(series, attr)}')
+
+    pools = sorted((pools or {}).items())
+    for key, kind in POOL_METRICS:
+        name = f"redis_pool_{key}_total" if kind == "counter" else f"redis_pool_{key}"
+        lines.append(f"# TYPE {name} {kind}")
+        for client, stats in pools:
+            if key in stats:
+                lines.append(f'{name}{{client="{_label(client)}"}} {stats[key]}')
+
+    if client_cache:
+        lines.append("# TYPE redis_client_cache_entries gauge")
+        lines.append(f"redis_client_cache_entries {client_cache['size']}")
+        for key in ("hits", "misses", "invalidations", "fallbacks"):
+            lines.append(f"# TYPE redis_client_cache_{key}_total counter")
+            lines.append(f"redis_client_cache_{key}_total {client_cache[key]}")
+    return "\n".join(lines) + "\n"
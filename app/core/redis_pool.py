@@ -0,0 +1,401 @@
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+import redis
+import redis.asyncio
+import redis.asyncio.client
+import redis.asyncio.cluster
+import redis.client
+import redis.cluster
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ClusterDownError, ConnectionError, NoScriptError
+from redis.retry import Retry
+
+from .client_cache import TrackingCache
+from .redis_metrics import (
+    AsyncInstrumentedConnection,
+    AsyncInstrumentedUnixDomainSocketConnection,
+    InstrumentedConnection,
+    InstrumentedUnixDomainSocketConnection,
+)
+
+
+class MonitoredBlockingConnectionPool(redis.BlockingConnectionPool):
+    """BlockingConnectionPool that keeps counters for monitoring."""
+
+    def reset(self):
+        super().reset()
+        self._stats_lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+    def get_connection(self, command_name=None, *keys, **options):
+        if not self.pool.empty():
+            return super().get_connection(command_name, *keys, **options)
+
+        # Every slot is checked out: this caller has to wait for a release.
+        start = time.perf_counter()
+        try:
+            return super().get_connection(command_name, *keys, **options)
+        except ConnectionError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self.waits += 1
+                self.wait_seconds += time.perf_counter() - start
+
+    def stats(self):
+        slots = list(self.pool.queue)
+        idle = sum(1 for connection in slots if connection is not None)
+        return {
+            "max_connections": self.max_connections,
+            "created": len(self._connections),
+            "in_use": self.max_connections - len(slots),
+            "idle": idle,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 6),
+            "timeouts": self.timeouts,
+        }
+
+
+def _connection_kwargs(
+    connection_class,
+    unix_socket_connection_class,
+    retry_class,
+    host="localhost",
+    port=6379,
+    db=0,
+    decode_responses=True,
+    unix_socket_path=None,
+    socket_timeout=2,
+    socket_connect_timeout=2,
+    socket_keepalive=True,
+    health_check_interval=30,
+    retry_attempts=3,
+    retry_backoff_base=0.05,
+    retry_backoff_cap=1.0,
+):
+    connection_kwargs = {
+        "db": db,
+        "decode_responses": decode_responses,
+        "socket_timeout": socket_timeout,
+        "health_check_interval": health_check_interval,
+        "retry": retry_class(ExponentialBackoff(cap=retry_backoff_cap, base=retry_backoff_base), retry_attempts),
+        # Not TimeoutError: a command that timed out on the read may already
+        # have run, and increments, reservations and token takes must not
+        # run twice. Connect timeouts are retried by the connection itself.
+        "retry_on_error": [ConnectionError],
+    }
+    if unix_socket_path:
+        connection_kwargs.update(
+            connection_class=unix_socket_connection_class,
+            path=unix_socket_path,
+        )
+    else:
+        connection_kwargs.update(
+            connection_class=connection_class,
+            host=host,
+            port=port,
+            socket_connect_timeout=socket_connect_timeout,
+            socket_keepalive=socket_keepalive,
+        )
+    return connection_kwargs
+
+
+def _missing_scripts(results):
+    return [position for position, result in enumerate(results) if isinstance(result, NoScriptError)]
+
+
+def _raise_first_error(results):
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+
+class ScriptingPipeline(redis.client.Pipeline):
+    """Pipeline that sends scripts as bare EVALSHA, loading them only on NOSCRIPT.
+
+    A plain Pipeline sends SCRIPT EXISTS before every execute that runs a
+    registered script, so a pipelined script call costs two round trips.
+    Here the commands go out as they are; if the server lost a script
+    (restart, failover, SCRIPT FLUSH), it is loaded together with a re-send
+    of only the commands that failed, so nothing runs twice. Those then run
+    after the commands queued behind them; their positions are left in
+    ``resent`` for callers that depend on the order. Transactions keep the
+    stock behaviour: a NOSCRIPT there would abort the whole MULTI.
+    """
+
+    resent = ()
+
+    def load_scripts(self):
+        if self.transaction:
+            super().load_scripts()
+
+    def execute(self, raise_on_error=True):
+        self.resent = ()
+        if self.transaction or self.explicit_transaction or not self.scripts:
+            return super().execute(raise_on_error)
+        queued = list(self.command_stack)
+        scripts = {script.sha: script for script in self.scripts}
+        results = super().execute(raise_on_error=False)
+        missing = self.resent = _missing_scripts(results)
+        if missing:
+            shas = {queued[position][0][1] for position in missing}
+            for sha in shas:
+                self.pipeline_execute_command("SCRIPT LOAD", scripts[sha].script)
+            for position in missing:
+                args, options = queued[position]
+                self.pipeline_execute_command(*args, **options)
+            retried = super().execute(raise_on_error=False)
+            _raise_first_error(retried[:len(shas)])
+            for position, result in zip(missing, retried[len(shas):]):
+                results[position] = result
+        if raise_on_error:
+            _raise_first_error(results)
+        return results
+
+
+class ScriptingRedis(redis.Redis):
+    """Redis client whose non-transactional pipelines run scripts in one round trip."""
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return ScriptingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class AsyncScriptingPipeline(redis.asyncio.client.Pipeline):
+    resent = ()
+
+    async def load_scripts(self):
+        if self.is_transaction:
+            await super().load_scripts()
+
+    async def execute(self, raise_on_error=True):
+        self.resent = ()
+        if self.is_transaction or self.explicit_transaction or not self.scripts:
+            return await super().execute(raise_on_error)
+        queued = list(self.command_stack)
+        scripts = {script.sha: script for script in self.scripts}
+        results = await super().execute(raise_on_error=False)
+        missing = self.resent = _missing_scripts(results)
+        if missing:
+            shas = {queued[position][0][1] for position in missing}
+            for sha in shas:
+                self.pipeline_execute_command("SCRIPT LOAD", scripts[sha].script)
+            for position in missing:
+                args, options = queued[position]
+                self.pipeline_execute_command(*args, **options)
+            retried = await super().execute(raise_on_error=False)
+            _raise_first_error(retried[:len(shas)])
+            for position, result in zip(missing, retried[len(shas):]):
+                results[position] = result
+        if raise_on_error:
+            _raise_first_error(results)
+        return results
+
+
+class AsyncScriptingRedis(redis.asyncio.Redis):
+    def pipeline(self, transaction=True, shard_hint=None):
+        return AsyncScriptingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def build_redis_client(max_connections=50, pool_timeout=5, **options):
+    pool = MonitoredBlockingConnectionPool(
+        max_connections=max_connections,
+        timeout=pool_timeout,
+        **_connection_kwargs(InstrumentedConnection, InstrumentedUnixDomainSocketConnection, Retry, **options),
+    )
+    return ScriptingRedis(connection_pool=pool)
+
+
+# RedisCluster re-sends commands that timed out as well; see _connection_kwargs.
+_CLUSTER_ERRORS_ALLOW_RETRY = (ConnectionError, ClusterDownError)
+
+
+class ScriptingClusterPipeline(redis.cluster.ClusterPipeline):
+    """ClusterPipeline that loads scripts a node has not seen and re-sends just those.
+
+    A plain Pipeline loads its scripts before executing; a cluster pipeline
+    does not, so EVALSHA fails with NOSCRIPT on a new, restarted or failed
+    over primary. Only the failed commands are sent again, so nothing runs
+    twice.
+    """
+
+    def evalsha(self, sha, numkeys, *keys_and_args):
+        # ClusterPipeline blocks EVALSHA; it is routed by its keys like any command.
+        return self.execute_command("EVALSHA", sha, numkeys, *keys_and_args)
+
+    resent = ()
+
+    def execute(self, raise_on_error=True):
+        queued = [(command.args, command.options) for command in self.command_stack]
+        results = super().execute(raise_on_error=False)
+        missing = self.resent = _missing_scripts(results)
+        if missing:
+            for sha in {queued[position][0][1] for position in missing}:
+                self._cluster.script_load(self._cluster.scripts[sha].script)
+            for position in missing:
+                args, options = queued[position]
+                self.pipeline_execute_command(*args, **options)
+            for position, result in zip(missing, super().execute(raise_on_error=False)):
+                results[position] = result
+        if raise_on_error:
+            _raise_first_error(results)
+        return results
+
+
+class ScriptingRedisCluster(redis.cluster.RedisCluster):
+    """RedisCluster whose pipelines run registered Lua scripts on any node."""
+
+    ERRORS_ALLOW_RETRY = _CLUSTER_ERRORS_ALLOW_RETRY
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scripts = {}  # sha -> Script, for reloading on NOSCRIPT
+
+    def register_script(self, script):
+        script = super().register_script(script)
+        self.scripts[script.sha] = script
+        return script
+
+    def pipeline(self, transaction=None, shard_hint=None):
+        if transaction or shard_hint:
+            return super().pipeline(transaction, shard_hint)  # raises
+        pipe = ScriptingClusterPipeline(
+            nodes_manager=self.nodes_manager,
+            commands_parser=self.commands_parser,
+            startup_nodes=self.nodes_manager.startup_nodes,
+            result_callbacks=self.result_callbacks,
+            cluster_response_callbacks=self.cluster_response_callbacks,
+            cluster_error_retry_attempts=self.cluster_error_retry_attempts,
+            read_from_replicas=self.read_from_replicas,
+            reinitialize_steps=self.reinitialize_steps,
+            lock=self._lock,
+        )
+        pipe._cluster = self
+        return pipe
+
+
+class AsyncScriptingClusterPipeline(redis.asyncio.cluster.ClusterPipeline):
+    ERRORS_ALLOW_RETRY = _CLUSTER_ERRORS_ALLOW_RETRY
+
+    resent = ()
+
+    async def execute(self, raise_on_error=True, allow_redirections=True):
+        queued = [(command.args, dict(command.kwargs)) for command in self._command_stack]
+        results = await super().execute(False, allow_redirections)
+        missing = self.resent = _missing_scripts(results)
+        if missing:
+            for sha in {queued[position][0][1] for position in missing}:
+                await self._client.script_load(self._client.scripts[sha].script)
+            for position in missing:
+                args, kwargs = queued[position]
+                self.execute_command(*args, **kwargs)
+            for position, result in zip(missing, await super().execute(False, allow_redirections)):
+                results[position] = result
+        if raise_on_error:
+            _raise_first_error(results)
+        return results
+
+
+class AsyncScriptingRedisCluster(redis.asyncio.cluster.RedisCluster):
+    ERRORS_ALLOW_RETRY = _CLUSTER_ERRORS_ALLOW_RETRY
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scripts = {}
+
+    def register_script(self, script):
+        script = super().register_script(script)
+        self.scripts[script.sha] = script
+        return script
+
+    def pipeline(self, transaction=None, shard_hint=None):
+        if transaction or shard_hint:
+            return super().pipeline(transaction, shard_hint)
+        return AsyncScriptingClusterPipeline(self)
+
+
+def _cluster_kwargs(connection_class, retry_class, max_connections, options):
+    if options.get("unix_socket_path"):
+        raise ImproperlyConfigured("REDIS_CLUSTER needs REDIS_HOST/REDIS_PORT, not a unix socket.")
+    connection_kwargs = _connection_kwargs(connection_class, None, retry_class, **options)
+    connection_kwargs.pop("db")  # a cluster only has db 0
+    return {**connection_kwargs, "max_connections": max_connections}
+
+
+def build_redis_cluster_client(max_connections=50, pool_timeout=5, **options):
+    """Redis Cluster client; ``max_connections`` is per node and pools never block."""
+    return ScriptingRedisCluster(**_cluster_kwargs(InstrumentedConnection, Retry, max_connections, options))
+
+
+def build_async_redis_cluster_client(max_connections=50, pool_timeout=5, **options):
+    kwargs = _cluster_kwargs(AsyncInstrumentedConnection, AsyncRetry, max_connections, options)
+    kwargs.pop("connection_class")  # the async cluster always uses its own Connection
+    return AsyncScriptingRedisCluster(**kwargs)
+
+
+def build_async_redis_client(max_connections=50, pool_timeout=5, **options):
+    pool = redis.asyncio.BlockingConnectionPool(
+        max_connections=max_connections,
+        timeout=pool_timeout,
+        **_connection_kwargs(
+            AsyncInstrumentedConnection, AsyncInstrumentedUnixDomainSocketConnection, AsyncRetry, **options
+        ),
+    )
+    return AsyncScriptingRedis(connection_pool=pool)
+
+
+def build_cached_redis_client(fallback, cache_size=0, max_connections=None, pool_timeout=None, **options):
+    """A ``TrackingCache`` in front of ``fallback``, or ``fallback`` itself when ``cache_size`` is 0.
+
+    Tracking needs one connection per node on Redis Cluster, so there the
+    cache is not used.
+    """
+    if not cache_size or isinstance(fallback, redis.cluster.RedisCluster):
+        return fallback
+    connection_kwargs = _connection_kwargs(
+        InstrumentedConnection, InstrumentedUnixDomainSocketConnection, Retry, **options
+    )
+    connection_class = connection_kwargs.pop("connection_class")
+    return TrackingCache(fallback, connection_class, cache_size, **connection_kwargs)
+
+
+def _cluster_pool_stats(client):
+    stats = {"max_connections": 0, "created": 0, "in_use": 0, "idle": 0}
+    for node in client.get_nodes():
+        if isinstance(client, redis.cluster.RedisCluster):
+            if node.redis_connection is None:
+                continue
+            pool = node.redis_connection.connection_pool
+            in_use, idle = len(pool._in_use_connections), len(pool._available_connections)
+            max_connections = pool.max_connections
+        else:
+            idle = len(node._free)
+            in_use = len(node._connections) - idle
+            max_connections = node.max_connections
+        stats["max_connections"] += max_connections
+        stats["created"] += in_use + idle
+        stats["in_use"] += in_use
+        stats["idle"] += idle
+    return stats
+
+
+def pool_stats(client):
+    if isinstance(client, (redis.cluster.RedisCluster, redis.asyncio.cluster.RedisCluster)):
+        return _cluster_pool_stats(client)
+    pool = client.connection_pool
+    if isinstance(pool, MonitoredBlockingConnectionPool):
+        return pool.stats()
+    in_use = len(pool._in_use_connections)
+    idle = len(pool._available_connections)
+    return {
+        "max_connections": pool.max_connections,
+        "created": in_use + idle,
+        "in_use": in_use,
+        "idle": idle,
+    }
@@ -0,0 +1,158 @@
+"""Session engine on the shared Redis pool.
+
+Sessions are stored as ``<ttl>:<json>`` under ``session:<key>`` with the
+session's JSON serializer and no signing: the payload never leaves the
+server, so the HMAC and compression of ``SessionBase.encode`` are only
+overhead. Reads are one EVALSHA that returns the payload and slides the
+expiry by the TTL it was saved with. Anonymous sessions (cart shoppers)
+idle out after ``SESSION_REDIS_ANONYMOUS_TTL``, in step with the carts
+they identify; authenticated ones keep the usual session expiry.
+
+    SESSION_ENGINE = "core.redis_session"
+"""
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.base import CreateError, SessionBase, UpdateError
+
+redis_client = settings.REDIS_CLIENT
+async_redis_client = settings.REDIS_ASYNC_CLIENT
+
+KEY_PREFIX = "session:"
+
+_LOAD = """
+local value = redis.call('GET', KEYS[1])
+if value then
+    redis.call('EXPIRE', KEYS[1], string.match(value, '^(%d+):'))
+end
+return value
+"""
+_load_script = redis_client.register_script(_LOAD)
+_async_load_script = async_redis_client.register_script(_LOAD)
+
+
+class SessionStore(SessionBase):
+    # The key before the last cycle_key(), for cart.persistence (see check cart.E003).
+    previous_session_key = None
+
+    def _key(self, session_key):
+        return KEY_PREFIX + session_key
+
+    def _ttl(self, session_data):
+        expiry_age = self.get_expiry_age(expiry=session_data.get("_session_expiry"))
+        if SESSION_KEY in session_data or "_session_expiry" in session_data:
+            return expiry_age
+        return min(expiry_age, getattr(settings, "SESSION_REDIS_ANONYMOUS_TTL", expiry_age))
+
+    def _encode(self, session_data):
+        ttl = self._ttl(session_data)
+        payload = self.serializer().dumps(session_data).decode("latin-1")
+        return ttl, f"{ttl}:{payload}"
+
+    def _decode(self, value):
+        if value is None:
+            self._session_key = None
+            return {}
+        try:
+            return self.serializer().loads(value.split(":", 1)[1].encode("latin-1"))
+        except (IndexError, ValueError):
+            self._session_key = None
+            return {}
+
+    def load(self):
+        if not self.session_key:
+            return {}
+        return self._decode(_load_script(keys=[self._key(self.session_key)], client=redis_client))
+
+    async def aload(self):
+        if not self.session_key:
+            return {}
+        return self._decode(await _async_load_script(keys=[self._key(self.session_key)], client=async_redis_client))
+
+    def create(self):
+        while True:
+            self._session_key = self._get_new_session_key()
+            try:
+                self.save(must_create=True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+
+    async def acreate(self):
+        while True:
+            self._session_key = await self._aget_new_session_key()
+            try:
+                await self.asave(must_create=True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        ttl, value = self._encode(self._get_session(no_load=must_create))
+        # NX on create, XX on update: a session deleted meanwhile is not resurrected.
+        if not redis_client.set(self._key(self.session_key), value, ex=ttl, nx=must_create, xx=not must_create):
+            raise CreateError if must_create else UpdateError
+
+    async def asave(self, must_create=False):
+        if self.session_key is None:
+            return await self.acreate()
+        ttl, value = self._encode(await self._aget_session(no_load=must_create))
+        if not await async_redis_client.set(
+            self._key(self.session_key), value, ex=ttl, nx=must_create, xx=not must_create
+        ):
+            raise CreateError if must_create else UpdateError
+
+    def cycle_key(self):
+        # Kept for user_logged_in receivers: login() cycles the key first, and
+        # data keyed by the old one (the anonymous cart) must move over.
+        self.previous_session_key = self.session_key
+        super().cycle_key()
+
+    async def acycle_key(self):
+        self.previous_session_key = self.session_key
+        await super().acycle_key()
+
+    def exists(self, session_key):
+        return bool(session_key) and bool(redis_client.exists(self._key(session_key)))
+
+    async def aexists(self, session_key):
+        return bool(session_key) and bool(await async_redis_client.exists(self._key(session_key)))
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        redis_client.delete(self._key(session_key))
+
+    async def adelete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        await async_redis_client.delete(self._key(session_key))
+
+    @classmethod
+    def load_many(cls, session_keys):
+        """``{session_key: session data}`` in one round trip, without sliding expiries."""
+        session_keys = list(session_keys)
+        store = cls()
+        pipe = redis_client.pipeline(transaction=False)
+        for session_key in session_keys:
+            pipe.get(store._key(session_key))
+        return {
+            session_key: store._decode(value)
+            for session_key, value in zip(session_keys, pipe.execute())
+            if value is not None
+        }
+
+    @classmethod
+    def clear_expired(cls):
+        pass
+
+    @classmethod
+    async def aclear_expired(cls):
+        pass
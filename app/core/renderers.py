@@ -0,0 +1,54 @@
+"""orjson renderer and parser for DRF, enabled with ``FAST_JSON``.
+
+The output matches ``rest_framework.renderers.JSONRenderer``: compact
+UTF-8, U+2028/U+2029 escaped, and types orjson does not handle itself
+(``Decimal``, lazy strings, datetimes) go through DRF's own encoder so
+they are rendered the same way.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError as exc:
+    raise ImproperlyConfigured("FAST_JSON needs the orjson package.") from exc
+
+# DRF trims datetimes to milliseconds and writes UTC as "Z"; leave them to its encoder.
+_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+_default = JSONEncoder().default
+
+
+def dumps(data, indent=False):
+    options = _OPTIONS | orjson.OPT_INDENT_2 if indent else _OPTIONS
+    return (
+        orjson.dumps(data, default=_default, option=options)
+        .replace(b"\xe2\x80\xa8", b"\\u2028")
+        .replace(b"\xe2\x80\xa9", b"\\u2029")
+    )
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        # The browsable API asks for an indented body.
+        indent = (renderer_context or {}).get("indent") or "indent=" in (accepted_media_type or "")
+        return dumps(data, indent=bool(indent))
+
+
+class ORJSONParser(BaseParser):
+    media_type = "application/json"
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
@@ -11,7 +11,14 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-import redis
+
+from core.redis_pool import (
+    build_async_redis_client,
+    build_async_redis_cluster_client,
+    build_cached_redis_client,
+    build_redis_client,
+    build_redis_cluster_client,
+)
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -38,13 +45,16 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'inventory.apps.InventoryConfig',
+    'cart.apps.CartConfig',
     'rest_framework',
     'drf_spectacular',
 
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RedisMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -90,14 +100,120 @@ REDIS_HOST = "redis"
 REDIS_PORT = 6379
 REDIS_DB = 0
 REDIS_DECODE_RESPONSES = True
-
-REDIS_CLIENT = redis.Redis(
+REDIS_UNIX_SOCKET_PATH = None  # e.g. "/var/run/redis/redis.sock"; overrides host/port
+REDIS_MAX_CONNECTIONS = 50
+REDIS_POOL_TIMEOUT = 5  # seconds to wait for a free connection before erroring
+REDIS_SOCKET_TIMEOUT = 2
+REDIS_SOCKET_CONNECT_TIMEOUT = 2
+REDIS_SOCKET_KEEPALIVE = True
+REDIS_HEALTH_CHECK_INTERVAL = 30
+REDIS_RETRY_ATTEMPTS = 3
+REDIS_RETRY_BACKOFF_BASE = 0.05
+REDIS_RETRY_BACKOFF_CAP = 1.0
+
+REDIS_CLIENT_OPTIONS = dict(
     host=REDIS_HOST,
     port=REDIS_PORT,
     db=REDIS_DB,
     decode_responses=REDIS_DECODE_RESPONSES,
+    unix_socket_path=REDIS_UNIX_SOCKET_PATH,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    pool_timeout=REDIS_POOL_TIMEOUT,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+    socket_keepalive=REDIS_SOCKET_KEEPALIVE,
+    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+    retry_attempts=REDIS_RETRY_ATTEMPTS,
+    retry_backoff_base=REDIS_RETRY_BACKOFF_BASE,
+    retry_backoff_cap=REDIS_RETRY_BACKOFF_CAP,
 )
 
+# Redis Cluster: REDIS_HOST/REDIS_PORT is any startup node, keys are
+# routed by slot and REDIS_MAX_CONNECTIONS applies per node. Turn on
+# CART_KEY_HASH_TAGS (and migrate existing carts) with it.
+REDIS_CLUSTER = False
+
+if REDIS_CLUSTER:
+    REDIS_CLIENT = build_redis_cluster_client(**REDIS_CLIENT_OPTIONS)
+    REDIS_ASYNC_CLIENT = build_async_redis_cluster_client(**REDIS_CLIENT_OPTIONS)
+else:
+    REDIS_CLIENT = build_redis_client(**REDIS_CLIENT_OPTIONS)
+    # Shared by the async (ASGI) cart views; connections are opened lazily
+    # on the serving event loop.
+    REDIS_ASYNC_CLIENT = build_async_redis_client(**REDIS_CLIENT_OPTIONS)
+
+# Client-side cache for hot read-mostly keys (catalog snapshot, category
+# tree): replies kept per worker and invalidated by Redis through RESP3
+# CLIENT TRACKING on one extra connection. Number of replies; 0 disables
+# it and REDIS_CACHED_CLIENT is REDIS_CLIENT itself.
+REDIS_CLIENT_CACHE_SIZE = 0
+REDIS_CACHED_CLIENT = build_cached_redis_client(REDIS_CLIENT, REDIS_CLIENT_CACHE_SIZE, **REDIS_CLIENT_OPTIONS)
+
+# Cart storage layout, see cart/scripts.py: "split" (qty/details/promo keys)
+# or "compact" (one packed hash per cart, split carts migrate on first touch).
+CART_STORAGE = "split"
+
+# Hash-tag cart keys (cart:{<session>}:qty, ...) so each cart stays in one
+# Redis Cluster slot. Required with REDIS_CLUSTER; after switching it on,
+# move existing carts with `manage.py migrate_cart_keys`.
+CART_KEY_HASH_TAGS = REDIS_CLUSTER
+
+# Coalesce +/- clicks in-process for this many milliseconds and write the net
+# deltas in one pipeline (see cart/coalesce.py); 0 writes every click.
+CART_COALESCE_WINDOW_MS = 0
+
+# Cart TTL refresh: "always" on every mutation, or "lazy" at most once per
+# CART_TTL_REFRESH_AFTER seconds per session. CART_STORAGE = "compact" is the
+# single-key alternative: one EXPIRE instead of three.
+CART_TTL_STRATEGY = "always"
+CART_TTL_REFRESH_AFTER = 5 * 60
+
+# In-process product lookups in front of the Redis catalog snapshot (cart
+# adds): seconds an entry is trusted, and entries kept per worker.
+PRODUCT_LOCAL_CACHE_TTL = 5
+PRODUCT_LOCAL_CACHE_SIZE = 10_000
+
+# Keep a database copy of signed-in users' carts (cart/persistence.py): cart
+# mutations queue the session, `manage.py flush_carts --loop` writes batches
+# behind, and login merges the anonymous cart into the user's cart. Needs the
+# core.redis_session engine (check cart.E003) and a running flush_carts worker.
+CART_PERSISTENCE = False
+
+# Build cart responses as plain dicts (cart.serializers.cart_response_data)
+# instead of running CartResponseSerializer field by field; same JSON.
+CART_FAST_SERIALIZATION = False
+
+# Promo codes applied by cart.pricing: {"percent": ...} or {"amount": ...},
+# optionally with "min_subtotal". Codes are matched case-insensitively.
+CART_PROMO_CODES = {
+    "WELCOME10": {"percent": "10"},
+    "SPRING": {"amount": "5.00", "min_subtotal": "50.00"},
+}
+
+# Seconds a checkout holds its units (inventory/stock.py) before they are
+# released back; run `manage.py reconcile_stock --loop` to write sales back.
+STOCK_RESERVATION_TTL = 15 * 60
+
+# Token buckets (core/rate_limit.py) for the cart API: (requests per second,
+# burst) per client IP and per session cookie; None disables a scope. Workers
+# take RATE_LIMIT_LEASE of the burst per Redis call and spend it locally.
+RATE_LIMIT_PATHS = ("/api/cart/",)
+RATE_LIMITS = {
+    "ip": (20, 200),
+    "session": (5, 50),
+}
+RATE_LIMIT_LEASE = 0.1
+
+# Bearer token Prometheus sends to /metrics (Authorization: Bearer <token>).
+# Unset, /metrics is only served to staff sessions, like health/redis/.
+METRICS_TOKEN = None
+
+# Sessions live in Redis next to the carts they identify (core/redis_session.py),
+# so a cart request needs no database query for the session. Anonymous sessions
+# idle out with their cart (cart.redis_cart.CART_TTL).
+SESSION_ENGINE = "core.redis_session"
+SESSION_REDIS_ANONYMOUS_TTL = 60 * 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -146,6 +262,20 @@ REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
 
+# Render and parse JSON with orjson (core/renderers.py) instead of the
+# stdlib json module; same bytes on the wire. Needs the orjson package.
+FAST_JSON = False
+if FAST_JSON:
+    REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"] = [
+        "core.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ]
+    REST_FRAMEWORK["DEFAULT_PARSER_CLASSES"] = [
+        "core.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ]
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "Session-Based Cart",
     "DESCRIPTION": "Redis Fast Session Storage for Web Applications.",
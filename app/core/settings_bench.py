@@ -0,0 +1,63 @@
+"""Settings for the cart API benchmarks (``bench_cart_api``).
+
+SQLite stands in for PostgreSQL. Redis is the server at BENCH_REDIS_HOST,
+or an in-process fakeredis (optional dependency) with BENCH_FAKE_REDIS=1.
+Both clients keep the instrumented connections, so Redis ops per request
+are reported either way.
+
+    BENCH_FAKE_REDIS=1 python manage.py bench_cart_api --settings=core.settings_bench
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, REDIS_CLIENT_OPTIONS
+from .redis_pool import build_async_redis_client, build_cached_redis_client, build_redis_client
+
+DEBUG = False
+ALLOWED_HOSTS = ["testserver", "localhost", "127.0.0.1"]
+
+# Every simulated shopper comes from the same address: limit per session only.
+RATE_LIMITS = {"ip": None, "session": (5, 50)}
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get("BENCH_DB_PATH", BASE_DIR / "bench.sqlite3"),
+        "OPTIONS": {"timeout": 30},
+    }
+}
+
+if os.environ.get("BENCH_FAKE_REDIS"):
+    import redis
+    import redis.asyncio
+
+    try:
+        import fakeredis
+        from fakeredis.aioredis import FakeAsyncRedisConnection
+    except ImportError as exc:
+        from django.core.exceptions import ImproperlyConfigured
+
+        raise ImproperlyConfigured("BENCH_FAKE_REDIS needs the fakeredis package.") from exc
+
+    from .redis_metrics import _AsyncInstrumentedConnectionMixin, _InstrumentedConnectionMixin
+    from .redis_pool import AsyncScriptingRedis, ScriptingRedis
+
+    class _FakeConnection(_InstrumentedConnectionMixin, fakeredis.FakeRedisConnection):
+        pass
+
+    class _AsyncFakeConnection(_AsyncInstrumentedConnectionMixin, FakeAsyncRedisConnection):
+        pass
+
+    _fake_server = fakeredis.FakeServer()
+    REDIS_CLIENT = ScriptingRedis(connection_pool=redis.ConnectionPool(
+        connection_class=_FakeConnection, server=_fake_server, decode_responses=True,
+    ))
+    REDIS_ASYNC_CLIENT = AsyncScriptingRedis(connection_pool=redis.asyncio.ConnectionPool(
+        connection_class=_AsyncFakeConnection, server=_fake_server, decode_responses=True,
+    ))
+    REDIS_CACHED_CLIENT = REDIS_CLIENT  # fakeredis has no CLIENT TRACKING
+else:
+    _bench_redis_options = {**REDIS_CLIENT_OPTIONS, "host": os.environ.get("BENCH_REDIS_HOST", "localhost")}
+    REDIS_CLIENT = build_redis_client(**_bench_redis_options)
+    REDIS_ASYNC_CLIENT = build_async_redis_client(**_bench_redis_options)
+    REDIS_CACHED_CLIENT = build_cached_redis_client(REDIS_CLIENT, REDIS_CLIENT_CACHE_SIZE, **_bench_redis_options)
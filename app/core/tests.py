@@ -0,0 +1,364 @@
+"""Core tests. The Redis ones run on in-process fakeredis (optional dependency)."""
+import json
+from unittest import mock, skipUnless
+
+from django.http import HttpResponse
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+import redis
+from redis.cluster import NodesManager, key_slot
+from redis.exceptions import ConnectionError, RedisClusterException, ResponseError
+
+from . import rate_limit, redis_session
+from .client_cache import TrackingCache
+from .middleware import RateLimitMiddleware
+from .redis_pool import ScriptingRedisCluster
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+needs_fakeredis = skipUnless(fakeredis, "needs the fakeredis package")
+
+CLUSTER_PORTS = (7000, 7001, 7002)
+
+
+def fake_cluster(ports=CLUSTER_PORTS):
+    """A ScriptingRedisCluster over one fakeredis server per primary, the slots split evenly.
+
+    Returns ``(client, {port: plain client of that node})``.
+    """
+    servers = {port: fakeredis.FakeServer() for port in ports}
+    step = 16384 // len(ports)
+    slots = [
+        [index * step, 16383 if index == len(ports) - 1 else (index + 1) * step - 1, ["127.0.0.1", port, str(port)]]
+        for index, port in enumerate(ports)
+    ]
+
+    class FakeNode(redis.Redis):
+        def execute_command(self, *args, **options):
+            if args[:1] == ("CLUSTER SLOTS",):
+                return slots
+            return super().execute_command(*args, **options)
+
+    def create_redis_node(self, host, port, **kwargs):
+        return FakeNode(connection_pool=redis.ConnectionPool(
+            connection_class=fakeredis.FakeRedisConnection, server=servers[port], decode_responses=True,
+        ))
+
+    with mock.patch.object(NodesManager, "create_redis_node", create_redis_node):
+        client = ScriptingRedisCluster(host="127.0.0.1", port=ports[0], decode_responses=True)
+    nodes = {port: create_redis_node(None, "127.0.0.1", port) for port in ports}
+    return client, nodes
+
+
+def keys_on_every_node(client, count=3):
+    """One key per primary, in port order."""
+    keys = {}
+    for n in range(1000):
+        key = f"k{n}"
+        keys.setdefault(client.nodes_manager.get_node_from_slot(key_slot(key.encode())).port, key)
+        if len(keys) == count:
+            return [keys[port] for port in sorted(keys)]
+    raise AssertionError("no key for every node")
+
+
+@needs_fakeredis
+class ScriptingRedisClusterTests(SimpleTestCase):
+    def setUp(self):
+        self.client, self.nodes = fake_cluster()
+        self.incr = self.client.register_script("return redis.call('INCR', KEYS[1])")
+        self.keys = keys_on_every_node(self.client)
+
+    def run_pipelined(self):
+        pipe = self.client.pipeline(transaction=False)
+        for key in self.keys:
+            self.incr(keys=[key], client=pipe)
+        return pipe.execute()
+
+    def test_pipelined_scripts_run_on_every_node(self):
+        self.assertEqual(self.run_pipelined(), [1, 1, 1])
+        self.assertEqual([node.get(key) for node, key in zip(self.nodes.values(), self.keys)], ["1", "1", "1"])
+
+    def test_node_without_the_script_loads_it_and_runs_each_command_once(self):
+        self.run_pipelined()
+        self.nodes[CLUSTER_PORTS[1]].script_flush()
+        self.assertEqual(self.run_pipelined(), [2, 2, 2])
+        self.assertEqual(self.nodes[CLUSTER_PORTS[1]].script_exists(self.incr.sha), [True])
+
+    def test_script_call_outside_a_pipeline(self):
+        self.assertEqual(self.incr(keys=[self.keys[0]]), 1)
+        for node in self.nodes.values():
+            node.script_flush()
+        self.assertEqual(self.incr(keys=[self.keys[0]]), 2)
+
+    def test_pipeline_errors_are_raised_after_the_retry(self):
+        self.client.set(self.keys[1], "not a number")
+        with self.assertRaises(redis.ResponseError):
+            self.run_pipelined()
+        self.assertEqual(self.client.get(self.keys[0]), "1")
+
+    def test_transactions_are_refused(self):
+        with self.assertRaises(RedisClusterException):
+            self.client.pipeline(transaction=True)
+
+
+class StubTrackingConnection:
+    """A RESP3 connection with CLIENT TRACKING on, answering from the ``store`` client.
+
+    Invalidations are queued with ``invalidate`` and delivered like the
+    RESP3 parser does: before the next reply, or by a drain.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._sock = None
+        self._parser = self
+        self.callbacks = []
+        self.pushes = []
+        self.down = False
+        self.resp3 = True
+        self.during_fetch = None
+        self._reply = None
+
+    def set_invalidation_push_handler(self, handler):
+        self.handler = handler
+
+    def register_connect_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def connect(self):
+        if self._sock is not None:
+            return
+        if self.down:
+            raise ConnectionError("Connection refused.")
+        if not self.resp3:
+            raise ResponseError("unknown command 'HELLO'")
+        self._sock = object()
+        for callback in self.callbacks:
+            callback(self)
+
+    def disconnect(self):
+        self._sock = None
+
+    def send_command(self, *args):
+        if self.down:
+            raise ConnectionError("Connection reset by peer.")
+        self._reply = "OK" if args[0] == "CLIENT" else self.store.execute_command(*args)
+        if self.during_fetch and args[0] != "CLIENT":
+            self.during_fetch()
+
+    def read_response(self, push_request=False):
+        while self.pushes:
+            self.handler(self.pushes.pop(0))
+        return None if push_request else self._reply
+
+    def can_read(self, timeout=0):
+        return bool(self.pushes)
+
+    def invalidate(self, *keys):
+        self.pushes.append(["invalidate", list(keys) or None])
+
+
+@needs_fakeredis
+class TrackingCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.store = fakeredis.FakeRedis(decode_responses=True)
+        self.connection = StubTrackingConnection(self.store)
+        self.cache = TrackingCache(self.store, lambda protocol, **kwargs: self.connection, max_size=2)
+        self.store.hset("catalog", mapping={"1": "tea", "2": "cake"})
+
+    def write(self, field, value):
+        self.store.hset("catalog", field, value)
+        self.connection.invalidate("catalog")
+
+    def test_repeated_read_is_served_from_memory(self):
+        self.assertEqual(self.cache.hmget("catalog", ["1"]), ["tea"])
+        self.assertEqual(self.cache.hmget("catalog", ["1"]), ["tea"])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_write_invalidates_every_read_of_the_key(self):
+        self.cache.hget("catalog", "1")
+        self.cache.hmget("catalog", ["1", "2"])
+        self.write("1", "green tea")
+        self.assertEqual(self.cache.hget("catalog", "1"), "green tea")
+        self.assertEqual(self.cache.hmget("catalog", ["1", "2"]), ["green tea", "cake"])
+        self.assertEqual(self.cache.invalidations, 2)
+
+    def test_flushall_empties_the_cache(self):
+        self.cache.hget("catalog", "1")
+        self.store.flushall()
+        self.connection.invalidate()
+        self.assertIsNone(self.cache.hget("catalog", "1"))
+
+    def test_reply_fetched_across_an_invalidation_is_not_stored(self):
+        self.connection.during_fetch = lambda: self.write("1", "green tea")
+        self.assertEqual(self.cache.hget("catalog", "1"), "tea")
+        self.connection.during_fetch = None
+        self.assertEqual(self.cache.hget("catalog", "1"), "green tea")
+        self.assertEqual(self.cache.stats()["size"], 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.hget("catalog", "1")
+        self.cache.hget("catalog", "2")
+        self.cache.hget("catalog", "1")
+        self.cache.get("other")
+        self.assertEqual(list(self.cache._entries), [("HGET", "catalog", "1"), ("GET", "other")])
+        self.assertEqual(self.cache._by_key["catalog"], {("HGET", "catalog", "1")})
+
+    def test_lost_connection_falls_back_and_reconnects_with_an_empty_cache(self):
+        self.cache.hget("catalog", "1")
+        self.connection.down = True
+        self.connection.disconnect()
+        self.store.hset("catalog", "1", "green tea")  # its invalidation is lost with the connection
+        self.assertEqual(self.cache.hget("catalog", "1"), "green tea")
+        self.assertEqual(self.cache.stats()["size"], 0)
+        self.assertEqual(self.cache.fallbacks, 1)
+
+        self.connection.down = False
+        self.assertEqual(self.cache.hget("catalog", "1"), "green tea")
+        self.assertEqual(self.cache.hget("catalog", "1"), "green tea")
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_server_without_resp3_disables_the_cache(self):
+        self.connection.resp3 = False
+        with self.assertLogs("core.client_cache", "WARNING"):
+            self.assertEqual(self.cache.hget("catalog", "1"), "tea")
+        self.assertEqual(self.cache.hget("catalog", "1"), "tea")
+        self.assertFalse(self.cache.stats()["enabled"])
+        self.assertEqual(self.cache.hits, 0)
+
+
+@needs_fakeredis
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+        self.limiter = rate_limit.RateLimiter("session", 0.01, 4, lease_fraction=0.5)
+        for name, value in (
+            ("redis_client", self.redis),
+            ("async_redis_client", fakeredis.FakeAsyncRedis(server=server, decode_responses=True)),
+            ("_limiters", {"session": self.limiter}),
+            ("_counters", {"local": 0, "redis": 0, "throttled": 0}),
+            ("RATE_LIMIT_PATHS", ("/api/cart/",)),
+        ):
+            self.enterContext(mock.patch.object(rate_limit, name, value))
+        self.request = RequestFactory().get("/api/cart/get/", HTTP_COOKIE="sessionid=abc")
+
+    def take(self):
+        return rate_limit._token_bucket(keys=[self.limiter.key("abc")], args=self.limiter.args(), client=self.redis)
+
+    def test_bucket_grants_leases_until_empty(self):
+        self.assertEqual(self.take(), [2, 0])
+        self.assertEqual(self.take(), [2, 0])
+        granted, retry_ms = self.take()
+        self.assertEqual(granted, 0)
+        self.assertGreater(retry_ms, 90_000)
+        self.assertGreater(self.redis.pttl(self.limiter.key("abc")), 0)
+
+    def test_leased_tokens_are_spent_without_redis(self):
+        verdicts = [rate_limit.check(self.request) for _ in range(4)]
+        self.assertEqual(verdicts, [None] * 4)
+        self.assertEqual(rate_limit.stats(), {"local": 2, "redis": 2, "throttled": 0})
+        self.assertGreater(rate_limit.check(self.request), 0)
+        self.assertEqual(rate_limit.stats()["throttled"], 1)
+
+    def test_expired_lease_is_not_spent(self):
+        self.limiter.store_lease("abc", 3)
+        self.assertTrue(self.limiter.take_local("abc"))
+        self.limiter._leases["abc"][1] = 0
+        self.assertFalse(self.limiter.take_local("abc"))
+        self.limiter.store_lease("xyz", 1)  # the single token went to the request itself
+        self.assertNotIn("xyz", self.limiter._leases)
+
+    def test_empty_bucket_answers_429(self):
+        middleware = RateLimitMiddleware(lambda request: HttpResponse("ok"))
+        statuses = [middleware(self.request).status_code for _ in range(4)]
+        self.assertEqual(statuses, [200] * 4)
+        response = middleware(self.request)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("throttled", json.loads(response.content)["detail"])
+        self.assertGreaterEqual(int(response["Retry-After"]), 90)
+        self.assertEqual(middleware(RequestFactory().get("/api/products/")).status_code, 200)
+
+    async def test_async_check_shares_the_bucket(self):
+        self.assertIsNone(rate_limit.check(self.request))
+        self.assertIsNone(await rate_limit.acheck(self.request))  # the leased token
+        self.assertIsNone(await rate_limit.acheck(self.request))
+        self.assertIsNone(await rate_limit.acheck(self.request))
+        self.assertGreater(await rate_limit.acheck(self.request), 0)
+
+
+@needs_fakeredis
+class RedisSessionTests(SimpleTestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+        self.enterContext(mock.patch.object(redis_session, "redis_client", self.redis))
+        self.enterContext(mock.patch.object(
+            redis_session, "async_redis_client", fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        ))
+
+    def new_session(self, **data):
+        session = redis_session.SessionStore()
+        session.update(data)
+        session.create()
+        session.save()
+        return session
+
+    def test_load_many_reads_without_sliding_expiry(self):
+        first, second = self.new_session(cart="a"), self.new_session(cart="b")
+        self.redis.expire(redis_session.KEY_PREFIX + first.session_key, 60)
+        loaded = redis_session.SessionStore.load_many([first.session_key, "missing", second.session_key])
+        self.assertEqual(loaded, {first.session_key: {"cart": "a"}, second.session_key: {"cart": "b"}})
+        self.assertLessEqual(self.redis.ttl(redis_session.KEY_PREFIX + first.session_key), 60)
+
+    def test_load_slides_expiry(self):
+        session = self.new_session(cart="a")
+        key = redis_session.KEY_PREFIX + session.session_key
+        self.redis.expire(key, 60)
+        self.assertEqual(redis_session.SessionStore(session.session_key).load(), {"cart": "a"})
+        self.assertGreater(self.redis.ttl(key), 60)
+
+    def test_cycle_key_keeps_the_data_and_the_old_key(self):
+        session = self.new_session(cart="a")
+        old_key = session.session_key
+        session.cycle_key()
+        self.assertEqual(session.previous_session_key, old_key)
+        self.assertNotEqual(session.session_key, old_key)
+        self.assertFalse(session.exists(old_key))
+        self.assertEqual(redis_session.SessionStore(session.session_key).load(), {"cart": "a"})
+
+    async def test_acycle_key(self):
+        session = redis_session.SessionStore()
+        session["cart"] = "a"
+        await session.acreate()
+        await session.asave()
+        old_key = session.session_key
+        await session.acycle_key()
+        self.assertEqual(session.previous_session_key, old_key)
+        self.assertFalse(await session.aexists(old_key))
+        self.assertEqual(await redis_session.SessionStore(session.session_key).aload(), {"cart": "a"})
+
+
+class MetricsAccessTests(TestCase):
+    def setUp(self):
+        self.url = reverse("metrics")
+
+    def test_anonymous_and_non_staff_are_refused(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_login(get_user_model().objects.create_user("shopper", password="pw"))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_staff_session(self):
+        self.client.force_login(get_user_model().objects.create_user("ops", password="pw", is_staff=True))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_bearer_token(self):
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION="Bearer s3cret").status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
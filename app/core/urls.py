@@ -18,11 +18,15 @@ from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
+from .views import RedisPoolStatsView, metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('inventory.urls')),
     path("api/cart/", include('cart.urls')),
     path("schema/", SpectacularAPIView.as_view(), name="schema"),
     path("docs/", SpectacularSwaggerView.as_view(url_name="schema"), name="swagger-ui"),
+    path("health/redis/", RedisPoolStatsView.as_view(), name="redis-pool-stats"),
+    path("metrics", metrics_view, name="metrics"),
 
 ]
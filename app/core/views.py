@@ -0,0 +1,43 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import client_cache, redis_metrics
+from .redis_pool import pool_stats
+
+
+class RedisPoolStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            "sync": pool_stats(settings.REDIS_CLIENT),
+            "async": pool_stats(settings.REDIS_ASYNC_CLIENT),
+            "client_cache": client_cache.cache_stats(settings.REDIS_CACHED_CLIENT),
+        })
+
+
+def _may_scrape(request):
+    """``Authorization: Bearer <METRICS_TOKEN>`` when a token is set, else a staff session."""
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if token:
+        return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+    return request.user.is_staff
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint for this worker's Redis and request metrics."""
+    if not _may_scrape(request):
+        return HttpResponseForbidden("Metrics need a staff session or the METRICS_TOKEN bearer token.")
+    pools = {
+        "sync": pool_stats(settings.REDIS_CLIENT),
+        "async": pool_stats(settings.REDIS_ASYNC_CLIENT),
+    }
+    return HttpResponse(
+        redis_metrics.render_prometheus(pools, client_cache.cache_stats(settings.REDIS_CACHED_CLIENT)),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,94 @@
+"""Redis-cached category tree.
+
+One hash holds the serialized tree under ``tree`` and every category's
+materialized path under its id, so a browse page resolves a category to
+its subtree without touching the database. Category saves and deletes
+bump a generation counter and drop the hash (see ``inventory.signals``);
+a rebuild that raced with such a change is not stored. Reads go through
+``REDIS_CACHED_CLIENT``, so with client-side caching on a worker serves
+the tree from memory until Redis reports the hash changed.
+"""
+import json
+import uuid
+
+from django.conf import settings
+
+from .models import Category
+
+redis_client = settings.REDIS_CLIENT
+cached_redis_client = settings.REDIS_CACHED_CLIENT
+
+TREE_TTL = 60 * 60 * 24
+TREE_KEY = "catalog:{categories}"
+GENERATION_KEY = "catalog:{categories}:generation"
+TREE_FIELD = "tree"
+GENERATION_FIELD = "_generation"
+
+# KEYS: build key, live key, generation key. ARGV: generation seen before
+# reading the database. Swaps the build in only if nothing changed since.
+_swap_script = redis_client.register_script("""
+if (redis.call('GET', KEYS[3]) or '0') ~= ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+return 1
+""")
+
+# KEYS: generation key, live key. Bumps the generation and drops the tree
+# together, without MULTI (which redis-py does not offer on Redis Cluster).
+_invalidate_script = redis_client.register_script("""
+redis.call('INCR', KEYS[1])
+redis.call('DEL', KEYS[2])
+""")
+
+
+def build_tree():
+    """Return ``(tree, paths)`` from one query ordered by path."""
+    nodes = {}
+    tree = []
+    paths = {}
+    categories = Category.objects.order_by("path").values_list("id", "parent_id", "name", "slug", "is_active", "path")
+    for pid, parent_id, name, slug, is_active, path in categories:
+        node = {"id": pid, "name": name, "slug": slug, "is_active": is_active, "children": []}
+        nodes[pid] = node
+        paths[pid] = path
+        # Ordering by path puts every parent before its children.
+        siblings = nodes[parent_id]["children"] if parent_id in nodes else tree
+        siblings.append(node)
+    return tree, paths
+
+
+def _load():
+    generation = redis_client.get(GENERATION_KEY) or "0"
+    tree, paths = build_tree()
+    serialized = json.dumps(tree, separators=(",", ":"))
+
+    build_key = f"{TREE_KEY}:build:{uuid.uuid4().hex}"
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(build_key, mapping={GENERATION_FIELD: generation, TREE_FIELD: serialized, **paths})
+    pipe.expire(build_key, TREE_TTL)
+    _swap_script(keys=[build_key, TREE_KEY, GENERATION_KEY], args=[generation], client=pipe)
+    pipe.execute()
+    return serialized, paths
+
+
+def get_tree_json():
+    """The serialized category tree, ready to be sent as a response body."""
+    serialized = cached_redis_client.hget(TREE_KEY, TREE_FIELD)
+    if serialized is None:
+        serialized, _ = _load()
+    return serialized
+
+
+def get_path(category_id):
+    """Materialized path of ``category_id``, or None if it does not exist."""
+    values = cached_redis_client.hmget(TREE_KEY, [GENERATION_FIELD, category_id])
+    if values[0] is None:
+        _, paths = _load()
+        return paths.get(category_id)
+    return values[1]
+
+
+def invalidate():
+    _invalidate_script(keys=[GENERATION_KEY, TREE_KEY])
@@ -0,0 +1,77 @@
+"""Constant-memory encoders for exporting the product catalog.
+
+Rows are read with a server-side cursor and encoded one at a time, then
+coalesced into ~64KB chunks (optionally gzipped on the fly), so memory use
+does not grow with the size of the catalog.
+"""
+import csv
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Product
+
+EXPORT_FIELDS = (
+    "id", "category_id", "name", "slug", "description",
+    "is_digital", "is_active", "price", "created_at", "updated_at",
+)
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def iter_product_rows(chunk_size=CHUNK_SIZE):
+    return Product.objects.order_by("id").values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def ndjson_lines(rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in rows:
+        yield encoder.encode(dict(zip(EXPORT_FIELDS, row))) + "\n"
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def buffered(lines, size=BUFFER_SIZE):
+    buffer = []
+    length = 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b"".join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(export_format, gzip=False, rows=None):
+    rows = iter_product_rows() if rows is None else rows
+    lines = ndjson_lines(rows) if export_format == "ndjson" else csv_lines(rows)
+    chunks = buffered(lines)
+    return gzipped(chunks) if gzip else chunks
@@ -0,0 +1,95 @@
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from inventory import export
+from inventory.models import Product
+
+MODES = ("stream", "materialize")
+SOURCES = ("synthetic", "db")
+
+
+def synthetic_rows(count):
+    now = datetime.now(timezone.utc)
+    for pid in range(1, count + 1):
+        yield (
+            pid, pid % 50 + 1, f"Product {pid}", f"product-{pid}", "Synthetic benchmark product",
+            False, True, Decimal("19.99"), now, now,
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure peak RSS of exporting N products (synthetic, or the first N from the "
+        "database) through the streaming encoders versus materializing them like the "
+        "list endpoint. Each mode runs in its own process so the peaks do not mask each other."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--source", choices=SOURCES, default="synthetic")
+        parser.add_argument("--mode", choices=MODES, help="Run a single mode in-process.")
+        parser.add_argument("--gzip", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["mode"]:
+            result = self._run(options["mode"], options["source"], options["rows"], options["gzip"])
+            self.stdout.write(json.dumps(result))
+            return
+
+        # The children must use the same database and Redis as this run,
+        # whether they came from --settings or the environment.
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE}
+        results = {}
+        for mode in MODES:
+            command = [
+                sys.executable, sys.argv[0], "bench_export", "--mode", mode,
+                "--source", options["source"], "--rows", str(options["rows"]),
+            ]
+            if options["gzip"]:
+                command.append("--gzip")
+            completed = subprocess.run(command, capture_output=True, text=True, check=True, env=env)
+            results[mode] = json.loads(completed.stdout)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def _rows(self, mode, source, count):
+        if source == "synthetic":
+            return synthetic_rows(count)
+        if mode == "stream":
+            return itertools.islice(export.iter_product_rows(), count)
+        return Product.objects.order_by("id").values_list(*export.EXPORT_FIELDS)[:count]
+
+    def _run(self, mode, source, count, use_gzip):
+        if source == "db":
+            count = min(count, Product.objects.count())
+        baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        written = 0
+        rows = self._rows(mode, source, count)
+
+        if mode == "stream":
+            for chunk in export.export_chunks("ndjson", gzip=use_gzip, rows=rows):
+                written += len(chunk)
+        else:
+            # What the list endpoint used to do: build every row, then render.
+            products = [dict(zip(export.EXPORT_FIELDS, row)) for row in rows]
+            body = json.dumps(products, cls=DjangoJSONEncoder, ensure_ascii=False).encode()
+            written = len(body)
+
+        return {
+            "rows": count,
+            "bytes": written,
+            "seconds": round(time.perf_counter() - start, 2),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "baseline_rss_mb": round(baseline_kb / 1024, 1),
+        }
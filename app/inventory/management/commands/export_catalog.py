@@ -0,0 +1,30 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from inventory import export
+
+
+class Command(BaseCommand):
+    help = "Stream the product catalog to a file or stdout as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", dest="export_format", choices=sorted(export.CONTENT_TYPES), default="ndjson")
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--output", default="-", help="Output path, or - for stdout.")
+        parser.add_argument("--chunk-size", type=int, default=export.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        rows = export.iter_product_rows(chunk_size=options["chunk_size"])
+        chunks = export.export_chunks(options["export_format"], gzip=options["gzip"], rows=rows)
+
+        if options["output"] == "-":
+            out = sys.stdout.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+            return
+
+        with open(options["output"], "wb") as out:
+            for chunk in chunks:
+                out.write(chunk)
@@ -0,0 +1,188 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from redis.exceptions import RedisError
+
+from inventory import category_tree, product_cache, stock
+from inventory.models import Category, Product
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
+CATEGORY_COLUMNS = {
+    "id": "bigint", "parent_id": "bigint", "name": "text", "slug": "text",
+    "is_active": "boolean", "level": "smallint",
+}
+PRODUCT_COLUMNS = {
+    "id": "bigint", "category_id": "bigint", "name": "text", "slug": "text",
+    "description": "text", "is_digital": "boolean", "is_active": "boolean",
+    "price": "numeric(10,2)", "stock": "integer", "created_at": "timestamptz", "updated_at": "timestamptz",
+}
+
+
+def _read_header(path, known_columns):
+    with open(path, newline="", encoding="utf-8") as f:
+        header = next(csv.reader(f), None)
+    if not header or "id" not in header:
+        raise CommandError(f"{path}: missing CSV header with an id column.")
+    unknown = set(header) - set(known_columns)
+    if unknown:
+        raise CommandError(f"{path}: unknown columns {', '.join(sorted(unknown))}.")
+    return header
+
+
+def _copy_into_staging(cursor, staging_table, columns, path):
+    column_list = ", ".join(columns)
+    with open(path, "rb") as f, cursor.copy(
+        f"COPY {staging_table} ({column_list}) FROM STDIN WITH (FORMAT csv, HEADER true)"
+    ) as copy:
+        while block := f.read(COPY_BLOCK_SIZE):
+            copy.write(block)
+
+
+def _upsert(cursor, table, staging_table, columns, defaults=None):
+    """INSERT ... ON CONFLICT (id) DO UPDATE, skipping rows that did not change.
+
+    ``defaults`` are SQL expressions for columns that are missing from the
+    CSV or empty in it. Timestamps do not count as a change on their own;
+    changed rows get ``updated_at = now()`` like an ORM save would.
+    """
+    defaults = defaults or {}
+    insert_columns = list(dict.fromkeys([*columns, *defaults]))
+    select_list = ", ".join(
+        f"COALESCE({column}, {defaults[column]})" if column in defaults and column in columns
+        else defaults.get(column, column)
+        for column in insert_columns
+    )
+    updated = [column for column in insert_columns if column not in ("id", "created_at")]
+    compared = [column for column in updated if column != "updated_at"]
+    assignments = ", ".join(
+        f"{column} = now()" if column == "updated_at" else f"{column} = EXCLUDED.{column}"
+        for column in updated
+    )
+    current = ", ".join(f"{table}.{column}" for column in compared)
+    incoming = ", ".join(f"EXCLUDED.{column}" for column in compared)
+    cursor.execute(
+        f"INSERT INTO {table} ({', '.join(insert_columns)}) "
+        f"SELECT {select_list} FROM {staging_table} "
+        f"ON CONFLICT (id) DO UPDATE SET {assignments} "
+        f"WHERE ({current}) IS DISTINCT FROM ({incoming})"
+    )
+    return cursor.rowcount
+
+
+def _rebuild_category_paths(cursor, table):
+    """Recompute the materialized ``path`` and ``level`` of every category in one statement."""
+    cursor.execute(
+        f"WITH RECURSIVE tree (id, path, level) AS ("
+        f" SELECT id, id::text || '/', 1 FROM {table} WHERE parent_id IS NULL"
+        f" UNION ALL"
+        f" SELECT c.id, tree.path || c.id::text || '/', tree.level + 1"
+        f" FROM {table} c JOIN tree ON c.parent_id = tree.id"
+        f") "
+        f"UPDATE {table} c SET path = tree.path, level = tree.level FROM tree "
+        f"WHERE c.id = tree.id AND (c.path, c.level) IS DISTINCT FROM (tree.path, tree.level)"
+    )
+    return cursor.rowcount
+
+
+def _reset_sequence(cursor, table):
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table}"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk load category and product CSVs with COPY FROM STDIN into staging "
+        "tables and upsert them in one transaction (PostgreSQL only)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", help="Category CSV (id,parent_id,name,slug,is_active,level).")
+        parser.add_argument("--products", help="Product CSV (id,category_id,name,slug,...,price,stock).")
+        parser.add_argument("--delete-missing", action="store_true",
+                            help="Delete products whose id is not in the product CSV.")
+        parser.add_argument("--skip-cache", action="store_true",
+                            help="Do not refresh the Redis catalog caches and stock counters afterwards.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("import_catalog streams with COPY and requires PostgreSQL.")
+        if not options["categories"] and not options["products"]:
+            raise CommandError("Pass --categories and/or --products.")
+
+        category_table = Category._meta.db_table
+        product_table = Product._meta.db_table
+        stocked_ids = []
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if options["categories"]:
+                columns = _read_header(options["categories"], CATEGORY_COLUMNS)
+                self._create_staging(cursor, "stage_category", columns, CATEGORY_COLUMNS)
+                _copy_into_staging(cursor, "stage_category", columns, options["categories"])
+                # parent_id is loaded in the same statement: Django's FK
+                # constraints are DEFERRABLE INITIALLY DEFERRED, so parents may
+                # appear after their children and the tree resolves at commit.
+                count = _upsert(cursor, category_table, "stage_category", columns,
+                                defaults={"is_active": "false", "level": "0"})
+                _reset_sequence(cursor, category_table)
+                self.stdout.write(f"Categories inserted/updated: {count}")
+                # The inserts bypass Category.save(), which maintains the paths.
+                count = _rebuild_category_paths(cursor, category_table)
+                self.stdout.write(f"Category paths updated: {count}")
+
+            if options["products"]:
+                columns = _read_header(options["products"], PRODUCT_COLUMNS)
+                self._create_staging(cursor, "stage_product", columns, PRODUCT_COLUMNS)
+                _copy_into_staging(cursor, "stage_product", columns, options["products"])
+                count = _upsert(cursor, product_table, "stage_product", columns, defaults={
+                    "is_digital": "false",
+                    "is_active": "false",
+                    "created_at": "now()",
+                    "updated_at": "now()",
+                })
+                _reset_sequence(cursor, product_table)
+                self.stdout.write(f"Products inserted/updated: {count}")
+                if "stock" in columns:
+                    # Read before commit drops the staging table.
+                    cursor.execute("SELECT id FROM stage_product ORDER BY id")
+                    stocked_ids = [product_id for product_id, in cursor.fetchall()]
+
+                if options["delete_missing"]:
+                    cursor.execute(
+                        f"DELETE FROM {product_table} p "
+                        f"WHERE NOT EXISTS (SELECT 1 FROM stage_product s WHERE s.id = p.id)"
+                    )
+                    self.stdout.write(f"Products deleted: {cursor.rowcount}")
+
+        # COPY bypasses the model signals, so refresh the caches here.
+        if options["categories"] and not options["skip_cache"]:
+            try:
+                category_tree.invalidate()
+            except RedisError as exc:
+                self.stderr.write(f"Category tree cache not invalidated: {exc}")
+
+        if options["products"] and not options["skip_cache"]:
+            try:
+                version = product_cache.rebuild_catalog()
+            except RedisError as exc:
+                self.stderr.write(f"Catalog cache not rebuilt: {exc}")
+            else:
+                self.stdout.write(f"Catalog cache rebuilt (version {version}).")
+
+        if stocked_ids and not options["skip_cache"]:
+            # The Redis counters would keep the old stock until the next
+            # stock.reconcile().
+            try:
+                count = stock.sync_in_batches(stocked_ids)
+            except RedisError as exc:
+                self.stderr.write(f"Stock counters not synced: {exc}")
+            else:
+                self.stdout.write(f"Stock counters synced: {count}")
+
+        self.stdout.write(self.style.SUCCESS("Catalog import finished."))
+
+    def _create_staging(self, cursor, name, columns, types):
+        definition = ", ".join(f"{column} {types[column]}" for column in columns)
+        cursor.execute(f"CREATE TEMP TABLE {name} ({definition}) ON COMMIT DROP")
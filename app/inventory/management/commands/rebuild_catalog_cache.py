@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from inventory import product_cache
+
+
+class Command(BaseCommand):
+    help = "Rebuild the Redis product snapshot and swap it in atomically (e.g. after bulk price updates)."
+
+    def handle(self, *args, **options):
+        version = product_cache.rebuild_catalog()
+        self.stdout.write(self.style.SUCCESS(f"Catalog cache rebuilt (version {version})."))
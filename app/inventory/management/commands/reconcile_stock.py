@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory import stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Release expired stock reservations, write sold units back to Product.stock "
+        "in bulk and re-derive the Redis counters from the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep reconciling, one pass per --interval.")
+        parser.add_argument("--interval", type=int, default=60, help="Seconds between passes with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            result = stock.reconcile()
+            self.stdout.write(
+                f"Released {result['released']} reservations, wrote back {result['flushed']} products, "
+                f"synced {result['synced']} counters."
+            )
+            if not options["loop"]:
+                return
+            time.sleep(max(0, options["interval"] - (time.monotonic() - started)))
@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0002_product_updated_at_auto_now'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='category',
+            name='created_at',
+        ),
+    ]
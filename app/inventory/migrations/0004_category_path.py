@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    Category = apps.get_model('inventory', 'Category')
+    categories = list(Category.objects.only('id', 'parent_id'))
+    parents = {category.id: category.parent_id for category in categories}
+    paths = {}
+
+    def path_of(category_id):
+        if category_id not in paths:
+            parent_id = parents[category_id]
+            paths[category_id] = (path_of(parent_id) if parent_id else '') + f'{category_id}/'
+        return paths[category_id]
+
+    for category in categories:
+        category.path = path_of(category.id)
+        category.level = category.path.count('/')
+    Category.objects.bulk_update(categories, ['path', 'level'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_remove_category_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_default='', default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 
 
 class Category(models.Model):
@@ -7,10 +9,46 @@ class Category(models.Model):
     slug = models.SlugField(max_length=100, unique=True)
     is_active = models.BooleanField(default=False)
     level = models.SmallIntegerField(default=False)
+    # Materialized path of ancestor ids, root first: "3/17/42/". A subtree is
+    # every category whose path starts with the root's path.
+    path = models.CharField(max_length=255, default='', db_default='', editable=False)
+
+    class Meta:
+        indexes = [
+            # varchar_pattern_ops lets PostgreSQL use the index for LIKE 'prefix%'.
+            models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Save and keep ``path`` and ``level`` of this category and its descendants in sync."""
+        paths = Category.objects.values_list('path', flat=True)
+        with transaction.atomic():
+            # Read from the database: in-memory parents may carry stale paths.
+            old_path = (paths.filter(pk=self.pk).first() or '') if self.pk else ''
+            parent_path = paths.get(pk=self.parent_id) if self.parent_id else ''
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError('A category cannot be moved under its own subtree.')
+
+            super().save(*args, **kwargs)
+            path = f'{parent_path}{self.pk}/'
+            if path == old_path:
+                self.path = path
+                return
+
+            # The id is only known after the insert, so the path is written
+            # with an UPDATE; descendants are re-rooted in a single statement.
+            level = path.count('/')
+            Category.objects.filter(pk=self.pk).update(path=path, level=level)
+            if old_path:
+                Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+                    level=F('level') + (level - old_path.count('/')),
+                )
+            self.path, self.level = path, level
+
 
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
@@ -20,7 +58,12 @@ class Product(models.Model):
     is_digital = models.BooleanField(default=False)
     is_active = models.BooleanField(default=False)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Units on hand; None means stock is not tracked (digital or unlimited).
+    # Reservations and sales run on the Redis counters in inventory.stock,
+    # which write sales back here in bulk.
+    stock = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
+
     def __str__(self):
         return self.name
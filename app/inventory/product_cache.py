@@ -0,0 +1,296 @@
+"""Read-through Redis snapshot of the product catalog.
+
+The whole catalog lives in one hash, ``pid -> "<price>|<is_active>|<name>"``
+plus a ``_version`` field. Rebuilds write a fresh hash and RENAME it over
+the live one, so readers switch catalogs atomically. Single product saves
+and deletes are written through by the signal handlers in
+``inventory.signals``, which keeps the snapshot complete: a product id
+missing from a live snapshot does not exist. The snapshot therefore has no
+TTL, so no request ever pays for a rebuild just because it got old; bulk
+changes that bypass the signals run ``rebuild_catalog_cache``. A rebuild
+on read only happens when the hash is gone (first start, flush, eviction),
+and the single-flight lock is held for a multiple of the last measured
+rebuild time.
+
+``lookup_products`` adds an in-process LRU in front of the snapshot for
+hot paths such as cart adds: entries (including "no such product") live
+for ``PRODUCT_LOCAL_CACHE_TTL`` seconds, so other workers' changes show up
+within that window; this worker's own writes drop its entries at once.
+With ``REDIS_CLIENT_CACHE_SIZE`` the snapshot reads themselves go through
+the tracking cache (``core.client_cache``), which Redis invalidates on
+any write to the catalog hash.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import Product
+
+redis_client = settings.REDIS_CLIENT
+async_redis_client = settings.REDIS_ASYNC_CLIENT
+cached_redis_client = settings.REDIS_CACHED_CLIENT
+
+LOCK_TTL_MS = 30 * 1000  # until a rebuild has been timed
+LOCK_TTL_FACTOR = 3  # times the last rebuild, so a slow one still holds the lock
+MIN_LOCK_TTL_MS = 1000
+TOUCHED_TTL = 60 * 60  # only read by a rebuild in progress
+WAIT_FOR_REBUILD = 2.0  # seconds a reader waits for another worker's rebuild
+BUILD_BATCH_SIZE = 1000
+
+# One hash tag so RENAME stays single-slot on Redis Cluster.
+LIVE_KEY = "catalog:{products}"
+LOCK_KEY = "catalog:{products}:lock"
+VERSION_KEY = "catalog:{products}:version"
+TOUCHED_KEY = "catalog:{products}:touched"
+REBUILD_MS_KEY = "catalog:{products}:rebuild_ms"
+VERSION_FIELD = "_version"
+
+PRODUCT_LOCAL_CACHE_TTL = getattr(settings, "PRODUCT_LOCAL_CACHE_TTL", 5)
+PRODUCT_LOCAL_CACHE_SIZE = getattr(settings, "PRODUCT_LOCAL_CACHE_SIZE", 10_000)
+
+# Only write through into a live snapshot; a missing one is rebuilt on read.
+_write_through_script = redis_client.register_script("""
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+if ARGV[3] == '' then
+    redis.call('HDEL', KEYS[1], ARGV[2])
+else
+    redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+end
+return 1
+""")
+
+_release_lock_script = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+# SMEMBERS + DEL in one step (a MULTI pipeline is not available on Redis Cluster).
+_take_touched_script = redis_client.register_script("""
+local ids = redis.call('SMEMBERS', KEYS[1])
+redis.call('DEL', KEYS[1])
+return ids
+""")
+
+
+class _LocalCache:
+    """Thread-safe LRU of product lookups, each entry valid for ``ttl`` seconds."""
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # product id -> (expires at, product or None)
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, product_ids):
+        """Return ``(found, missing)``; ``found`` maps ids to products or None."""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for pid in product_ids:
+                entry = self._entries.get(pid)
+                if entry is None or entry[0] < now:
+                    missing.append(pid)
+                    continue
+                self._entries.move_to_end(pid)
+                found[pid] = entry[1]
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def set_many(self, product_ids, products):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for pid in product_ids:
+                self._entries[pid] = (expires, products.get(pid))
+                self._entries.move_to_end(pid)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, product_ids):
+        with self._lock:
+            for pid in product_ids:
+                self._entries.pop(pid, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+_local = _LocalCache(PRODUCT_LOCAL_CACHE_TTL, PRODUCT_LOCAL_CACHE_SIZE)
+
+
+def _encode(name, price, is_active):
+    return f"{price}|{int(is_active)}|{name}"
+
+
+def _decode(product_id, value):
+    price, is_active, name = value.split("|", 2)
+    return {
+        "id": int(product_id),
+        "name": name,
+        "price": Decimal(price),
+        "is_active": is_active == "1",
+    }
+
+
+def _from_db(product_ids=None):
+    products = Product.objects.values_list("id", "name", "price", "is_active")
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+    return {
+        pid: {"id": pid, "name": name, "price": price, "is_active": is_active}
+        for pid, name, price, is_active in products
+    }
+
+
+def rebuild_catalog():
+    """Snapshot the catalog from the database and swap it in atomically."""
+    build_key = f"{LIVE_KEY}:build:{uuid.uuid4().hex}"
+    start = time.monotonic()
+    redis_client.delete(TOUCHED_KEY)
+
+    pipe = redis_client.pipeline(transaction=False)
+    rows = Product.objects.values_list("id", "name", "price", "is_active").iterator(chunk_size=BUILD_BATCH_SIZE)
+    for count, (pid, name, price, is_active) in enumerate(rows, 1):
+        pipe.hset(build_key, pid, _encode(name, price, is_active))
+        if count % BUILD_BATCH_SIZE == 0:
+            pipe.execute()
+    version = redis_client.incr(VERSION_KEY)
+    pipe.hset(build_key, VERSION_FIELD, version)
+    pipe.rename(build_key, LIVE_KEY)
+    pipe.set(REBUILD_MS_KEY, int((time.monotonic() - start) * 1000))
+    pipe.execute()
+    _local.clear()
+
+    # Saves that landed while we were reading the table may be missing from
+    # the snapshot we just swapped in; re-apply them from the database.
+    touched = _take_touched_script(keys=[TOUCHED_KEY])
+    if touched:
+        refresh_products([int(pid) for pid in touched])
+    return version
+
+
+def refresh_products(product_ids):
+    """Write the current database state of ``product_ids`` through to the snapshot."""
+    current = _from_db(product_ids)
+    pipe = redis_client.pipeline(transaction=False)
+    for pid in product_ids:
+        product = current.get(pid)
+        value = _encode(product["name"], product["price"], product["is_active"]) if product else ""
+        _write_through_script(keys=[LIVE_KEY], args=[VERSION_FIELD, pid, value], client=pipe)
+        pipe.sadd(TOUCHED_KEY, pid)
+    pipe.expire(TOUCHED_KEY, TOUCHED_TTL)
+    pipe.execute()
+    _local.discard(product_ids)
+
+
+def _lock_ttl_ms():
+    last = redis_client.get(REBUILD_MS_KEY)
+    if last is None:
+        return LOCK_TTL_MS
+    return max(int(last) * LOCK_TTL_FACTOR, MIN_LOCK_TTL_MS)
+
+
+def _ensure_snapshot():
+    """Rebuild a missing snapshot once across all workers (single flight).
+
+    Returns False if another worker's rebuild did not finish in time.
+    """
+    token = uuid.uuid4().hex
+    if redis_client.set(LOCK_KEY, token, nx=True, px=_lock_ttl_ms()):
+        try:
+            rebuild_catalog()
+        finally:
+            _release_lock_script(keys=[LOCK_KEY], args=[token])
+        return True
+
+    deadline = time.monotonic() + WAIT_FOR_REBUILD
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        if redis_client.hexists(LIVE_KEY, VERSION_FIELD):
+            return True
+    return False
+
+
+def get_products(product_ids):
+    """Return ``{id: {"id", "name", "price", "is_active"}}`` for existing products."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+
+    values = cached_redis_client.hmget(LIVE_KEY, [VERSION_FIELD, *product_ids])
+    if values[0] is None:
+        if not _ensure_snapshot():
+            return _from_db(product_ids)
+        values = redis_client.hmget(LIVE_KEY, [VERSION_FIELD, *product_ids])
+
+    return {
+        pid: _decode(pid, value)
+        for pid, value in zip(product_ids, values[1:])
+        if value is not None
+    }
+
+
+async def aget_products(product_ids):
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+
+    values = await async_redis_client.hmget(LIVE_KEY, [VERSION_FIELD, *product_ids])
+    if values[0] is None:
+        return await sync_to_async(get_products)(product_ids)
+
+    return {
+        pid: _decode(pid, value)
+        for pid, value in zip(product_ids, values[1:])
+        if value is not None
+    }
+
+
+def lookup_products(product_ids):
+    """``get_products`` through the in-process LRU; warm lookups never leave the process."""
+    product_ids = list(product_ids)
+    found, missing = _local.get_many(product_ids)
+    if missing:
+        products = get_products(missing)
+        _local.set_many(missing, products)
+        found.update(products)
+    return {pid: product for pid, product in found.items() if product is not None}
+
+
+async def alookup_products(product_ids):
+    product_ids = list(product_ids)
+    found, missing = _local.get_many(product_ids)
+    if missing:
+        products = await aget_products(missing)
+        _local.set_many(missing, products)
+        found.update(products)
+    return {pid: product for pid, product in found.items() if product is not None}
+
+
+def get_product(product_id):
+    """One product through the in-process LRU, or None if it does not exist."""
+    return lookup_products([product_id]).get(product_id)
+
+
+async def aget_product(product_id):
+    return (await alookup_products([product_id])).get(product_id)
+
+
+def local_cache_stats():
+    return _local.stats()
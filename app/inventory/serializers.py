@@ -4,4 +4,26 @@ from .models import Product
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields =['id','name','price']
\ No newline at end of file
+        fields =['id','name','price']
+
+
+PRODUCT_LIST_FIELDS = ['id', 'name', 'slug', 'price', 'is_active', 'is_digital', 'category_id', 'updated_at']
+
+
+class ProductListQuerySerializer(serializers.Serializer):
+    cursor = serializers.IntegerField(min_value=0, required=False, help_text="Id of the last product of the previous page.")
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+    category = serializers.IntegerField(required=False)
+    is_active = serializers.BooleanField(required=False, allow_null=True, default=None)
+    fields = serializers.CharField(required=False, help_text="Comma separated subset of: " + ", ".join(PRODUCT_LIST_FIELDS))
+
+    def validate_fields(self, value):
+        fields = [field.strip() for field in value.split(',') if field.strip()]
+        unknown = set(fields) - set(PRODUCT_LIST_FIELDS)
+        if unknown:
+            raise serializers.ValidationError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        return fields
+
+
+class CategoryProductListQuerySerializer(ProductListQuerySerializer):
+    category = None
@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import category_tree, product_cache, stock
+from .models import Category, Product
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def write_through_product(sender, instance, **kwargs):
+    # After commit, so the cache never shows a row the database rolled back.
+    # robust: a Redis outage must not fail the save itself.
+    product_id = instance.pk
+    transaction.on_commit(lambda: product_cache.refresh_products([product_id]), robust=True)
+
+
+@receiver(post_save, sender=Product)
+def sync_stock(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: stock.sync_products([product_id]), robust=True)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_tree(sender, instance, **kwargs):
+    transaction.on_commit(category_tree.invalidate, robust=True)
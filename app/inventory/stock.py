@@ -0,0 +1,330 @@
+"""Stock reservations on atomic Redis counters.
+
+``Product.stock`` in the database is the units on hand. While a product is
+loaded, Redis keeps per product:
+
+    available  units that can still be reserved
+    held       units in live reservations
+    sold       units committed but not yet written back to the database
+
+with ``available = stock - held - sold`` at all times. Every operation is
+one Lua script, so a hot SKU is a single-threaded decrement in Redis
+instead of a contended row lock in PostgreSQL.
+
+A reservation (one per cart session) holds all its items or none, and
+expires after ``STOCK_RESERVATION_TTL`` unless committed by checkout
+completion (``CartCheckoutCompleteView``); expired ones are
+released lazily by the next ``reserve`` and in bulk by ``reconcile``,
+which also writes sold units back with one ``bulk_update`` and re-derives
+``available`` from the database to correct any drift.
+
+Products with ``stock=None`` are not tracked and never limit a
+reservation.
+"""
+import time
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .models import Product
+
+redis_client = settings.REDIS_CLIENT
+async_redis_client = settings.REDIS_ASYNC_CLIENT
+
+STOCK_RESERVATION_TTL = getattr(settings, "STOCK_RESERVATION_TTL", 15 * 60)
+REAP_ON_RESERVE = 16  # expired reservations released by each reserve call
+REAP_BATCH_SIZE = 500
+SYNC_BATCH_SIZE = 1000
+
+# One hash tag so every script stays single-slot on Redis Cluster.
+AVAILABLE_KEY = "stock:{inventory}:available"
+HELD_KEY = "stock:{inventory}:held"
+SOLD_KEY = "stock:{inventory}:sold"
+FLUSHING_KEY = "stock:{inventory}:sold:flushing"
+RESERVATIONS_KEY = "stock:{inventory}:reservations"  # id -> "pid=qty,pid=qty"
+EXPIRIES_KEY = "stock:{inventory}:expiries"  # id scored by expiry timestamp
+UNTRACKED_KEY = "stock:{inventory}:untracked"
+
+_KEYS = [AVAILABLE_KEY, HELD_KEY, SOLD_KEY, FLUSHING_KEY, RESERVATIONS_KEY, EXPIRIES_KEY, UNTRACKED_KEY]
+
+_RELEASE = """
+local function release(id)
+    local items = redis.call('HGET', KEYS[5], id)
+    if items then
+        for pid, qty in string.gmatch(items, '(%d+)=(%d+)') do
+            redis.call('HINCRBY', KEYS[1], pid, qty)
+            redis.call('HINCRBY', KEYS[2], pid, -qty)
+        end
+        redis.call('HDEL', KEYS[5], id)
+    end
+    redis.call('ZREM', KEYS[6], id)
+    return items and 1 or 0
+end
+
+local function reap(now, limit)
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[6], '-inf', now, 'LIMIT', 0, limit)
+    for _, id in ipairs(expired) do
+        release(id)
+    end
+    return #expired
+end
+"""
+
+# ARGV: reservation id, now, expires at, reap limit, then (product_id, quantity) pairs.
+# Returns {1} when reserved, {0, {pid, free, ...}} when short, {-1, {pid, ...}}
+# when products are not loaded. Nothing changes unless every item fits; a
+# previous reservation under the same id is replaced.
+_reserve_source = _RELEASE + """
+reap(ARGV[2], tonumber(ARGV[4]))
+local previous = {}
+local items = redis.call('HGET', KEYS[5], ARGV[1])
+if items then
+    for pid, qty in string.gmatch(items, '(%d+)=(%d+)') do
+        previous[pid] = tonumber(qty)
+    end
+end
+local missing, short, tracked = {}, {}, {}
+for i = 5, #ARGV, 2 do
+    if redis.call('SISMEMBER', KEYS[7], ARGV[i]) == 0 then
+        local available = redis.call('HGET', KEYS[1], ARGV[i])
+        if not available then
+            table.insert(missing, ARGV[i])
+        else
+            local free = tonumber(available) + (previous[ARGV[i]] or 0)
+            if free < tonumber(ARGV[i + 1]) then
+                table.insert(short, ARGV[i])
+                table.insert(short, free)
+            end
+            table.insert(tracked, ARGV[i] .. '=' .. ARGV[i + 1])
+        end
+    end
+end
+if #missing > 0 then
+    return {-1, missing}
+end
+if #short > 0 then
+    return {0, short}
+end
+release(ARGV[1])
+for _, item in ipairs(tracked) do
+    local pid, qty = string.match(item, '(%d+)=(%d+)')
+    redis.call('HINCRBY', KEYS[1], pid, -qty)
+    redis.call('HINCRBY', KEYS[2], pid, qty)
+end
+if #tracked > 0 then
+    redis.call('HSET', KEYS[5], ARGV[1], table.concat(tracked, ','))
+    redis.call('ZADD', KEYS[6], ARGV[3], ARGV[1])
+end
+return {1}
+"""
+
+# ARGV: reservation id
+_release_source = _RELEASE + """
+return release(ARGV[1])
+"""
+
+# ARGV: reservation id, now. Moves held units to sold; 0 if expired or unknown.
+_commit_source = _RELEASE + """
+local expires = redis.call('ZSCORE', KEYS[6], ARGV[1])
+if not expires or tonumber(expires) <= tonumber(ARGV[2]) then
+    release(ARGV[1])
+    return 0
+end
+local items = redis.call('HGET', KEYS[5], ARGV[1]) or ''
+for pid, qty in string.gmatch(items, '(%d+)=(%d+)') do
+    redis.call('HINCRBY', KEYS[2], pid, -qty)
+    redis.call('HINCRBY', KEYS[3], pid, qty)
+end
+redis.call('HDEL', KEYS[5], ARGV[1])
+redis.call('ZREM', KEYS[6], ARGV[1])
+return 1
+"""
+
+# ARGV: now, limit
+_reap_source = _RELEASE + """
+return reap(ARGV[1], tonumber(ARGV[2]))
+"""
+
+# ARGV: only missing ("1"/"0"), then (product_id, database stock or "") pairs.
+# Derives available from the database stock and what Redis still holds.
+_sync_source = """
+for i = 2, #ARGV, 2 do
+    local pid = ARGV[i]
+    if ARGV[i + 1] == '' then
+        redis.call('SADD', KEYS[7], pid)
+        redis.call('HDEL', KEYS[1], pid)
+    elseif ARGV[1] == '0' or redis.call('HEXISTS', KEYS[1], pid) == 0 then
+        local pending = tonumber(redis.call('HGET', KEYS[2], pid) or '0')
+            + tonumber(redis.call('HGET', KEYS[3], pid) or '0')
+            + tonumber(redis.call('HGET', KEYS[4], pid) or '0')
+        redis.call('SREM', KEYS[7], pid)
+        redis.call('HSET', KEYS[1], pid, tonumber(ARGV[i + 1]) - pending)
+    end
+end
+return 1
+"""
+
+# Moves sold counts aside for writing back. An unfinished earlier flush is
+# returned again instead, so a crash before the database commit loses nothing.
+_take_sold_source = """
+if redis.call('EXISTS', KEYS[4]) == 0 then
+    if redis.call('EXISTS', KEYS[3]) == 0 then
+        return {}
+    end
+    redis.call('RENAME', KEYS[3], KEYS[4])
+end
+return redis.call('HGETALL', KEYS[4])
+"""
+
+_reserve_script = redis_client.register_script(_reserve_source)
+_release_script = redis_client.register_script(_release_source)
+_commit_script = redis_client.register_script(_commit_source)
+_reap_script = redis_client.register_script(_reap_source)
+_sync_script = redis_client.register_script(_sync_source)
+_take_sold_script = redis_client.register_script(_take_sold_source)
+_async_reserve_script = async_redis_client.register_script(_reserve_source)
+_async_release_script = async_redis_client.register_script(_release_source)
+_async_commit_script = async_redis_client.register_script(_commit_source)
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages):
+        self.shortages = shortages  # product_id -> units still available
+        super().__init__(f"Insufficient stock for products {sorted(shortages)}")
+
+
+def _reserve_args(reservation_id, quantities, ttl):
+    now = time.time()
+    args = [reservation_id, now, now + (ttl or STOCK_RESERVATION_TTL), REAP_ON_RESERVE]
+    for product_id, quantity in quantities.items():
+        args += [product_id, quantity]
+    return args
+
+
+def _reserve_result(result, retried):
+    """None when reserved, the product ids to load before a retry, or raise."""
+    status = result[0]
+    if status == 1:
+        return
+    if status == -1:
+        if not retried:
+            return [int(pid) for pid in result[1]]
+        # Still not loaded after a sync: the products no longer exist.
+        raise InsufficientStock({int(pid): 0 for pid in result[1]})
+    short = result[1]
+    raise InsufficientStock({int(pid): max(0, int(free)) for pid, free in zip(short[::2], short[1::2])})
+
+
+def _clean(quantities):
+    return {int(pid): int(qty) for pid, qty in quantities.items() if qty > 0}
+
+
+def reserve(reservation_id, quantities, ttl=None):
+    """Hold ``{product_id: quantity}`` under ``reservation_id``; all or nothing.
+
+    Replaces any earlier reservation with the same id and returns its expiry
+    as a datetime. Raises ``InsufficientStock`` with what is left of the
+    products that do not fit.
+    """
+    quantities = _clean(quantities)
+    for retried in (False, True):
+        args = _reserve_args(reservation_id, quantities, ttl)
+        missing = _reserve_result(_reserve_script(keys=_KEYS, args=args, client=redis_client), retried)
+        if missing is None:
+            return datetime.fromtimestamp(args[2], tz=timezone.utc)
+        sync_products(missing, only_missing=True)
+
+
+async def areserve(reservation_id, quantities, ttl=None):
+    quantities = _clean(quantities)
+    for retried in (False, True):
+        args = _reserve_args(reservation_id, quantities, ttl)
+        result = await _async_reserve_script(keys=_KEYS, args=args, client=async_redis_client)
+        missing = _reserve_result(result, retried)
+        if missing is None:
+            return datetime.fromtimestamp(args[2], tz=timezone.utc)
+        await sync_to_async(sync_products)(missing, only_missing=True)
+
+
+def release(reservation_id):
+    """Give a reservation's units back; returns False if there was none."""
+    return bool(_release_script(keys=_KEYS, args=[reservation_id], client=redis_client))
+
+
+async def arelease(reservation_id):
+    return bool(await _async_release_script(keys=_KEYS, args=[reservation_id], client=async_redis_client))
+
+
+def commit(reservation_id):
+    """Turn a live reservation into a sale; False if it expired or never existed."""
+    return bool(_commit_script(keys=_KEYS, args=[reservation_id, time.time()], client=redis_client))
+
+
+async def acommit(reservation_id):
+    return bool(await _async_commit_script(keys=_KEYS, args=[reservation_id, time.time()], client=async_redis_client))
+
+
+def sync_products(product_ids, only_missing=False):
+    """Derive the Redis counters of ``product_ids`` from their database stock."""
+    product_ids = list(product_ids)
+    stock = dict(Product.objects.filter(id__in=product_ids).values_list("id", "stock"))
+    args = ["1" if only_missing else "0"]
+    for pid in product_ids:
+        # Deleted products are left unloaded; reserve reports them as short.
+        if pid in stock:
+            args += [pid, "" if stock[pid] is None else stock[pid]]
+    if len(args) > 1:
+        _sync_script(keys=_KEYS, args=args, client=redis_client)
+
+
+def sync_in_batches(product_ids):
+    """``sync_products`` over any number of ids, ``SYNC_BATCH_SIZE`` at a time; returns the id count."""
+    synced = 0
+    batch = []
+    for product_id in product_ids:
+        batch.append(product_id)
+        if len(batch) == SYNC_BATCH_SIZE:
+            sync_products(batch)
+            synced += len(batch)
+            batch = []
+    if batch:
+        sync_products(batch)
+        synced += len(batch)
+    return synced
+
+
+def reap_expired():
+    """Release every expired reservation; returns how many were released."""
+    released = 0
+    while True:
+        count = _reap_script(keys=_KEYS, args=[time.time(), REAP_BATCH_SIZE], client=redis_client)
+        released += count
+        if count < REAP_BATCH_SIZE:
+            return released
+
+
+def flush_sold():
+    """Write sold units back to ``Product.stock`` in one bulk UPDATE; returns the product count."""
+    raw = _take_sold_script(keys=_KEYS, client=redis_client)
+    sold = {int(pid): int(qty) for pid, qty in zip(raw[::2], raw[1::2]) if int(qty)}
+    if sold:
+        products = [Product(id=pid, stock=Greatest(F("stock") - Value(qty), Value(0))) for pid, qty in sold.items()]
+        with transaction.atomic():
+            Product.objects.bulk_update(products, ["stock"], batch_size=SYNC_BATCH_SIZE)
+    # A crash after the commit but before this DEL writes the batch back twice:
+    # stock errs low (undersell), never high.
+    redis_client.delete(FLUSHING_KEY)
+    return len(sold)
+
+
+def reconcile():
+    """Periodic pass: expire reservations, write sales back, re-derive availability."""
+    released = reap_expired()
+    flushed = flush_sold()
+    product_ids = Product.objects.values_list("id", flat=True).order_by("id").iterator(chunk_size=SYNC_BATCH_SIZE)
+    synced = sync_in_batches(product_ids)
+    return {"released": released, "flushed": flushed, "synced": synced}
@@ -1,3 +1,285 @@
-from django.test import TestCase
+"""Inventory tests. The Redis ones need the in-process fakeredis of the bench settings:
 
-# Create your tests here.
+    BENCH_FAKE_REDIS=1 python manage.py test --settings=core.settings_bench
+"""
+import csv
+import gzip
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from core import redis_metrics
+
+from . import category_tree, export, product_cache, stock
+from .management.commands import import_catalog
+from .models import Category, Product
+
+fake_redis = skipUnless(os.environ.get("BENCH_FAKE_REDIS"), "needs BENCH_FAKE_REDIS=1 --settings=core.settings_bench")
+
+redis_client = settings.REDIS_CLIENT
+
+
+def round_trips(operation, *args, **kwargs):
+    with redis_metrics.track() as stats:
+        operation(*args, **kwargs)
+    return stats.round_trips
+
+
+@fake_redis
+class InventoryRoundTripTests(TestCase):
+    def setUp(self):
+        redis_client.flushall()
+        product_cache._local.clear()
+        category = Category.objects.create(name="Tea", slug="tea", is_active=True)
+        self.tea, self.cake = (
+            Product.objects.create(
+                category=category, name=name, slug=name.lower(), price=price, stock=5, is_active=True,
+            )
+            for name, price in (("Green", "1.50"), ("Cake", "4.00"))
+        )
+        self.ids = [self.tea.id, self.cake.id]
+
+    def test_warm_catalog_read(self):
+        product_cache.get_products(self.ids)  # builds the snapshot
+        self.assertEqual(round_trips(product_cache.get_products, self.ids), 1)
+
+    def test_warm_lookup_stays_in_process(self):
+        product_cache.lookup_products(self.ids)
+        with redis_metrics.track() as stats:
+            products = product_cache.lookup_products(self.ids)
+        self.assertEqual(stats.round_trips, 0)
+        self.assertEqual(products[self.tea.id]["name"], "Green")
+
+    def test_reserve_and_commit(self):
+        stock.reserve("warm", {self.tea.id: 1, self.cake.id: 1})  # loads the products and scripts
+        stock.commit("warm")
+        self.assertEqual(round_trips(stock.reserve, "s1", {self.tea.id: 2, self.cake.id: 1}), 1)
+        self.assertEqual(round_trips(stock.commit, "s1"), 1)
+        self.assertFalse(stock.commit("s1"))
+
+    def test_reservation_is_all_or_nothing(self):
+        stock.reserve("s1", {self.tea.id: 4})
+        with self.assertRaises(stock.InsufficientStock) as raised:
+            stock.reserve("s2", {self.tea.id: 2, self.cake.id: 1})
+        self.assertEqual(raised.exception.shortages, {self.tea.id: 1})
+        stock.reserve("s3", {self.cake.id: 5})
+        self.assertTrue(stock.release("s1"))
+        stock.reserve("s2", {self.tea.id: 5})
+
+
+class ProductListConditionalGetTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Tea", slug="tea", is_active=True)
+        self.products = [
+            Product.objects.create(category=category, name=name, slug=name.lower(), price="1.00", is_active=True)
+            for name in ("Green", "Black", "White")
+        ]
+        self.url = reverse("product-list") + "?limit=2"
+
+    def revalidate(self, response, **headers):
+        return self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"], **headers)
+
+    def test_unchanged_page_is_not_fetched(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Last-Modified", response)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(response).status_code, 304)
+
+    def test_if_modified_since(self):
+        response = self.client.get(self.url)
+        revalidated = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_saved_product_changes_the_etag(self):
+        response = self.client.get(self.url)
+        self.products[1].name = "Earl Grey"
+        self.products[1].save()
+        revalidated = self.revalidate(response)
+        self.assertEqual(revalidated.status_code, 200)
+        self.assertEqual(revalidated.json()["results"][1]["name"], "Earl Grey")
+
+    def test_deleted_product_changes_the_etag(self):
+        response = self.client.get(self.url)
+        self.products[0].delete()
+        revalidated = self.revalidate(response)
+        self.assertEqual(revalidated.status_code, 200)
+        self.assertEqual([item["name"] for item in revalidated.json()["results"]], ["Black", "White"])
+
+
+@fake_redis
+class StockSyncTests(TestCase):
+    def setUp(self):
+        redis_client.flushall()
+        category = Category.objects.create(name="Tea", slug="tea", is_active=True)
+        self.ids = [
+            Product.objects.create(category=category, name=name, slug=name.lower(), price="1.00", stock=5).id
+            for name in ("Green", "Black", "White")
+        ]
+
+    def test_bulk_written_stock_reaches_the_counters(self):
+        stock.sync_products(self.ids)
+        Product.objects.filter(id__in=self.ids).update(stock=2)  # like COPY, no signals
+        with mock.patch.object(stock, "SYNC_BATCH_SIZE", 2):
+            self.assertEqual(stock.sync_in_batches(iter(self.ids)), 3)
+        self.assertEqual(redis_client.hmget(stock.AVAILABLE_KEY, self.ids), ["2", "2", "2"])
+
+    def test_import_accepts_a_stock_column(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as f:
+            f.write("id,category_id,name,slug,price,stock\n")
+            f.flush()
+            header = import_catalog._read_header(f.name, import_catalog.PRODUCT_COLUMNS)
+        self.assertEqual(header[-1], "stock")
+
+
+@fake_redis
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        redis_client.flushall()
+        self.food = Category.objects.create(name="Food", slug="food")
+        self.drinks = Category.objects.create(name="Drinks", slug="drinks")
+        self.tea = Category.objects.create(name="Tea", slug="tea", parent=self.food)
+        self.green = Category.objects.create(name="Green", slug="green", parent=self.tea)
+
+    def paths(self):
+        return dict(Category.objects.values_list("slug", "path"))
+
+    def test_move_re_roots_the_subtree(self):
+        self.tea.parent = self.drinks
+        self.tea.save()
+        d, t, g = self.drinks.pk, self.tea.pk, self.green.pk
+        self.assertEqual(self.paths()["tea"], f"{d}/{t}/")
+        self.assertEqual(self.paths()["green"], f"{d}/{t}/{g}/")
+        self.assertEqual(Category.objects.get(pk=g).level, 3)
+
+        self.tea.parent = None
+        self.tea.save()
+        self.assertEqual(self.paths()["green"], f"{t}/{g}/")
+        self.assertEqual(Category.objects.get(pk=g).level, 2)
+
+    def test_category_cannot_move_under_its_own_subtree(self):
+        self.food.parent = self.green
+        with self.assertRaises(ValueError):
+            self.food.save()
+        self.assertEqual(self.paths()["food"], f"{self.food.pk}/")
+
+    def test_tree_is_cached_and_dropped_on_save(self):
+        tree = json.loads(category_tree.get_tree_json())
+        self.assertEqual([node["slug"] for node in tree], ["food", "drinks"])
+        self.assertEqual(tree[0]["children"][0]["children"][0]["slug"], "green")
+        self.assertEqual(category_tree.get_path(self.green.pk), self.green.path)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tea.parent = self.drinks
+            self.tea.save()
+        self.assertFalse(redis_client.exists(category_tree.TREE_KEY))
+        self.assertEqual(category_tree.get_path(self.green.pk), f"{self.drinks.pk}/{self.tea.pk}/{self.green.pk}/")
+
+    def test_rebuild_that_raced_a_change_is_not_swapped_in(self):
+        build_tree = category_tree.build_tree
+
+        def racing_build():
+            built = build_tree()
+            category_tree.invalidate()
+            return built
+
+        with mock.patch.object(category_tree, "build_tree", racing_build):
+            self.assertIn('"food"', category_tree.get_tree_json())
+        self.assertEqual(redis_client.keys("catalog:{categories}*"), [category_tree.GENERATION_KEY])
+
+
+class ImportCatalogTests(TransactionTestCase):
+    def write_csv(self, text):
+        f = tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False)
+        self.addCleanup(os.unlink, f.name)
+        with f:
+            f.write(text)
+        return f.name
+
+    def test_header_is_checked_before_loading(self):
+        for text, message in (("", "missing CSV header"), ("name,slug\n", "missing CSV header"),
+                              ("id,name,colour\n", "unknown columns colour")):
+            with self.assertRaisesMessage(CommandError, message):
+                import_catalog._read_header(self.write_csv(text), import_catalog.CATEGORY_COLUMNS)
+
+    @skipUnless(connection.vendor != "postgresql", "checks the refusal on other databases")
+    def test_other_databases_are_refused(self):
+        with self.assertRaisesMessage(CommandError, "requires PostgreSQL"):
+            call_command("import_catalog", products=self.write_csv("id\n"))
+
+    @skipUnless(connection.vendor == "postgresql", "COPY needs PostgreSQL")
+    def test_import_upserts_and_rebuilds_paths(self):
+        # Children before their parents: the FK checks are deferred to the commit.
+        categories = self.write_csv("id,parent_id,name,slug,is_active\n2,1,Tea,tea,true\n1,,Food,food,true\n")
+        products = self.write_csv(
+            "id,category_id,name,slug,price,stock\n10,2,Green,green,1.50,5\n11,2,Black,black,2.00,\n"
+        )
+        out = StringIO()
+        call_command("import_catalog", categories=categories, products=products, skip_cache=True, stdout=out)
+        self.assertIn("Products inserted/updated: 2", out.getvalue())
+        self.assertEqual(Category.objects.get(pk=2).path, "1/2/")
+        self.assertEqual(Category.objects.get(pk=2).level, 2)
+        self.assertEqual(dict(Product.objects.values_list("id", "stock")), {10: 5, 11: None})
+
+        out = StringIO()
+        call_command("import_catalog", products=products, skip_cache=True, stdout=out)
+        self.assertIn("Products inserted/updated: 0", out.getvalue())
+
+        out = StringIO()
+        products = self.write_csv("id,category_id,name,slug,price\n10,2,Green,green,1.75\n")
+        call_command("import_catalog", products=products, delete_missing=True, skip_cache=True, stdout=out)
+        self.assertIn("Products deleted: 1", out.getvalue())
+        self.assertEqual(list(Product.objects.values_list("id", "price", "stock")), [(10, Decimal("1.75"), 5)])
+        self.assertEqual(Category.objects.create(name="Cake", slug="cake").pk, 3)  # sequence moved past the ids
+
+
+class ProductExportTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Tea", slug="tea")
+        for name, description in (("Green", 'Says "hi",\nthen leaves'), ("Black", None)):
+            Product.objects.create(
+                category=category, name=name, slug=name.lower(), description=description, price="1.50",
+            )
+        self.admin = get_user_model().objects.create_superuser("admin", "admin@example.com", "pw")
+
+    def export(self, export_format, **headers):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse("product-export", args=[export_format]), **headers)
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content)
+
+    def test_ndjson(self):
+        response, body = self.export("ndjson")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([row["name"] for row in rows], ["Green", "Black"])
+        self.assertEqual(rows[0]["description"], 'Says "hi",\nthen leaves')
+        self.assertEqual(rows[0]["price"], "1.50")
+        self.assertEqual(list(rows[0]), list(export.EXPORT_FIELDS))
+
+    def test_gzipped_csv(self):
+        response, body = self.export("csv", HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        rows = list(csv.reader(StringIO(gzip.decompress(body).decode())))
+        self.assertEqual(rows[0], list(export.EXPORT_FIELDS))
+        self.assertEqual([row[2] for row in rows[1:]], ["Green", "Black"])
+        self.assertEqual(rows[1][4], 'Says "hi",\nthen leaves')
+
+    def test_export_is_admin_only(self):
+        response = self.client.get(reverse("product-export", args=["csv"]))
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_lines_are_coalesced_into_chunks(self):
+        chunks = list(export.buffered((f"{n:09d}\n" for n in range(25)), size=100))
+        self.assertEqual([len(chunk) for chunk in chunks], [100, 100, 50])
+        self.assertEqual(b"".join(chunks).count(b"\n"), 25)
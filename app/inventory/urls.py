@@ -1,6 +1,9 @@
-from django.urls import path
-from .views import ProductListAPIView
+from django.urls import path, re_path
+from .views import CategoryProductListAPIView, CategoryTreeAPIView, ProductExportView, ProductListAPIView
 
 urlpatterns = [
     path('products/', ProductListAPIView.as_view(), name='product-list'),
+    path('categories/tree/', CategoryTreeAPIView.as_view(), name='category-tree'),
+    path('categories/<int:category_id>/products/', CategoryProductListAPIView.as_view(), name='category-products'),
+    re_path(r'^products/export/(?P<export_format>ndjson|csv)/$', ProductExportView.as_view(), name='product-export'),
 ]
\ No newline at end of file
@@ -1,11 +1,124 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from drf_spectacular.utils import extend_schema
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from . import category_tree, export
 from .models import Product
-from .serializers import ProductSerializer
+from .serializers import CategoryProductListQuerySerializer, ProductListQuerySerializer
 
 
 class ProductListAPIView(APIView):
+    query_serializer_class = ProductListQuerySerializer
+
+    def filter_products(self, products, params, **kwargs):
+        if "category" in params:
+            products = products.filter(category_id=params["category"])
+        return products
+
+    @extend_schema(
+        parameters=[ProductListQuerySerializer],
+        description="Keyset-paginated product list. Pass `next_cursor` back as `cursor` for the next page.",
+    )
+    def get(self, request, **kwargs):
+        query = self.query_serializer_class(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        fields = params.get("fields") or ["id", "name", "price"]
+        columns = list(dict.fromkeys(["id", *fields]))
+
+        products = self.filter_products(Product.objects.all(), params, **kwargs)
+        if params["is_active"] is not None:
+            products = products.filter(is_active=params["is_active"])
+
+        if "cursor" in params:
+            products = products.filter(id__gt=params["cursor"])
+        page = products.order_by("id")
+
+        # Validators come from an aggregate over the page's key range, so a
+        # conditional GET that ends in 304 never fetches or hashes the rows.
+        # Any save bumps updated_at; a delete or insert changes the count or
+        # the last id of the range.
+        validators = Product.objects.filter(
+            id__in=page.values("id")[: params["limit"] + 1]
+        ).aggregate(last_modified=Max("updated_at"), count=Count("id"), last_id=Max("id"))
+        last_modified = validators.pop("last_modified")
+        etag = '"%s"' % hashlib.md5(
+            f"{request.get_full_path()}:{last_modified and last_modified.isoformat()}:{validators}".encode()
+        ).hexdigest()
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            rows = list(page.values_list(*columns)[: params["limit"] + 1])
+            has_more = len(rows) > params["limit"]
+            rows = rows[: params["limit"]]
+
+            results = []
+            for row in rows:
+                item = dict(zip(columns, row))
+                if "price" in item:
+                    item["price"] = str(item["price"])
+                results.append({field: item[field] for field in fields})
+
+            response = Response({
+                "results": results,
+                "next_cursor": rows[-1][0] if has_more else None,
+            })
+
+        response["ETag"] = etag
+        if timestamp is not None:
+            response["Last-Modified"] = http_date(timestamp)
+        response["Cache-Control"] = "no-cache"
+        return response
+
+
+class CategoryProductListAPIView(ProductListAPIView):
+    query_serializer_class = CategoryProductListQuerySerializer
+
+    def filter_products(self, products, params, category_id=None):
+        # The path comes from the cached tree, so the subtree is a single
+        # prefix scan on the category path index joined to the products.
+        path = category_tree.get_path(category_id)
+        if path is None:
+            raise Http404("Category not found.")
+        return products.filter(category__path__startswith=path)
+
+    @extend_schema(
+        parameters=[CategoryProductListQuerySerializer],
+        description="Keyset-paginated products of a category and all of its descendants.",
+    )
+    def get(self, request, category_id):
+        return super().get(request, category_id=category_id)
+
+
+class CategoryTreeAPIView(APIView):
+    @extend_schema(responses={200: None}, description="The full category tree, nested by `children`.")
     def get(self, request):
-        products = Product.objects.all()
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        # Already serialized in Redis; sent as-is instead of re-rendering.
+        return HttpResponse(category_tree.get_tree_json(), content_type="application/json")
+
+
+class ProductExportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        responses={200: None},
+        description="Stream the full catalog as NDJSON or CSV, gzipped when the client accepts it.",
+    )
+    def get(self, request, export_format):
+        use_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+        response = StreamingHttpResponse(
+            export.export_chunks(export_format, gzip=use_gzip),
+            content_type=export.CONTENT_TYPES[export_format],
+        )
+        response["Content-Disposition"] = f'attachment; filename="products.{export_format}"'
+        response["Vary"] = "Accept-Encoding"
+        if use_gzip:
+            response["Content-Encoding"] = "gzip"
+        return response